@@ -5,6 +5,7 @@ import os
 import six
 import toolz as tz
 
+from bcbiovm.shared import catalog
 from bcbiovm.shared import retriever as sret
 
 # ## Arvados specific functionality
@@ -73,37 +74,42 @@ def _open_remote(file_ref, config=None):
     cr = arvados.CollectionReader(coll_uuid, api_client=api_client)
     return cr.open(coll_ref)
 
+def _keep_entries(keep_files):
+    """Catalog entries of files within collections, with collection UUIDs and full references.
+    """
+    for keep_full in keep_files:
+        keep_uuid, keep_file = _get_uuid_file(keep_full)
+        yield keep_file, (keep_uuid, keep_full)
+
+def _keep_dir_entries(keep_files):
+    for keep_file, info in _keep_entries(keep_files):
+        yield os.path.dirname(keep_file), info
+
 def _find_file(config, startswith=False):
     """Flexibly search for files in an Arvados collection.
 
     startswith -- searching for directories
     """
     keep_files = _get_remote_files(config)
+    files = catalog.get("arvados", keep_files, _keep_entries)
+    partial = catalog.get("arvados-dirs", keep_files, _keep_dir_entries) if startswith else files
     def get_file(f):
         # exact matches
-        for keep_full in keep_files:
-            keep_uuid, keep_file = _get_uuid_file(keep_full)
-            if keep_file == f:
-                return keep_full
-            elif startswith and keep_file.startswith(f):
-                return "%s:%s/%s" % (KEY, keep_uuid, f)
+        matches = files.startswith(f) if startswith else files.exact(f)
+        if matches:
+            keep_uuid, keep_full = files.values[matches[0]]
+            return keep_full if files.paths[matches[0]] == f else "%s:%s/%s" % (KEY, keep_uuid, f)
         # partial matches, including directories (using startswith)
-        for keep_full in keep_files:
-            keep_uuid, keep_file = _get_uuid_file(keep_full)
-            if startswith:
-                keep_file = os.path.dirname(keep_file)
-            if keep_file.endswith("/%s" % f):
-                return "%s:%s/%s" % (KEY, keep_uuid, keep_file)
+        matches = partial.endswith(f)
+        if matches:
+            keep_uuid, _ = partial.values[matches[0]]
+            return "%s:%s/%s" % (KEY, keep_uuid, partial.paths[matches[0]])
     return get_file
 
 def _list(config):
-    keep_files = _get_remote_files(config)
+    files = catalog.get("paths", _get_remote_files(config))
     def do(d):
-        out = []
-        for keep_full in keep_files:
-            if keep_full.startswith(d):
-                out.append(keep_full)
-        return out
+        return [files.paths[i] for i in files.startswith(d)]
     return do
 
 # ## API: General functionality
@@ -1,10 +1,11 @@
 """Manage installation and updates of bcbio_vm on AWS systems.
 """
+from __future__ import print_function
 import os
 
 import toolz as tz
 
-from bcbiovm.aws import common
+from bcbiovm.aws import common, prewarm
 
 # ## Bootstrap a new instance
 
@@ -45,6 +46,10 @@ def bootstrap(args):
     """
     _bootstrap_baseline(args, common.ANSIBLE_BASE)
     _bootstrap_nfs(args, common.ANSIBLE_BASE)
+    if not getattr(args, "no_prewarm", False):
+        if not prewarm.prewarm(args):
+            print("Could not pre-warm the docker image on all nodes; "
+                  "nodes without it pull the image on first use.")
     _bootstrap_bcbio(args, common.ANSIBLE_BASE)
 
 def _bootstrap_baseline(args, ansible_base):
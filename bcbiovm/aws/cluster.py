@@ -5,7 +5,7 @@ import argparse
 import os
 import sys
 
-from bcbiovm.aws import bootstrap, common
+from bcbiovm.aws import bootstrap, common, prewarm
 
 def setup_cmd(awsparser):
     parser_sub_b = awsparser.add_parser("cluster", help="Run and manage AWS clusters")
@@ -21,8 +21,20 @@ def setup_cmd(awsparser):
                         help="Don't upgrade the cluster host OS and reboot")
     parser.add_argument("-q", "--quiet", dest="verbose", action="store_false", default=True,
                         help="Quiet output when running Ansible playbooks")
+    parser.add_argument("--no-prewarm", default=False, action="store_true",
+                        help="Don't pull the bcbio docker image on all nodes before running")
+    parser.add_argument("--image-cache", help="Shared directory, like /encrypted/docker-images, "
+                        "to load and save the bcbio docker image when pre-warming nodes")
     parser.set_defaults(func=bootstrap_cluster)
 
+    parser = parser_b.add_parser("prewarm",
+                                 help="Pull the bcbio docker image on all cluster nodes "
+                                      "in parallel, verifying the image digest",
+                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser = common.add_default_ec_args(parser)
+    parser = prewarm.add_args(parser)
+    parser.set_defaults(func=prewarm_cluster)
+
     parser = parser_b.add_parser("command",
                                  help="Run a script on the bcbio frontend "
                                       "node inside a screen session",
@@ -51,6 +63,10 @@ def setup_cmd(awsparser):
                         help="Don't upgrade the cluster host OS and reboot")
     parser.add_argument("-q", "--quiet", dest="verbose", action="store_false", default=True,
                         help="Quiet output when running Ansible playbooks")
+    parser.add_argument("--no-prewarm", default=False, action="store_true",
+                        help="Don't pull the bcbio docker image on all nodes before running")
+    parser.add_argument("--image-cache", help="Shared directory, like /encrypted/docker-images, "
+                        "to load and save the bcbio docker image when pre-warming nodes")
     parser.set_defaults(func=start)
 
     parser = parser_b.add_parser("setup", help="Rerun cluster configuration steps",
@@ -72,6 +88,11 @@ def bootstrap_cluster(args):
     """Bootstrap bcbio, or upgrade bcbio on an existing cluster."""
     bootstrap.bootstrap(args)
 
+def prewarm_cluster(args):
+    """Pull the bcbio docker image on all nodes of a cluster."""
+    if not prewarm.prewarm(args):
+        sys.exit(1)
+
 
 # ## Run a remote command
 
@@ -0,0 +1,133 @@
+"""Pre-warm the bcbio docker image on all nodes of a cluster.
+
+Without pre-warming, each compute node pulls the multi-GB image when its first
+task arrives, so scaling out stalls the first wave of tasks while every node
+pulls at once. This pulls a single pinned image digest on all nodes up front,
+with bounded concurrency, verifying the digest and reporting time per node.
+"""
+from __future__ import print_function
+
+import time
+from multiprocessing.pool import ThreadPool
+
+from six.moves import shlex_quote
+
+from bcbiovm.aws import common
+from bcbiovm.docker import imagecache
+
+DEFAULT_IMAGE = "quay.io/bcbio/bcbio-vc"
+
+def add_args(parser):
+    parser.add_argument("--image", default=DEFAULT_IMAGE,
+                        help="Docker image to pre-warm on cluster nodes")
+    parser.add_argument("--digest", help="Image digest to pin (sha256:...). Defaults to the "
+                        "digest the frontend node retrieves for the image")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Maximum number of nodes pulling simultaneously")
+    parser.add_argument("--image-cache", help="Shared directory of docker image tarballs, like the "
+                        "encrypted NFS mount. Nodes load the pinned digest from here instead of pulling.")
+    return parser
+
+def prewarm(args):
+    """Pull the pinned image digest on all cluster nodes, verifying and reporting timing.
+
+    Returns True if all nodes have the image, leaving callers to decide if
+    failures are fatal.
+    """
+    cluster = common.ecluster_config(args.econfig).load_cluster(args.cluster)
+    image = getattr(args, "image", None) or DEFAULT_IMAGE
+    concurrency = getattr(args, "concurrency", None) or 8
+    frontend = cluster.get_frontend_node()
+    nodes = [n for n in cluster.get_all_nodes() if n.name != frontend.name]
+    # Pull on the frontend first to pin the digest all other nodes retrieve
+    digest = getattr(args, "digest", None)
+    cache_dir = getattr(args, "image_cache", None)
+    results = [_prewarm_node(cluster, frontend, image, digest, cache_dir, save=True)]
+    digest = digest or results[0]["digest"]
+    if not results[0]["ok"] or not digest:
+        _report(results)
+        return False
+    if nodes:
+        pool = ThreadPool(min(concurrency, len(nodes)))
+        try:
+            results += pool.map(lambda n: _prewarm_node(cluster, n, image, digest, cache_dir), nodes)
+        finally:
+            pool.close()
+    _report(results)
+    return all(r["ok"] for r in results)
+
+def _image_ref(image, digest):
+    """Reference an image repository by digest, removing any tag.
+    """
+    repo = image.split("@")[0]
+    if ":" in repo.split("/")[-1]:
+        repo = repo.rsplit(":", 1)[0]
+    return "%s@%s" % (repo, digest)
+
+def _prewarm_node(cluster, node, image, digest=None, cache_dir=None, save=False):
+    """Pull and verify the image on a single node, returning status and timing.
+
+    With a shared image cache, load a cached image matching the digest instead of
+    pulling, and save the pulled image to the cache if `save` is set. Failing to
+    save leaves the node usable, so is reported in `cache_error` without failing it.
+    """
+    start = time.time()
+    out = {"node": node.name, "digest": None, "ok": False, "error": None, "source": "registry",
+           "cache_error": None}
+    try:
+        client = node.connect(known_hosts_file=cluster.known_hosts_file)
+        if not client:
+            raise IOError("Could not connect to %s" % node.name)
+        try:
+            if cache_dir and digest and _exec(client, imagecache.load_cmd(cache_dir, image, digest))[0] == 0:
+                out.update({"digest": digest, "ok": True, "source": "cache"})
+            else:
+                out["digest"] = _pull_and_verify(client, image, digest)
+                if cache_dir and save:
+                    status, output = _exec(client, imagecache.save_cmd(cache_dir, image, out["digest"]))
+                    if status != 0:
+                        out["cache_error"] = "image cache save failed: %s" % _last_line(output)
+                out["ok"] = True
+        finally:
+            client.close()
+    except Exception as e:
+        out["error"] = str(e)
+    out["time"] = time.time() - start
+    return out
+
+def _pull_and_verify(client, image, digest=None):
+    """Pull an image on a node, verifying and returning the retrieved digest.
+    """
+    ref = _image_ref(image, digest) if digest else image
+    status, output = _exec(client, "docker pull %s" % ref)
+    if status != 0:
+        raise IOError("docker pull failed: %s" % _last_line(output))
+    _, output = _exec(client, "docker image inspect --format "
+                      "'{{range .RepoDigests}}{{println .}}{{end}}' %s" % ref)
+    digests = [x.split("@")[-1] for x in output.split() if "@" in x]
+    if digest and digest not in digests:
+        raise IOError("Digest mismatch, expected %s found %s" % (digest, ", ".join(digests)))
+    digest = digest or (digests[0] if digests else None)
+    if not digest:
+        raise IOError("No digest found for %s" % ref)
+    # Tag the pinned digest so runs on this node use the verified image
+    status, output = _exec(client, "docker tag %s %s" % (_image_ref(image, digest), image))
+    if status != 0:
+        raise IOError("docker tag failed: %s" % _last_line(output))
+    return digest
+
+def _exec(client, cmd):
+    _, stdout, stderr = client.exec_command("bash -c %s" % shlex_quote(cmd))
+    output = stdout.read().decode(errors="ignore") + stderr.read().decode(errors="ignore")
+    return stdout.channel.recv_exit_status(), output
+
+def _last_line(output):
+    return output.strip().split("\n")[-1]
+
+def _report(results):
+    print("%-30s %10s %9s  %s" % ("node", "time(s)", "source", "status"))
+    for r in sorted(results, key=lambda x: x["time"], reverse=True):
+        status = r["digest"] if r["ok"] else "FAILED: %s" % r["error"]
+        if r.get("cache_error"):
+            status += " (%s)" % r["cache_error"]
+        print("%-30s %10.1f %9s  %s" % (r["node"], r["time"], r["source"], status))
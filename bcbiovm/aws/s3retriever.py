@@ -39,8 +39,7 @@ def _get_remote_files(config):
 def _is_remote(path):
     return path.startswith("%s:/" % KEY)
 
-
-_find_file = gcp_retriever._find_file
+_find_file = functools.partial(gcp_retriever._find_file, remote_files_fn=_get_remote_files)
 
 # ## API: General functionality
 
@@ -5,11 +5,10 @@ import shutil
 import subprocess
 import uuid
 
-import yaml
-
 from bcbio import utils
 from bcbio.provenance import do
-from bcbiovm.ship import pack, reconstitute
+from bcbiovm.shared import serialize
+from bcbiovm.ship import ledger, pack, reconstitute
 
 def runfn(fn_name, queue, wrap_args, parallel, run_args):
     """Run external function submitting to existing queue.
@@ -18,16 +17,20 @@ def runfn(fn_name, queue, wrap_args, parallel, run_args):
     run_id = uuid.uuid4()
     work_dir = os.getcwd()
     script_file = "bcbio-%s-%s-run.sh" % (fn_name, run_id)
-    arg_file = "bcbio-%s-%s-args.json" % (fn_name, run_id)
-    parallel_file = "bcbio-%s-%s-parallel.json" % (fn_name, run_id)
+    # bcbio passes the wrapper_args list built in bcbiovm.clusterk.main
+    fmt = serialize.get_format(parallel=wrap_args[0] if wrap_args else None)
+    ext = serialize.extension(fmt)
+    # Pass the format to bcbio_vm.py runfn through the parallel file
+    parallel = dict(parallel, **{serialize.FORMAT_KEY: fmt})
+    arg_file = "bcbio-%s-%s-args%s" % (fn_name, run_id, ext)
+    parallel_file = "bcbio-%s-%s-parallel%s" % (fn_name, run_id, ext)
     tarball = "bcbio-%s-%s.tar.gz" % (fn_name, run_id)
     out_file = "%s-out%s" % os.path.splitext(arg_file)
-    run_args = pack.send_run(run_args, parallel["pack"])
+    with ledger.context(work_dir, fn_name):
+        run_args = pack.send_run(run_args, parallel["pack"])
     with utils.chdir(work_dir):
-        with open(arg_file, "w") as out_handle:
-            yaml.safe_dump(run_args, out_handle, default_flow_style=False, allow_unicode=False)
-        with open(parallel_file, "w") as out_handle:
-            yaml.safe_dump(parallel, out_handle, default_flow_style=False, allow_unicode=False)
+        serialize.write(run_args, arg_file)
+        serialize.write(parallel, parallel_file)
         with open(script_file, "w") as out_handle:
             out_handle.write(_bootstrap_sh.format(fn_name=fn_name, arg_file=os.path.basename(arg_file),
                                                   parallel_file=os.path.basename(parallel_file)))
@@ -42,8 +45,7 @@ def runfn(fn_name, queue, wrap_args, parallel, run_args):
             for tag in ["fnname=%s" % fn_name]:
                 cmd += ["--tag", tag]
             do.run(cmd, "Submit to clusterk")
-        with open(reconstitute.get_output(out_file, parallel["pack"])) as in_handle:
-            out = yaml.safe_load(in_handle)
+        out = serialize.read(reconstitute.get_output(out_file, parallel["pack"]))
         for f in [script_file, parallel_file, arg_file, tarball, out_file]:
             if os.path.exists(f):
                 os.remove(f)
@@ -2,27 +2,28 @@
 """
 import os
 
-import yaml
-
 from bcbiovm.docker import manage, mounts
+from bcbiovm.shared import serialize
 from bcbiovm.ship import pack
 
 def run(args, docker_config):
     work_dir = os.getcwd()
     parallel = {"type": "clusterk", "queue": args.queue, "cores": args.numcores,
                 "module": "bcbiovm.clusterk", "wrapper": "runfn"}
-    with open(args.sample_config) as in_handle:
-        ready_config, _ = mounts.normalize_config(yaml.safe_load(in_handle), args.fcdir)
+    ready_config, _ = mounts.normalize_config(serialize.read(args.sample_config, "yaml"), args.fcdir)
     ready_config_file = os.path.join(work_dir, "%s-ready%s" %
                                      (os.path.splitext(os.path.basename(args.sample_config))))
-    with open(ready_config_file, "w") as out_handle:
-        yaml.safe_dump(ready_config, out_handle, default_flow_style=False, allow_unicode=False)
-    parallel["pack"] = pack.prep_s3(args.biodata_bucket, args.run_bucket, "runfn_output")
+    serialize.write(ready_config, ready_config_file, "yaml")
+    parallel["pack"] = pack.prep_s3(args.biodata_bucket, args.run_bucket, "runfn_output",
+                                    getattr(args, "content_addressed", False),
+                                    (getattr(args, "bundle_kb", None) or 0) * 1024)
     parallel["wrapper_args"] = [{"sample_config": ready_config_file,
                                  "docker_config": docker_config,
                                  "fcdir": args.fcdir,
                                  "datadir": args.datadir,
-                                 "systemconfig": args.systemconfig}]
+                                 "systemconfig": args.systemconfig,
+                                 "pack": parallel["pack"],
+                                 serialize.FORMAT_KEY: getattr(args, "serialize_format", None)}]
     workdir_mount = "%s:%s" % (work_dir, docker_config["work_dir"])
     manage.run_bcbio_cmd(args.image, [workdir_mount],
                          ["version", "--workdir=%s" % docker_config["work_dir"]])
@@ -1,6 +1,26 @@
 """Re-run individual tasks within multiprocessing framework.
+
+Runs tasks locally inside docker containers, supervising multiple containers
+at once within the cores and memory of the current machine. Concurrent calls
+share the machine's capacity through node-wide accounting in the supervisor.
 """
+from bcbio import utils
 
+@utils.map_wrap
 def runfn(*args):
-    print(args)
-    raise NotImplementedError
+    from bcbiovm.docker import supervisor
+    return supervisor.run_items([_to_docker_item(args)])[0]
+
+def _to_docker_item(args):
+    """Convert Clusterk wrapper arguments into docker runfn wrapper arguments.
+
+    bcbio passes the wrapper_args built in bcbiovm.clusterk.main, then only
+    fresources and checkpointed from the parallel configuration, so the pack
+    configuration travels in the wrapper arguments.
+    """
+    fn_name, wrap_args, parallel = args[:3]
+    dockerconf = wrap_args["docker_config"]
+    cmd_args = {"systemconfig": wrap_args["systemconfig"], "pack": wrap_args["pack"],
+                "image": wrap_args.get("image", dockerconf["image_url"]),
+                "sample_config": wrap_args["sample_config"], "fcdir": wrap_args["fcdir"]}
+    return [fn_name, dockerconf, cmd_args, parallel] + list(args[3:])
@@ -2,12 +2,12 @@
 
 Looks up and fills in sample locations from inputs folders in a DNAnexus project.
 """
-import fnmatch
 import os
 
 import toolz as tz
 
 from bcbio import utils
+from bcbiovm.shared import catalog
 from bcbiovm.shared import retriever as sret
 
 dxpy = utils.LazyImport("dxpy")
@@ -91,13 +91,9 @@ def _find_file(config, startswith=False):
         for fname, (pid, _) in remote_files.items():
             remote_folders[os.path.dirname(fname)] = (pid, None)
         remote_files = remote_folders
-
-    def glob_match(f1, f2):
-        """Check for wildcard glob style matches.
-        """
-        if f1.find("*") >= 0:
-            if fnmatch.fnmatch(f2, "*/%s" % f1):
-                return True
+        files = catalog.Catalog(remote_files.items())
+    else:
+        files = catalog.get("dnanexus", remote_files, lambda xs: xs.items())
 
     def get_file(f):
         if _is_remote(f):
@@ -115,10 +111,14 @@ def _find_file(config, startswith=False):
                     pid, fid = remote_files[folder_f]
                     return "%s:%s/%s:%s" % (KEY, fid, pid, folder_f)
         # find any files nested in sub folders or as globs
+        matches = set(files.endswith(f))
+        if f.find("*") >= 0:
+            matches |= set(files.glob(f))
         out = []
         for project, folder in _remote_folders(config):
-            for rfname, (pid, rid) in remote_files.items():
-                if rfname.startswith(folder + "/") and (rfname.endswith("/" + f) or glob_match(f, rfname)):
+            for i in sorted(matches):
+                rfname, (pid, rid) = files.paths[i], files.values[i]
+                if rfname.startswith(folder + "/"):
                     out.append("%s:%s/%s:%s" % (KEY, rid, pid, rfname))
         if len(out) == 1:
             return out[0]
@@ -126,15 +126,20 @@ def _find_file(config, startswith=False):
             return out
     return get_file
 
+def _project_entries(remote_files):
+    """Catalog entries of files prefixed by project, as used in references.
+    """
+    for fname, (pid, fid) in remote_files.items():
+        yield "%s:%s" % (pid, fname), (pid, fid, fname)
+
 def _list(config):
-    remote_files = _get_remote_files(config)
+    files = catalog.get("dnanexus-projects", _get_remote_files(config), _project_entries)
 
     def do(d):
         out = []
-        dfname = _get_id_fname(d)[-1]
-        for fname, (pid, fid) in remote_files.items():
-            if ("%s:%s" % (pid, fname)).startswith(dfname):
-                out.append("%s:%s/%s:%s" % (KEY, fid, pid, fname))
+        for i in files.startswith(_get_id_fname(d)[-1]):
+            pid, fid, fname = files.values[i]
+            out.append("%s:%s/%s:%s" % (KEY, fid, pid, fname))
         return out
     return do
 
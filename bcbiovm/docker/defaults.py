@@ -11,6 +11,12 @@ from bcbiovm.aws import config as awsconfig
 
 TOSAVE_DEFAULTS = {"datadir": None}
 
+# default information about docker container
+DOCKER = {"port": 8085,
+          "biodata_dir": "/usr/local/share/bcbio-nextgen",
+          "work_dir": "/mnt/work",
+          "image_url": "quay.io/bcbio/bcbio-vc"}
+
 def update_check_args(args, command_info, need_datadir=True):
     args = add_defaults(args)
     args = _handle_remotes(args)
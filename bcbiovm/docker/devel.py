@@ -9,7 +9,6 @@ import os
 import shutil
 import subprocess
 
-import numpy
 import yaml
 
 from bcbio import utils
@@ -21,10 +20,7 @@ from bcbiovm.aws import common
 from bcbiovm.docker import defaults, install, manage, mounts
 
 # default information about docker container
-DOCKER = {"port": 8085,
-          "biodata_dir": "/usr/local/share/bcbio-nextgen",
-          "work_dir": "/mnt/work",
-          "image_url": "quay.io/bcbio/bcbio-vc"}
+DOCKER = defaults.DOCKER
 
 # Available genomes and indexes
 SUPPORTED_GENOMES = ["GRCh37", "hg19", "hg38", "hg38-noalt", "mm10", "mm9",
@@ -193,6 +189,7 @@ def _get_cur_mem(key, val):
 def _calculate_common_memory(kvs):
     """Get the median memory specification, in megabytes.
     """
+    import numpy
     mems = []
     for key, val in kvs:
         cur_val, _ = _get_cur_mem(key, val)
@@ -0,0 +1,280 @@
+"""Minimal client for the Docker Engine API over the local unix socket.
+
+Talks directly to the docker daemon to avoid spawning `docker` command line
+processes for frequent operations. Callers fall back to the command line
+client when the socket is not available, for instance with a remote DOCKER_HOST.
+"""
+import collections
+import json
+import os
+import socket
+import struct
+
+from six.moves import http_client
+from six.moves.urllib.parse import quote, urlencode
+
+from bcbiovm.shared import trace
+
+DEFAULT_SOCKET = "/var/run/docker.sock"
+
+class EngineError(Exception):
+    """Error response from the Docker Engine API.
+    """
+    def __init__(self, status, message):
+        Exception.__init__(self, "Docker engine error %s: %s" % (status, message))
+        self.status = status
+        self.message = message
+
+class _UnixHTTPConnection(http_client.HTTPConnection):
+    """HTTP connection made over a unix domain socket.
+    """
+    def __init__(self, socket_path, timeout=None):
+        http_client.HTTPConnection.__init__(self, "localhost")
+        self.socket_path = socket_path
+        self.sock_timeout = timeout
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.sock_timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+def socket_path():
+    """Retrieve the engine socket, respecting unix:// DOCKER_HOST specifications.
+    """
+    docker_host = os.environ.get("DOCKER_HOST")
+    if docker_host:
+        if docker_host.startswith("unix://"):
+            return docker_host[len("unix://"):]
+        else:
+            return None
+    return DEFAULT_SOCKET
+
+def is_available():
+    """Check if we can talk to the engine directly through a local socket.
+    """
+    sock = socket_path()
+    return bool(sock and os.path.exists(sock) and os.access(sock, os.R_OK | os.W_OK))
+
+def connect(timeout=None):
+    return _UnixHTTPConnection(socket_path(), timeout)
+
+def _send(conn, method, path, params=None, body=None):
+    if params:
+        path = "%s?%s" % (path, urlencode(params))
+    headers = {}
+    if body is not None:
+        body = json.dumps(body)
+        headers["Content-Type"] = "application/json"
+    conn.request(method, path, body=body, headers=headers)
+    return conn.getresponse()
+
+def request(method, path, params=None, body=None, timeout=60):
+    """Make a request to the engine, returning the status and decoded JSON response.
+    """
+    conn = connect(timeout)
+    try:
+        response = _send(conn, method, path, params, body)
+        data = response.read()
+    finally:
+        conn.close()
+    data = data.decode(errors="ignore") if data else ""
+    try:
+        data = json.loads(data) if data else None
+    except ValueError:
+        pass
+    return response.status, data
+
+def _error_message(data):
+    return data.get("message", data) if isinstance(data, dict) else data
+
+def inspect_image(image):
+    """Retrieve details for an image name, tag or digest. Returns None if not present locally.
+    """
+    status, data = request("GET", "/images/%s/json" % quote(image, safe="/:@"))
+    if status == 404:
+        return None
+    elif status >= 400:
+        raise EngineError(status, _error_message(data))
+    return data
+
+def list_images(reference):
+    """List IDs of local images matching a reference, like a repository with any tag.
+    """
+    params = {"filters": json.dumps({"reference": [reference]})}
+    return [x["Id"] for x in _check(*request("GET", "/images/json", params=params))]
+
+# ## Containers
+
+ContainerResult = collections.namedtuple("ContainerResult", ["cid", "exit_code", "error", "output"])
+
+def _check(status, data, expected=(200, 201, 204, 304)):
+    if status not in expected:
+        raise EngineError(status, _error_message(data))
+    return data
+
+def _port_config(ports):
+    """Convert docker-style host:container port specifications into API configuration.
+    """
+    exposed, bindings = {}, {}
+    for p in ports or []:
+        host_port, container_port = p.rsplit(":", 1) if ":" in p else (p, p)
+        container_port = container_port if "/" in container_port else "%s/tcp" % container_port
+        exposed[container_port] = {}
+        bindings.setdefault(container_port, []).append({"HostPort": host_port})
+    return exposed, bindings
+
+def _limits_config(limits):
+    """Convert container resource limits, from bcbiovm.docker.limits, into API configuration.
+    """
+    out = {}
+    if limits.get("cpus"):
+        out["NanoCpus"] = int(limits["cpus"] * 1e9)
+    if limits.get("memory"):
+        out["Memory"] = limits["memory"]
+        out["MemorySwap"] = limits.get("memory_swap", limits["memory"])
+    if limits.get("cpuset_cpus"):
+        out["CpusetCpus"] = limits["cpuset_cpus"]
+    if limits.get("cpuset_mems"):
+        out["CpusetMems"] = limits["cpuset_mems"]
+    if limits.get("blkio_weight"):
+        out["BlkioWeight"] = limits["blkio_weight"]
+    return out
+
+def create_container(image, cmd, binds=None, env=None, ports=None, privileged=False,
+                     network_mode="host", user=None, limits=None, labels=None, auto_remove=False):
+    exposed, bindings = _port_config(ports)
+    config = {"Image": image, "Cmd": cmd, "Env": env or [],
+              "OpenStdin": True, "AttachStdout": True, "AttachStderr": True,
+              "ExposedPorts": exposed,
+              "HostConfig": {"Binds": binds or [], "Privileged": privileged,
+                             "NetworkMode": network_mode, "PortBindings": bindings}}
+    config["HostConfig"].update(_limits_config(limits or {}))
+    if auto_remove:
+        config["HostConfig"]["AutoRemove"] = True
+    if labels:
+        config["Labels"] = labels
+    if user:
+        config["User"] = user
+    return _check(*request("POST", "/containers/create", body=config))["Id"]
+
+def start_container(cid):
+    _check(*request("POST", "/containers/%s/start" % cid))
+
+def inspect_container(cid):
+    """Retrieve details for a container, or None if it does not exist.
+    """
+    status, data = request("GET", "/containers/%s/json" % cid)
+    if status == 404:
+        return None
+    return _check(status, data)
+
+def list_containers(labels=None):
+    """List IDs of containers, including stopped ones, matching key=value labels.
+    """
+    params = {"all": 1}
+    if labels:
+        params["filters"] = json.dumps({"label": ["%s=%s" % (k, v) for k, v in labels.items()]})
+    return [c["Id"] for c in _check(*request("GET", "/containers/json", params=params))]
+
+def wait_container(cid):
+    """Wait for a container to finish, returning the exit code.
+    """
+    return _check(*request("POST", "/containers/%s/wait" % cid, timeout=None))["StatusCode"]
+
+def remove_container(cid):
+    _check(*request("DELETE", "/containers/%s" % cid, params={"force": 1, "v": 1}),
+           expected=(204, 404))
+
+def container_logs(cid, follow=True):
+    """Stream output lines from a container.
+    """
+    return _stream_lines("GET", "/containers/%s/logs" % cid,
+                         params={"follow": int(follow), "stdout": 1, "stderr": 1})
+
+def _stream_lines(method, path, params=None, body=None):
+    """Stream output lines from an engine endpoint.
+
+    Handles the multiplexed stdout/stderr framing used for containers without a TTY.
+    """
+    conn = connect(None)
+    try:
+        response = _send(conn, method, path, params, body)
+        if response.status != 200:
+            data = response.read().decode(errors="ignore")
+            raise EngineError(response.status, data)
+        buf = b""
+        while True:
+            header = response.read(8)
+            if len(header) < 8:
+                break
+            _, size = struct.unpack(">BxxxL", header)
+            buf += response.read(size)
+            while b"\n" in buf:
+                line, buf = buf.split(b"\n", 1)
+                yield line.decode(errors="ignore")
+        if buf:
+            yield buf.decode(errors="ignore")
+    finally:
+        conn.close()
+
+def run_container(image, cmd, binds=None, env=None, ports=None, privileged=False,
+                  network_mode="host", user=None, log_fn=None, limits=None, labels=None):
+    """Create and start a container, streaming logs until finished and then removing it.
+
+    Returns a ContainerResult with the exit code, or the error message if the
+    engine reported a problem, along with the last lines of output. The container
+    is killed and removed if interrupted.
+    """
+    cid = None
+    output = collections.deque(maxlen=100)
+    try:
+        with trace.span("docker.create"):
+            cid = create_container(image, cmd, binds, env, ports, privileged, network_mode, user,
+                                   limits, labels)
+            start_container(cid)
+        with trace.span("docker.attach", container=cid):
+            for line in container_logs(cid):
+                output.append(line)
+                if log_fn:
+                    log_fn(line)
+            exit_code = wait_container(cid)
+        return ContainerResult(cid, exit_code, None, list(output))
+    except (EngineError, EnvironmentError) as e:
+        return ContainerResult(cid, None, str(e), list(output))
+    finally:
+        if cid:
+            with trace.span("docker.kill_rm", container=cid):
+                try:
+                    remove_container(cid)
+                except (EngineError, EnvironmentError):
+                    pass
+
+def exec_run(cid, cmd, user=None, env=None, workdir=None, log_fn=None):
+    """Run a command inside an existing container, streaming output until finished.
+
+    Returns a ContainerResult for the exec, with errors reported in `error`. As
+    with run_container, the container ID is None if the exec was never created, so
+    the command did not run.
+    """
+    output = collections.deque(maxlen=100)
+    config = {"Cmd": cmd, "Env": env or [], "AttachStdout": True, "AttachStderr": True}
+    if user:
+        config["User"] = user
+    if workdir:
+        config["WorkingDir"] = workdir
+    try:
+        exec_id = _check(*request("POST", "/containers/%s/exec" % cid, body=config))["Id"]
+    except (EngineError, EnvironmentError) as e:
+        return ContainerResult(None, None, str(e), [])
+    try:
+        with trace.span("docker.exec", container=cid):
+            for line in _stream_lines("POST", "/exec/%s/start" % exec_id,
+                                      body={"Detach": False, "Tty": False}):
+                output.append(line)
+                if log_fn:
+                    log_fn(line)
+        exit_code = _check(*request("GET", "/exec/%s/json" % exec_id))["ExitCode"]
+        return ContainerResult(cid, exit_code, None, list(output))
+    except (EngineError, EnvironmentError) as e:
+        return ContainerResult(cid, None, str(e), list(output))
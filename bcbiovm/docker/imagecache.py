@@ -0,0 +1,196 @@
+"""Cache docker images as compressed tarballs in a shared directory, keyed by digest.
+
+Pulling multi-GB images from the registry on every node is slow when a shared
+filesystem, like the encrypted NFS mount on AWS clusters, is much faster. The
+first install saves the image with `docker save` compressed by pigz, and later
+installs on any node `docker load` it when the registry digest matches.
+
+Each cached image has a `<digest>.tar.gz` tarball plus a `<digest>.id` file with
+the image ID, used to verify loaded images.
+"""
+from __future__ import print_function
+import os
+import re
+import socket
+import subprocess
+
+from six.moves import shlex_quote
+
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
+
+DEFAULT_REGISTRY = "registry-1.docker.io"
+_MANIFEST_TYPES = ["application/vnd.docker.distribution.manifest.list.v2+json",
+                   "application/vnd.docker.distribution.manifest.v2+json",
+                   "application/vnd.oci.image.index.v1+json",
+                   "application/vnd.oci.image.manifest.v1+json"]
+
+def _cache_base(cache_dir, digest):
+    return os.path.join(cache_dir, digest.replace(":", "-"))
+
+def cache_file(cache_dir, digest):
+    return _cache_base(cache_dir, digest) + ".tar.gz"
+
+def _id_file(cache_dir, digest):
+    return _cache_base(cache_dir, digest) + ".id"
+
+def is_cached(cache_dir, digest):
+    return os.path.exists(cache_file(cache_dir, digest)) and os.path.exists(_id_file(cache_dir, digest))
+
+def _compress_prog():
+    return "pigz" if which("pigz") else "gzip"
+
+def split_image(image):
+    """Split an image name into registry, repository, and tag or digest reference.
+    """
+    name, ref = image, "latest"
+    if "@" in name:
+        name, ref = name.split("@", 1)
+    elif ":" in name.split("/")[-1]:
+        name, ref = name.rsplit(":", 1)
+    parts = name.split("/")
+    if len(parts) > 1 and ("." in parts[0] or ":" in parts[0] or parts[0] == "localhost"):
+        registry, repo = parts[0], "/".join(parts[1:])
+    else:
+        registry, repo = DEFAULT_REGISTRY, name if len(parts) > 1 else "library/%s" % name
+    return registry, repo, ref
+
+def _save_ref(image):
+    """Reference a single image to save, since `docker save` of an untagged repository exports every tag.
+    """
+    if "@" in image or ":" in image.split("/")[-1]:
+        return image
+    return "%s:latest" % image
+
+def remote_digest(image, timeout=30):
+    """Retrieve the digest the registry currently provides for an image, or None if unavailable.
+    """
+    import requests
+    registry, repo, ref = split_image(image)
+    if ref.startswith("sha256:"):
+        return ref
+    url = "https://%s/v2/%s/manifests/%s" % (registry, repo, ref)
+    headers = {"Accept": ", ".join(_MANIFEST_TYPES)}
+    try:
+        r = requests.head(url, headers=headers, timeout=timeout)
+        if r.status_code == 401:
+            token = _get_token(r.headers.get("WWW-Authenticate", ""), timeout)
+            if token:
+                headers["Authorization"] = "Bearer %s" % token
+                r = requests.head(url, headers=headers, timeout=timeout)
+        if r.status_code == 200:
+            return r.headers.get("Docker-Content-Digest")
+    except requests.exceptions.RequestException:
+        pass
+    return None
+
+def _get_token(auth_header, timeout):
+    """Retrieve an anonymous bearer token for registries requiring one, like Docker Hub.
+    """
+    import requests
+    params = dict(re.findall(r'(\w+)="([^"]*)"', auth_header))
+    realm = params.pop("realm", None)
+    if not realm:
+        return None
+    r = requests.get(realm, params=params, timeout=timeout)
+    if r.status_code == 200:
+        return r.json().get("token") or r.json().get("access_token")
+    return None
+
+def load(cache_dir, image, digest):
+    """Load an image from the cache, tagging it with the image name. Returns True on success.
+    """
+    if not is_cached(cache_dir, digest):
+        return False
+    print("Loading docker image %s from %s" % (image, cache_file(cache_dir, digest)))
+    cmd = "set -o pipefail; %s -dc %s | docker load" % (_compress_prog(), shlex_quote(cache_file(cache_dir, digest)))
+    if subprocess.call(cmd, shell=True, executable="/bin/bash", stdout=subprocess.DEVNULL) != 0:
+        return False
+    with open(_id_file(cache_dir, digest)) as in_handle:
+        image_id = in_handle.read().strip()
+    if _image_id(image_id) != image_id:
+        print("Cached docker image %s did not load the expected image %s" % (digest, image_id))
+        return False
+    return subprocess.call(["docker", "tag", image_id, image]) == 0
+
+def save(cache_dir, image, digest):
+    """Save a local image to the cache under its digest, if not already present.
+
+    Writes to a temporary file per host and process then renames into place, so
+    concurrent saves from multiple nodes do not produce partial tarballs.
+    """
+    if is_cached(cache_dir, digest):
+        return cache_file(cache_dir, digest)
+    image = _save_ref(image)
+    image_id = _image_id(image)
+    if not image_id:
+        return None
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    out_file = cache_file(cache_dir, digest)
+    tx_suffix = ".%s-%s.tmp" % (socket.gethostname(), os.getpid())
+    print("Saving docker image %s to %s" % (image, out_file))
+    try:
+        subprocess.check_call("set -o pipefail; docker save %s | %s -c > %s" %
+                              (shlex_quote(image), _compress_prog(), shlex_quote(out_file + tx_suffix)),
+                              shell=True, executable="/bin/bash")
+        with open(_id_file(cache_dir, digest) + tx_suffix, "w") as out_handle:
+            out_handle.write(image_id)
+        os.rename(out_file + tx_suffix, out_file)
+        os.rename(_id_file(cache_dir, digest) + tx_suffix, _id_file(cache_dir, digest))
+    finally:
+        for f in [out_file + tx_suffix, _id_file(cache_dir, digest) + tx_suffix]:
+            if os.path.exists(f):
+                os.remove(f)
+    return out_file
+
+def local_digest(image):
+    """Retrieve the registry digest of a local image, from its pull information.
+    """
+    _, repo, _ = split_image(image)
+    try:
+        out = subprocess.check_output(["docker", "image", "inspect", "--format",
+                                       "{{range .RepoDigests}}{{println .}}{{end}}", image],
+                                      stderr=subprocess.STDOUT).decode()
+    except subprocess.CalledProcessError:
+        return None
+    digests = [x.strip().split("@") for x in out.split("\n") if "@" in x]
+    for name, digest in digests:
+        if name.endswith(repo.replace("library/", "")):
+            return digest
+    return digests[0][1] if digests else None
+
+def _image_id(image):
+    try:
+        return subprocess.check_output(["docker", "image", "inspect", "--format", "{{.Id}}", image],
+                                       stderr=subprocess.STDOUT).decode().strip()
+    except subprocess.CalledProcessError:
+        return None
+
+def load_cmd(cache_dir, image, digest):
+    """Shell command to load and verify an image from the cache on a remote node.
+    """
+    tarball, id_file, image = [shlex_quote(x) for x in
+                               [cache_file(cache_dir, digest), _id_file(cache_dir, digest), image]]
+    return ("set -o pipefail; test -f {tarball} && test -f {id_file} && "
+            "$(command -v pigz || echo gzip) -dc {tarball} | docker load > /dev/null && "
+            "test \"$(docker image inspect --format '{{{{.Id}}}}' \"$(cat {id_file})\")\" = \"$(cat {id_file})\" && "
+            "docker tag \"$(cat {id_file})\" {image}").format(**locals())
+
+def save_cmd(cache_dir, image, digest):
+    """Shell command to save an image into the cache from a remote node, if not present.
+
+    Exits with the status of saving, after removing any partial temporary files.
+    """
+    tarball, id_file, cache_dir, image = [shlex_quote(x) for x in
+                                          [cache_file(cache_dir, digest), _id_file(cache_dir, digest),
+                                           cache_dir, _save_ref(image)]]
+    # Temporary files per shell process, with the process ID outside of quoting so it expands
+    tx_tarball, tx_id_file = [x + '."$$".tmp' for x in [tarball, id_file]]
+    return ("set -o pipefail; if test -f {tarball} && test -f {id_file}; then exit 0; fi; "
+            "mkdir -p {cache_dir} && docker save {image} | $(command -v pigz || echo gzip) -c > {tx_tarball} && "
+            "docker image inspect --format '{{{{.Id}}}}' {image} > {tx_id_file} && "
+            "mv {tx_tarball} {tarball} && mv {tx_id_file} {id_file}; "
+            "status=$?; rm -f {tx_tarball} {tx_id_file}; exit $status").format(**locals())
@@ -5,12 +5,17 @@ from __future__ import print_function
 import os
 import subprocess
 import sys
+import time
 
 import yaml
 
-from bcbiovm.docker import manage, mounts
+from bcbiovm.docker import engine, imagecache, manage, mounts
+from bcbiovm.shared import nodestate
 
 DEFAULT_IMAGE = "quay.io/bcbio/bcbio-vc"
+# Seconds to trust a previous lookup of a local docker image. Lookups are cached
+# in a node-local file so concurrent runfn processes share a single check.
+IMAGE_CACHE_TTL = int(os.environ.get("BCBIO_DOCKER_IMAGE_CACHE_TTL", 300))
 
 def full(args, dockerconf):
     """Full installaction of docker image and data.
@@ -81,10 +86,21 @@ def upgrade_bcbio_vm():
 
 def pull(args, dockerconf):
     """Pull down latest docker image.
+
+    With an image cache directory, load the image from a cached tarball matching
+    the registry digest if present, otherwise pull and save it to the cache.
     """
     print("Retrieving bcbio-nextgen docker image with code and tools")
     assert args.image, "Unspecified image name for docker import"
-    subprocess.check_call(["docker", "pull", args.image])
+    cache_dir = getattr(args, "image_cache", None)
+    digest = imagecache.remote_digest(args.image) if cache_dir else None
+    if not (digest and imagecache.load(cache_dir, args.image, digest)):
+        subprocess.check_call(["docker", "pull", args.image])
+        if cache_dir:
+            digest = imagecache.local_digest(args.image)
+            if digest:
+                imagecache.save(cache_dir, args.image, digest)
+    _image_cache_remove(args.image)
 
 def _save_install_defaults(args):
     """Save arguments passed to installation to be used on subsequent upgrades.
@@ -139,19 +155,74 @@ def add_install_defaults(args):
 
 def _check_docker_image(args, raise_error=True):
     """Ensure docker image exists.
+
+    Uses recently cached lookups when available, otherwise inspects the image
+    through the docker engine. The lookup happens under a node-local lock so
+    simultaneously starting processes wait for and reuse a single check.
     """
-    a_tag = None
-    a_image = args.image
-    if ":" in a_image:
-        (a_image,a_tag) = a_image.split(":")
-    for image in subprocess.check_output(["docker", "images"]).decode(errors="ignore").split("\n"):
-        parts = image.split()
-        if len(parts) > 1 and parts[0] == a_image:
-            if not a_tag or a_tag and parts[1] == a_tag:
-                return True
+    if _image_cache_get(args.image):
+        return True
+    with nodestate.lock(IMAGE_CACHE):
+        if _image_cache_get(args.image):
+            return True
+        image_id = _inspect_docker_image(args.image)
+        if image_id:
+            _image_cache_set(args.image, image_id)
+            return True
     if raise_error:
         raise ValueError("Could not find docker image %s in local repository" % args.image)
 
+def _inspect_docker_image(image):
+    """Retrieve the ID of a local image, or None if not present.
+
+    Image names without a tag or digest match any local tag of the repository.
+    Talks to the engine socket directly, falling back to the docker command line.
+    """
+    tagged = _is_tagged(image)
+    if engine.is_available():
+        try:
+            if tagged:
+                info = engine.inspect_image(image)
+                return info["Id"] if info else None
+            else:
+                return (engine.list_images(image) or [None])[0]
+        except (engine.EngineError, EnvironmentError):
+            pass
+    cmd = (["docker", "image", "inspect", "--format", "{{.Id}}", image] if tagged
+           else ["docker", "images", "--quiet", "--no-trunc", image])
+    try:
+        with open(os.devnull, "w") as devnull:
+            out = subprocess.check_output(cmd, stderr=devnull)
+        return (out.decode(errors="ignore").split() or [None])[0]
+    except subprocess.CalledProcessError:
+        return None
+
+def _is_tagged(image):
+    """Check if an image name includes a tag or digest, ignoring any registry port.
+    """
+    return "@" in image or ":" in image.split("/")[-1]
+
+# ## Node-local cache of docker image lookups
+
+IMAGE_CACHE = "docker-images"
+
+def _image_cache_get(image):
+    cur = nodestate.read(IMAGE_CACHE).get(image)
+    if cur and time.time() - cur["time"] < IMAGE_CACHE_TTL:
+        return cur["id"]
+
+def _image_cache_set(image, image_id):
+    cache = nodestate.read(IMAGE_CACHE)
+    cache[image] = {"id": image_id, "time": time.time()}
+    nodestate.write(IMAGE_CACHE, cache)
+
+def _image_cache_remove(image):
+    with nodestate.lock(IMAGE_CACHE):
+        cache = nodestate.read(IMAGE_CACHE)
+        if image in cache:
+            del cache[image]
+            nodestate.write(IMAGE_CACHE, cache)
+
 def docker_image_arg(args):
     if not hasattr(args, "image") or not args.image:
         default_args = _get_install_defaults(args)
@@ -0,0 +1,174 @@
+"""Resource limits for containers running bcbio functions, enforced with cgroups.
+
+Several runfn containers commonly share a node, so without limits a
+multithreaded aligner in one container starves the others and a memory heavy
+step can trigger the host OOM killer. Limits derive from the cores and memory
+bcbio schedules for each job in the parallel configuration:
+
+  cores_per_job (or cores)  -> CPU quota
+  mem (GB per job)          -> memory limit, plus 10% for JVM and process overhead
+
+bcbio's runners pass wrappers only part of the parallel configuration, so
+`job_parallel` also retrieves cores and memory bcbio records in the sample
+configuration of each job.
+
+Optional settings, in the parallel configuration or environment:
+
+  BCBIO_DOCKER_MEMORY_SWAP=1.0        swap allowed beyond the memory limit, as a
+                                      fraction of the limit (-1 for unlimited), so
+                                      transient overshoots slow down rather than
+                                      trigger an OOM kill
+  cpuset / BCBIO_DOCKER_CPUSET=1      pin each container to dedicated CPUs, kept on
+                                      a single NUMA node when enough CPUs are free
+  blkio_weights / BCBIO_DOCKER_BLKIO_WEIGHTS=io=800,default=300
+                                      block I/O weight (10-1000) by function name
+                                      or function class
+  BCBIO_DOCKER_LIMITS=0               disable container limits
+"""
+import contextlib
+import glob
+import os
+import uuid
+
+from bcbiovm.shared import nodestate
+
+# Functions dominated by reading and writing large files
+FN_CLASSES = {"io": set(["prep_align_inputs", "process_alignment", "merge_split_alignments",
+                         "delayed_bam_merge", "postprocess_alignment", "prepare_sample",
+                         "trim_sample", "combine_bam", "prep_samples", "disambiguate_split"])}
+MEMORY_OVERHEAD = 0.1
+CPUSET_STATE = "cpusets"
+JOB_KEYS = ["cores_per_job", "cores", "mem", "cpuset", "blkio_weights"]
+
+def job_parallel(parallel, fn_args):
+    """Retrieve parallel configuration for a job, adding cores and memory from sample configurations.
+
+    IPython runs record the full parallel configuration in each sample
+    configuration, and multiprocessing runs the number of cores. Values in
+    parallel take precedence.
+    """
+    out = dict(parallel)
+    config = (_find_data(fn_args) or {}).get("config") or {}
+    for k, v in (config.get("parallel") or {}).items():
+        if k in JOB_KEYS and not out.get(k):
+            out[k] = v
+    if not out.get("cores_per_job") and not out.get("cores"):
+        cores = (config.get("algorithm") or {}).get("num_cores")
+        if cores:
+            out["cores_per_job"] = cores
+    return out
+
+def _find_data(fn_args):
+    for arg in fn_args:
+        if isinstance(arg, dict) and "config" in arg:
+            return arg
+        elif isinstance(arg, (list, tuple)) and arg and isinstance(arg[0], dict) and "config" in arg[0]:
+            return arg[0]
+
+def from_parallel(fn_name, parallel):
+    """Retrieve container limits for running a function with the given parallel configuration.
+    """
+    if os.environ.get("BCBIO_DOCKER_LIMITS", "1").lower() in ["0", "false", "no"]:
+        return {}
+    out = {}
+    cores = parallel.get("cores_per_job") or parallel.get("cores")
+    if cores:
+        out["cpus"] = min(float(cores), float(os.cpu_count() or cores))
+    mem = parallel.get("mem")
+    if mem:
+        out["memory"] = int(float(mem) * (1.0 + MEMORY_OVERHEAD) * 1024 * 1024 * 1024)
+        swap = float(os.environ.get("BCBIO_DOCKER_MEMORY_SWAP", 1.0))
+        out["memory_swap"] = -1 if swap < 0 else int(out["memory"] * (1.0 + swap))
+    weight = _blkio_weight(fn_name, parallel)
+    if weight:
+        out["blkio_weight"] = weight
+    cpuset = parallel.get("cpuset", os.environ.get("BCBIO_DOCKER_CPUSET", ""))
+    if cores and str(cpuset).lower() in ["1", "true"]:
+        out["cpuset_cores"] = int(cores)
+    return out
+
+def fn_class(fn_name):
+    for name, fns in FN_CLASSES.items():
+        if fn_name in fns:
+            return name
+    return "default"
+
+def _blkio_weight(fn_name, parallel):
+    weights = parallel.get("blkio_weights")
+    if not weights and os.environ.get("BCBIO_DOCKER_BLKIO_WEIGHTS"):
+        weights = dict(x.split("=") for x in os.environ["BCBIO_DOCKER_BLKIO_WEIGHTS"].split(","))
+    if not weights:
+        return None
+    weight = weights.get(fn_name, weights.get(fn_class(fn_name), weights.get("default")))
+    return min(1000, max(10, int(weight))) if weight else None
+
+# ## CPU and NUMA node pinning
+
+@contextlib.contextmanager
+def allocate(limits):
+    """Reserve dedicated CPUs for a container while it runs, if pinning is requested.
+
+    Reservations are shared between processes on the node, preferring CPUs from a
+    single NUMA node. Yields limits with `cpuset_cpus` and `cpuset_mems` set.
+    """
+    if not limits.get("cpuset_cores"):
+        yield limits
+        return
+    key = "%s-%s" % (os.getpid(), uuid.uuid4())
+    with nodestate.lock(CPUSET_STATE):
+        state = nodestate.active(nodestate.read(CPUSET_STATE))
+        used = set(c for info in state.values() for c in info["cpus"])
+        cpus, mems = _choose_cpus(limits["cpuset_cores"], used)
+        if cpus:
+            state[key] = {"cpus": cpus}
+        nodestate.write(CPUSET_STATE, state)
+    out = dict(limits)
+    del out["cpuset_cores"]
+    if cpus:
+        out["cpuset_cpus"] = ",".join(str(c) for c in cpus)
+        if mems is not None:
+            out["cpuset_mems"] = str(mems)
+    try:
+        yield out
+    finally:
+        if cpus:
+            with nodestate.lock(CPUSET_STATE):
+                state = nodestate.read(CPUSET_STATE)
+                state.pop(key, None)
+                nodestate.write(CPUSET_STATE, state)
+
+def _choose_cpus(num, used):
+    """Choose free CPUs, from a single NUMA node if possible. Returns CPUs and the NUMA node.
+    """
+    nodes = _numa_nodes()
+    for node, cpus in sorted(nodes.items(), key=lambda x: len([c for c in x[1] if c not in used])):
+        free = [c for c in cpus if c not in used]
+        if len(free) >= num:
+            return free[:num], node
+    free = [c for c in sorted(c for cpus in nodes.values() for c in cpus) if c not in used]
+    if len(free) >= num:
+        return free[:num], None
+    return None, None
+
+def _numa_nodes():
+    """Retrieve CPUs available to us, grouped by NUMA node.
+    """
+    available = set(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None
+    nodes = {}
+    for node_dir in glob.glob("/sys/devices/system/node/node[0-9]*"):
+        with open(os.path.join(node_dir, "cpulist")) as in_handle:
+            cpus = _parse_cpulist(in_handle.read().strip())
+        nodes[int(os.path.basename(node_dir)[4:])] = [c for c in cpus if available is None or c in available]
+    if not nodes:
+        nodes[0] = sorted(available) if available else list(range(os.cpu_count() or 1))
+    return nodes
+
+def _parse_cpulist(cpulist):
+    out = []
+    for part in cpulist.split(","):
+        if "-" in part:
+            start, end = part.split("-")
+            out.extend(range(int(start), int(end) + 1))
+        elif part:
+            out.append(int(part))
+    return out
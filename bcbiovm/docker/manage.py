@@ -1,6 +1,7 @@
 """Manage stopping and starting a docker container for running analysis.
 """
 from __future__ import print_function
+import contextlib
 from functools import reduce
 import grp
 import operator
@@ -8,49 +9,162 @@ import os
 import platform
 import pwd
 import subprocess
+import threading
 
 from bcbio.log import logger
 from bcbio.provenance import do
+from bcbiovm.docker import engine, pool, usermap
+from bcbiovm.docker import limits as container_limits
+from bcbiovm.shared import trace
 
-def run_bcbio_cmd(image, mounts, bcbio_nextgen_args, ports=None):
+_context = threading.local()
+
+@contextlib.contextmanager
+def run_context(labels=None, log_prefix=""):
+    """Label containers started by this thread and prefix their log output.
+
+    Used by the multi-container supervisor to identify containers to remove on
+    cancellation and to distinguish interleaved logs. Labelled runs always start
+    their own containers rather than using the pool.
+    """
+    _context.labels, _context.log_prefix = labels, log_prefix
+    try:
+        yield
+    finally:
+        _context.labels, _context.log_prefix = None, ""
+
+def run_bcbio_cmd(image, mounts, bcbio_nextgen_args, ports=None, pooled=False, limits=None):
     """Run command in docker container with the supplied arguments to bcbio-nextgen.py.
     """
-    mounts = reduce(operator.add, (["-v", m] for m in list(set(mounts))), [])
+    return run_cmd(image, mounts, ["bcbio_nextgen.py"] + bcbio_nextgen_args, ports, pooled, limits)
+
+def run_cmd(image, mounts, cmd, ports=None, pooled=False, limits=None):
+    """Run a command in a docker container as the current user.
+
+    Talks to the docker engine socket directly when available, avoiding separate
+    processes to run, attach to, kill and remove the container. Falls back to the
+    docker command line client otherwise, or if set with BCBIO_DOCKER_CLIENT=cli.
+
+    pooled runs the command in a warm container from the node pool, if enabled.
+    limits are cgroup CPU, memory and block I/O limits from bcbiovm.docker.limits.
+    Containers pinned to specific CPUs do not use the pool.
+
+    With BCBIO_DOCKER_USER_MODE=mapped, containers run directly as the external
+    user instead of creating it with createsetuser, see bcbiovm.docker.usermap.
+    """
+    mapped_user = usermap.is_enabled()
+    mounts = usermap.add_mounts(mounts) if mapped_user else list(set(mounts))
+    limits = limits or {}
+    labels = getattr(_context, "labels", None)
+    use_engine = os.environ.get("BCBIO_DOCKER_CLIENT") != "cli" and engine.is_available()
+    if (use_engine and pooled and not ports and not limits.get("cpuset_cores") and not labels
+          and pool.is_enabled()):
+        result = pool.run_cmd(image, mounts, cmd, _get_env_vars(),
+                              privileged=_is_privileged(), log_fn=_log_output, limits=limits)
+        # Fall back to a new container only if the pooled command never started,
+        # since re-running a partially completed function is unsafe
+        if result and result.cid:
+            return _check_result(result)
+    if mapped_user:
+        cmd, run_user, env = usermap.login_cmd(cmd), usermap.user_spec(), _get_env_vars() + usermap.env_vars()
+    else:
+        cmd, run_user, env = _get_container_cmd(cmd), None, _get_env_vars()
+    with container_limits.allocate(limits) as cur_limits:
+        if use_engine:
+            result = engine.run_container(image, cmd, binds=mounts, env=env, ports=ports,
+                                          privileged=_is_privileged(), log_fn=_log_output,
+                                          user=run_user, limits=cur_limits, labels=labels)
+            if result.cid:
+                return _check_result(result)
+            else:
+                logger.info("Could not start container through docker engine API, using command line: %s"
+                            % result.error)
+        return _run_bcbio_cmd_cl(image, mounts, cmd, ports, cur_limits, labels, run_user, env)
+
+def _log_output(line):
+    logger.debug(getattr(_context, "log_prefix", "") + line.rstrip())
+
+def _check_result(result):
+    """Raise an error, mirroring the command line client, for failed engine API runs.
+    """
+    if result.exit_code != 0:
+        print("Stopping docker container")
+        raise subprocess.CalledProcessError(
+            result.exit_code if result.exit_code is not None else 1,
+            "Running in docker container: %s" % result.cid,
+            "\n".join(result.output + ([result.error] if result.error else [])))
+    return result.cid
+
+def _run_bcbio_cmd_cl(image, mounts, cmd, ports=None, limits=None, labels=None, user=None, env=None):
+    """Run a container with the docker command line client.
+    """
+    mounts = reduce(operator.add, (["-v", m] for m in mounts), [])
     ports = reduce(operator.add, (["-p", p] for p in ports or []), [])
-    privileged = ['--privileged'] if os.environ.get('BCBIO_DOCKER_PRIVILEGED', None) else []
-    envs = _get_pass_envs()
-    envs += ["-e", "PERL5LIB=/usr/local/lib/perl5"]
+    privileged = ['--privileged'] if _is_privileged() else []
+    privileged += ["--user", user] if user else []
+    envs = reduce(operator.add, (["-e", e] for e in (_get_env_vars() if env is None else env)), [])
     networking = ["--net=host"]  # Use host-networking so Docker works correctly on AWS VPCs
-
-    user = pwd.getpwuid(os.getuid())
-    group = grp.getgrgid(os.getgid())
-
-    cmd = ["docker", "run", "-d", "-i"] + privileged + networking + ports + mounts + envs + [image]
-    # On Mac OSX boot2docker runs the docker server inside VirtualBox, which maps
-    # the root user there to the external user. In this case we want to run the job
-    # as root so it will have permission to access user directories. Since the Docker server
-    # is sandboxed inside VirtualBox this doesn't have the same security worries as
-    # on a Linux system.
-    # On Linux systems, we run commands as the original calling user so they have the
-    # same permissions inside the Docker container as they do externally.
-    if platform.system() != "Darwin":
-        cmd += ["/sbin/createsetuser", user.pw_name, str(user.pw_uid), group.gr_name, str(group.gr_gid)]
-    cmd += ["bcbio_nextgen.py"] + bcbio_nextgen_args
+    labels = reduce(operator.add, (["--label", "%s=%s" % x] for x in (labels or {}).items()), [])
+    cmd = (["docker", "run", "-d", "-i"] + privileged + networking + _limits_cl(limits or {}) +
+           labels + ports + mounts + envs + [image] + cmd)
     # logger.info(" ".join(cmd))
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-    cid = process.communicate()[0].decode().strip()
+    with trace.span("docker.create"):
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        cid = process.communicate()[0].decode().strip()
     try:
-        do.run(["docker", "attach", "--no-stdin", cid], "Running in docker container: %s" % cid,
-               log_stdout=True)
+        with trace.span("docker.attach", container=cid):
+            do.run(["docker", "attach", "--no-stdin", cid], "Running in docker container: %s" % cid,
+                   log_stdout=True)
     except subprocess.CalledProcessError as e:
         print("Stopping docker container")
         subprocess.call(["docker", "kill", cid], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
         raise e
     finally:
-        subprocess.call(["docker", "kill", cid], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        subprocess.call(["docker", "rm", cid], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        with trace.span("docker.kill_rm", container=cid):
+            subprocess.call(["docker", "kill", cid], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            subprocess.call(["docker", "rm", cid], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
     return cid
 
+def _limits_cl(limits):
+    out = []
+    if limits.get("cpus"):
+        out += ["--cpus", str(limits["cpus"])]
+    if limits.get("memory"):
+        out += ["--memory", str(limits["memory"]),
+                "--memory-swap", str(limits.get("memory_swap", limits["memory"]))]
+    if limits.get("cpuset_cpus"):
+        out += ["--cpuset-cpus", limits["cpuset_cpus"]]
+    if limits.get("cpuset_mems"):
+        out += ["--cpuset-mems", limits["cpuset_mems"]]
+    if limits.get("blkio_weight"):
+        out += ["--blkio-weight", str(limits["blkio_weight"])]
+    return out
+
+def _get_container_cmd(cmd):
+    """Retrieve the command to run inside the container.
+
+    On Mac OSX boot2docker runs the docker server inside VirtualBox, which maps
+    the root user there to the external user. In this case we want to run the job
+    as root so it will have permission to access user directories. Since the Docker server
+    is sandboxed inside VirtualBox this doesn't have the same security worries as
+    on a Linux system.
+    On Linux systems, we run commands as the original calling user so they have the
+    same permissions inside the Docker container as they do externally.
+    """
+    if platform.system() != "Darwin":
+        user = pwd.getpwuid(os.getuid())
+        group = grp.getgrgid(os.getgid())
+        cmd = ["/sbin/createsetuser", user.pw_name, str(user.pw_uid), group.gr_name, str(group.gr_gid)] + cmd
+    return cmd
+
+def _is_privileged():
+    return bool(os.environ.get('BCBIO_DOCKER_PRIVILEGED', None))
+
+def _get_env_vars():
+    """Environmental variables to set inside the container.
+    """
+    return _get_pass_envs() + ["PERL5LIB=/usr/local/lib/perl5"]
+
 def _get_pass_envs():
     """Pass external proxy information inside container for retrieval.
     """
@@ -60,5 +174,5 @@ def _get_pass_envs():
                      "RSYNC_PROXY", "rsync_proxy",
                      "AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"]:
         if proxyenv in os.environ:
-            out += ["-e", "%s=%s" % (proxyenv, os.environ[proxyenv])]
+            out.append("%s=%s" % (proxyenv, os.environ[proxyenv]))
     return out
@@ -2,6 +2,7 @@
 """
 from __future__ import print_function
 import os
+from multiprocessing.pool import ThreadPool
 
 import six
 
@@ -24,29 +25,134 @@ def update_config(config, fcdir=None):
     config, directories = normalize_config(config, fcdir)
     if config.get("upload", {}).get("dir"):
         directories.append(config["upload"]["dir"])
-    mounts = {}
-    for i, d in enumerate(sorted(set(directories))):
-        mounts[d] = d
-    mounts = ["%s:%s" % (k, v) for k, v in mounts.items()]
+    mounts = minimize(["%s:%s" % (d, d) for d in sorted(set(directories))])
     config = remap.external_to_docker(config, mounts)
     return config, mounts
 
-def normalize_config(config, fcdir=None):
+# ## Mount planning
+
+# System directories we never replace with an external mount
+FORBIDDEN_ROOTS = ["/", "/home", "/bin", "/boot", "/dev", "/etc", "/lib", "/lib64", "/opt",
+                   "/proc", "/root", "/run", "/sbin", "/sys", "/tmp", "/usr", "/var"]
+# Directory trees owned by the image, like /usr/local, /opt/conda and /var/lib, where
+# mounting a parent of inputs would shadow the image's own files
+IMAGE_ROOTS = ["/bin", "/boot", "/dev", "/etc", "/lib", "/lib64", "/opt", "/proc", "/root",
+               "/run", "/sbin", "/srv", "/sys", "/usr", "/var"]
+
+def minimize(mount_strs, max_mounts=None, forbidden=None):
+    """Collapse directories mounted at the same location into a minimal set of parents.
+
+    Sample inputs in per-sample directories otherwise produce hundreds of bind
+    mounts, slowing container creation. Directories nested in other mounts with
+    the same options are always dropped. While over `max_mounts`
+    (BCBIO_DOCKER_MAX_MOUNTS, default 25), the directories with the deepest
+    common parent merge into that parent. Parents equal to or containing a
+    directory in `forbidden` (BCBIO_DOCKER_FORBIDDEN_MOUNTS, comma separated,
+    defaulting to FORBIDDEN_ROOTS), within IMAGE_ROOTS, or containing the
+    destination of a remapped mount are never used.
+
+    Only identity mounts (dir:dir) collapse, so file paths remapped with
+    remap.external_to_docker are the same as with the original mounts. Mount
+    options, like :ro, are kept and only mounts with the same options merge.
+    Read only directories within writable mounts are dropped.
+    """
+    if max_mounts is None:
+        max_mounts = int(os.environ.get("BCBIO_DOCKER_MAX_MOUNTS", 25))
+    if forbidden is None:
+        forbidden = [x for x in os.environ.get("BCBIO_DOCKER_FORBIDDEN_MOUNTS", "").split(",") if x]
+        forbidden = forbidden or FORBIDDEN_ROOTS
+    forbidden = set(os.path.normpath(x) for x in forbidden)
+    dirs, other = {}, []
+    for m in mount_strs:
+        parts = m.split(":")
+        external, docker, opts = parts[0], parts[1], ":".join(parts[2:])
+        if os.path.normpath(external) == os.path.normpath(docker) and os.path.isabs(external):
+            dirs.setdefault(opts, set([])).add(os.path.normpath(external))
+        else:
+            other.append(m)
+    other_dests = [os.path.normpath(m.split(":")[1]) for m in other]
+    def _allowed(parent):
+        return (not any(_is_under(f, parent) for f in forbidden) and
+                not any(_is_under(parent, r) for r in IMAGE_ROOTS) and
+                not any(_is_under(dest, parent) for dest in other_dests))
+    dirs = dict((opts, _remove_nested(ds)) for opts, ds in dirs.items())
+    while sum(len(ds) for ds in dirs.values()) + len(other) > max_mounts:
+        best = None
+        for opts, ds in dirs.items():
+            parent = _deepest_common_parent(ds, _allowed)
+            if parent and (best is None or parent.count("/") > best[1].count("/")):
+                best = (opts, parent)
+        if not best:
+            break
+        dirs[best[0]] = _remove_nested(dirs[best[0]] | set([best[1]]))
+    return _merge_options(dirs) + other
+
+def _merge_options(dirs):
+    """Combine directories by options, dropping read only directories within writable ones.
+    """
+    writable = [d for opts, ds in dirs.items() if "ro" not in opts.split(",") for d in ds]
+    out, seen = [], set([])
+    for opts in sorted(dirs, key=lambda x: "ro" in x.split(",")):
+        for d in sorted(dirs[opts]):
+            if d in seen or ("ro" in opts.split(",") and any(_is_under(d, w) for w in writable)):
+                continue
+            seen.add(d)
+            out.append("%s:%s%s" % (d, d, ":%s" % opts if opts else ""))
+    return sorted(out)
+
+def _is_under(path, parent):
+    return path == parent or path.startswith(parent.rstrip("/") + "/")
+
+def _remove_nested(dirs):
+    out = set([])
+    for d in sorted(dirs, key=lambda x: x.count("/")):
+        if not any(_is_under(d, p) for p in out):
+            out.add(d)
+    return out
+
+def _deepest_common_parent(dirs, allowed):
+    """Find the deepest allowed parent directory shared by at least two directories.
+
+    Neighbours in sorted path component order share the deepest parents.
+    """
+    ordered = sorted(dirs, key=lambda x: x.split("/"))
+    best = None
+    for d1, d2 in zip(ordered, ordered[1:]):
+        parent = os.path.commonprefix([d1.split("/"), d2.split("/")])
+        parent = "/".join(parent) or "/"
+        if allowed(parent) and (best is None or parent.count("/") > best.count("/")):
+            best = parent
+    return best
+
+def normalize_config(config, fcdir=None, threads=None):
     """Normalize sample configuration file to have absolute paths and collect directories.
 
     Prepares configuration for remapping directories into docker containers.
+    File existence and symlink resolution share a cache across samples, and
+    samples normalize with `threads` simultaneous workers to hide filesystem
+    latency on large configurations, defaulting to BCBIO_VM_NORMALIZE_THREADS.
     """
-    absdetails = []
-    directories = []
+    if threads is None:
+        threads = int(os.environ.get("BCBIO_VM_NORMALIZE_THREADS", 1))
+    cache = PathCache()
     ignore = ["variantcaller", "realign", "recalibrate", "phasing", "svcaller"]
-    for d in config["details"]:
+    def _normalize_detail(d):
         d = abs_file_paths(d, base_dirs=[fcdir] if fcdir else None,
                            ignore=["description", "analysis", "resources",
-                                   "genome_build", "lane"])
+                                   "genome_build", "lane"], cache=cache)
         d["algorithm"] = abs_file_paths(d["algorithm"], base_dirs=[fcdir] if fcdir else None,
-                                        ignore=ignore)
-        absdetails.append(d)
-        directories.extend(_get_directories(d, ignore))
+                                        ignore=ignore, cache=cache)
+        return d, _get_directories(d, ignore, cache)
+    if threads > 1 and len(config["details"]) > 1:
+        pool = ThreadPool(min(threads, len(config["details"])))
+        try:
+            normalized = pool.map(_normalize_detail, config["details"])
+        finally:
+            pool.close()
+    else:
+        normalized = [_normalize_detail(d) for d in config["details"]]
+    absdetails = [d for d, _ in normalized]
+    directories = [x for _, dirs in normalized for x in dirs]
     if config.get("upload", {}).get("dir"):
         config["upload"]["dir"] = os.path.normpath(os.path.realpath(
             os.path.join(os.getcwd(), config["upload"]["dir"])))
@@ -55,6 +161,26 @@ def normalize_config(config, fcdir=None):
     config["details"] = absdetails
     return config, directories
 
+class PathCache(object):
+    """Cache file existence and resolved paths while normalizing a configuration.
+
+    Sample configurations repeatedly reference the same inputs, references and
+    directories, so avoid re-checking them on slow shared filesystems.
+    """
+    def __init__(self):
+        self._exists = {}
+        self._realpath = {}
+
+    def exists(self, path):
+        if path not in self._exists:
+            self._exists[path] = os.path.exists(path)
+        return self._exists[path]
+
+    def realpath(self, path):
+        if path not in self._realpath:
+            self._realpath[path] = os.path.normpath(os.path.realpath(path))
+        return self._realpath[path]
+
 def find_genome_directory(dirname):
     """Handle external non-docker installed biodata located relative to config directory.
     """
@@ -75,43 +201,49 @@ def find_genome_directory(dirname):
             mounts.append("%s:%s" % (full_genome_dir, full_genome_dir))
     return mounts
 
-def _get_directories(xs, ignore):
+def _get_directories(xs, ignore, cache=None):
     """Retrieve all directories specified in an input file.
     """
+    cache = cache or PathCache()
     out = []
     if not isinstance(xs, dict):
         return out
     for k, v in xs.items():
         if k not in ignore:
             if isinstance(v, dict):
-                out.extend(_get_directories(v, ignore))
-            elif v and isinstance(v, six.string_types) and os.path.exists(v) and os.path.isabs(v):
+                out.extend(_get_directories(v, ignore, cache))
+            elif v and isinstance(v, six.string_types) and os.path.isabs(v) and cache.exists(v):
                 out.append(os.path.dirname(v))
-            elif v and isinstance(v, (list, tuple)) and v[0] and os.path.exists(v[0]) and os.path.isabs(v[0]):
+            elif (v and isinstance(v, (list, tuple)) and v[0] and isinstance(v[0], six.string_types)
+                  and os.path.isabs(v[0]) and cache.exists(v[0])):
                 out.extend(os.path.dirname(x) for x in v if x)
     out = [x for x in out if x]
     return out
 
-def _normalize_path(x, base_dirs):
+def _normalize_path(x, base_dirs, cache=None):
+    cache = cache or PathCache()
     for base_dir in base_dirs:
-        if os.path.exists(os.path.join(base_dir, x)):
-            return os.path.normpath(os.path.realpath(os.path.join(base_dir, x)))
+        cur = os.path.join(base_dir, x)
+        if cache.exists(cur):
+            return cache.realpath(cur)
     return None
 
-def abs_file_paths(xs, base_dirs=None, ignore=None):
+def abs_file_paths(xs, base_dirs=None, ignore=None, cache=None):
     """Expand files to be absolute, non-symlinked file paths.
     """
     if not isinstance(xs, dict):
         return xs
+    cache = cache or PathCache()
     base_dirs = base_dirs if base_dirs else []
     base_dirs.append(os.getcwd())
     ignore_keys = set(ignore if ignore else [])
     out = {}
     for k, v in xs.items():
-        if k not in ignore_keys and v and isinstance(v, six.string_types) and _normalize_path(v, base_dirs):
-            out[k] = _normalize_path(v, base_dirs)
-        elif k not in ignore_keys and v and isinstance(v, (list, tuple)) and _normalize_path(v[0], base_dirs):
-            out[k] = [_normalize_path(x, base_dirs) for x in v]
-        else:
-            out[k] = v
+        new_v = None
+        if k not in ignore_keys and v and isinstance(v, six.string_types):
+            new_v = _normalize_path(v, base_dirs, cache)
+        elif k not in ignore_keys and v and isinstance(v, (list, tuple)):
+            if isinstance(v[0], six.string_types) and _normalize_path(v[0], base_dirs, cache):
+                new_v = [_normalize_path(x, base_dirs, cache) for x in v]
+        out[k] = new_v if new_v else v
     return out
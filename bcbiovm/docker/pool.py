@@ -0,0 +1,228 @@
+"""Pool of long running containers for executing bcbio functions on a node.
+
+Starting a container, creating the matching user and tearing it down again can
+take longer than short bookkeeping functions like `organize_samples`. Pooled
+containers start once per (image, mounts, user) combination and run each
+`bcbio_nextgen.py runfn` call with a docker exec.
+
+Pool state lives in a node-local file so separate runfn processes and IPython
+engines share containers. The pool retires containers only while they are idle:
+when unused for too long, once past a maximum age, or when failing health
+checks. Pooled containers also exit, and are removed, on their own once idle for
+longer than the idle time, so containers do not outlive a run when no further
+tasks start on the node. Each exec refreshes the keepalive and marks the
+container busy while running, so long running functions are never cut off.
+Enable by setting the maximum pool size:
+
+  BCBIO_DOCKER_POOL=4             maximum containers in the pool (0 disables)
+  BCBIO_DOCKER_POOL_IDLE=600      seconds before evicting an unused container
+  BCBIO_DOCKER_POOL_LIFETIME=14400 age in seconds after which idle containers are not reused
+
+Containers are pooled by image, mounts, user, resource limits, privileges and
+environment, so each run sees the same container configuration it would get
+from a new container.
+"""
+import grp
+import hashlib
+import json
+import os
+import platform
+import pwd
+import time
+
+from bcbio.log import logger
+from bcbiovm.docker import engine, usermap
+from bcbiovm.shared import nodestate, trace
+
+POOL_STATE = "container-pool"
+# Container-local tmpfs, writable by the external user, for keepalive and busy markers
+KEEPALIVE_DIR = "/dev/shm/bcbio-pool"
+# Extra seconds containers wait past the pool idle time, so the pool evicts them first
+KEEPALIVE_GRACE = 60
+
+def get_config():
+    return {"size": int(os.environ.get("BCBIO_DOCKER_POOL", 0)),
+            "idle": int(os.environ.get("BCBIO_DOCKER_POOL_IDLE", 600)),
+            "lifetime": int(os.environ.get("BCBIO_DOCKER_POOL_LIFETIME", 4 * 60 * 60))}
+
+def is_enabled():
+    return get_config()["size"] > 0 and engine.is_available()
+
+def run_cmd(image, mounts, cmd, env, privileged=False, log_fn=None, limits=None):
+    """Run a command, like bcbio_nextgen.py runfn, inside a pooled container.
+
+    Containers are pooled by resource limits as well as image and mounts, since
+    limits apply to the whole container. Returns the engine ContainerResult, or
+    None if no pooled container was available.
+    """
+    config = get_config()
+    cid = acquire(image, mounts, env, privileged, config, limits)
+    if not cid:
+        return None
+    result = None
+    try:
+        user, group = _get_user()
+        if user and usermap.is_enabled():
+            exec_user, exec_env = usermap.user_spec(), usermap.env_vars()
+        elif user:
+            exec_user = "%s:%s" % (user.pw_uid, group.gr_gid)
+            exec_env = ["USER=%s" % user.pw_name, "HOME=%s" % os.path.join("/home", user.pw_name),
+                        "UID=%s" % user.pw_uid]
+        else:
+            exec_user, exec_env = None, []
+        result = engine.exec_run(cid, _exec_cmd(usermap.login_cmd(cmd)), user=exec_user, env=exec_env,
+                                 log_fn=log_fn)
+        return result
+    finally:
+        release(cid, healthy=result is not None and result.error is None)
+
+def _pool_key(image, mounts, limits=None, privileged=False, env=None):
+    """Identify containers with matching configuration, hashing the environment as it may contain credentials.
+    """
+    user, group = _get_user()
+    ids = [str(user.pw_uid), str(group.gr_gid)] if user else []
+    config = [json.dumps({"limits": limits or {}, "privileged": bool(privileged), "env": sorted(env or [])},
+                         sort_keys=True)]
+    return hashlib.sha1("\n".join([image] + ids + config + sorted(set(mounts))).encode()).hexdigest()
+
+def _get_user():
+    """Retrieve the user and group to run as. Docker on Mac OSX runs as root, see manage.
+    """
+    if platform.system() == "Darwin":
+        return None, None
+    return pwd.getpwuid(os.getuid()), grp.getgrgid(os.getgid())
+
+def acquire(image, mounts, env, privileged, config, limits=None):
+    """Reserve a healthy idle container for the image and mounts, starting one if needed.
+    """
+    key = _pool_key(image, mounts, limits, privileged, env)
+    with trace.span("pool.acquire"):
+        with nodestate.lock(POOL_STATE):
+            state = _evict(nodestate.read(POOL_STATE), config)
+            cids = sorted(state.keys(), key=lambda c: state[c]["last_used"], reverse=True)
+            for cid in cids:
+                if state[cid]["key"] == key and not state[cid]["busy"]:
+                    if _is_healthy(cid):
+                        state[cid]["busy"] = os.getpid()
+                        nodestate.write(POOL_STATE, state)
+                        return cid
+                    else:
+                        _remove(cid)
+                        del state[cid]
+            if len(state) >= config["size"]:
+                idle = [c for c in state if not state[c]["busy"]]
+                if not idle:
+                    nodestate.write(POOL_STATE, state)
+                    return None
+                oldest = min(idle, key=lambda c: state[c]["last_used"])
+                _remove(oldest)
+                del state[oldest]
+            cid = _start(image, mounts, env, privileged, config, limits)
+            if cid:
+                state[cid] = {"key": key, "image": image, "created": time.time(),
+                              "last_used": time.time(), "busy": os.getpid()}
+            nodestate.write(POOL_STATE, state)
+            return cid
+
+def release(cid, healthy=True):
+    """Return a container to the pool, removing it if unhealthy.
+    """
+    with nodestate.lock(POOL_STATE):
+        state = nodestate.read(POOL_STATE)
+        if cid in state:
+            if healthy:
+                state[cid]["busy"] = None
+                state[cid]["last_used"] = time.time()
+            else:
+                _remove(cid)
+                del state[cid]
+            nodestate.write(POOL_STATE, state)
+
+def _evict(state, config):
+    """Remove idle, expired and orphaned containers from the pool.
+
+    Busy containers are only removed when the process using them has exited.
+    """
+    now = time.time()
+    out = {}
+    for cid, info in state.items():
+        if info["busy"]:
+            keep = _pid_alive(info["busy"])
+        else:
+            keep = (now - info["last_used"] < config["idle"] and
+                    now - info["created"] < config["lifetime"])
+        if keep:
+            out[cid] = info
+        else:
+            _remove(cid)
+    return out
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+def _is_healthy(cid):
+    try:
+        info = engine.inspect_container(cid)
+    except (engine.EngineError, EnvironmentError):
+        return False
+    return bool(info and info.get("State", {}).get("Running"))
+
+def _keepalive_cmd(idle, keepalive_dir=KEEPALIVE_DIR, check=10):
+    """Command keeping a pooled container running until idle for `idle` seconds.
+
+    Waits while any exec started by _exec_cmd is still running, checking every
+    `check` seconds, so the container never exits under a running function.
+    """
+    script = ('d=%(d)s; mkdir -p $d && touch $d/last || exit 1\n'
+              'while true; do\n'
+              '  sleep %(check)s; busy=\n'
+              '  for f in $d/busy.*; do\n'
+              '    [ -e "$f" ] && kill -0 "${f##*.}" 2> /dev/null && busy=1\n'
+              '  done\n'
+              '  [ -n "$busy" ] && continue\n'
+              '  [ $(( $(date +%%s) - $(stat -c %%Y $d/last) )) -ge %(idle)s ] && exit 0\n'
+              'done' % {"d": keepalive_dir, "check": check, "idle": int(idle)})
+    return ["sh", "-c", script]
+
+def _exec_cmd(cmd, keepalive_dir=KEEPALIVE_DIR):
+    """Wrap a command run in a pooled container, marking it busy and refreshing the keepalive.
+    """
+    script = ('d=%s; b=$d/busy.$$; touch $b $d/last 2> /dev/null; "$@"; status=$?; '
+              'touch $d/last 2> /dev/null; rm -f $b; exit $status' % keepalive_dir)
+    return ["sh", "-c", script, "sh"] + list(cmd)
+
+def _start(image, mounts, env, privileged, config, limits=None):
+    """Start a long running container, creating the external user inside it.
+
+    The container runs until idle for longer than the pool idle time, then exits
+    and is removed by docker, rather than running for a fixed time, so functions
+    running in it are never killed by the container exiting.
+    With mapped users, the container runs as the external user and mounts
+    include the node's passwd and group files, so no user creation is needed.
+    """
+    user, group = _get_user()
+    cmd = _keepalive_cmd(config["idle"] + KEEPALIVE_GRACE)
+    run_user = None
+    if user and usermap.is_enabled():
+        run_user = usermap.user_spec()
+    elif user:
+        cmd = ["/sbin/createsetuser", user.pw_name, str(user.pw_uid), group.gr_name, str(group.gr_gid)] + cmd
+    try:
+        with trace.span("pool.start"):
+            cid = engine.create_container(image, cmd, binds=list(set(mounts)), env=env, privileged=privileged,
+                                          user=run_user, limits=limits, auto_remove=True)
+            engine.start_container(cid)
+        return cid
+    except (engine.EngineError, EnvironmentError) as e:
+        logger.info("Could not start pooled docker container: %s" % e)
+        return None
+
+def _remove(cid):
+    try:
+        engine.remove_container(cid)
+    except (engine.EngineError, EnvironmentError):
+        pass
@@ -23,31 +23,94 @@ def docker_to_external(xs, mount_strs):
 def _mounts_to_in_dict(mounts):
     """Convert docker-style mounts (external_dir):{docker_dir} into dictionary of external to docker.
     """
-    out = {}
-    for m in mounts:
-        external, docker = m.split(":")
-        out[external] = docker
-    return out
+    return _cached_index("in", mounts, lambda external, docker: (external, docker))
 
 def _mounts_to_out_dict(mounts):
     """Convert docker-style mounts (external_dir):{docker_dir} into dictionary of docker to external.
     """
-    out = {}
-    for m in mounts:
-        external, docker = m.split(":")
-        out[docker] = external
-    return out
+    return _cached_index("out", mounts, lambda external, docker: (docker, external))
+
+_index_cache = {}
+
+def _cached_index(direction, mounts, key_fn):
+    """Build a mount index once per set of mounts, reusing it across remapping calls.
+    """
+    cache_key = (direction, tuple(mounts))
+    if cache_key not in _index_cache:
+        if len(_index_cache) > 100:
+            _index_cache.clear()
+        _index_cache[cache_key] = MountIndex(key_fn(*m.split(":")) for m in mounts)
+    return _index_cache[cache_key]
+
+class MountIndex(dict):
+    """Dictionary of path prefixes to remapped locations, with a path component trie.
+
+    Finds the longest matching prefix of a file name in time proportional to
+    the path depth, rather than checking every prefix. Matches respect path
+    component boundaries, so /data matches /data/file but not /data2/file.
+    """
+    _END = None
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._trie = None
+
+    def __setitem__(self, k, v):
+        dict.__setitem__(self, k, v)
+        self._trie = None
+
+    def __delitem__(self, k):
+        dict.__delitem__(self, k)
+        self._trie = None
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self._trie = None
+
+    def _build(self):
+        trie = {}
+        for k in self.keys():
+            node = trie
+            for part in _path_parts(k):
+                node = node.setdefault(part, {})
+            node[self._END] = k
+        return trie
+
+    def longest_prefix(self, fname):
+        """Retrieve the longest (prefix, remapped) pair for a file name, or None if no match.
+        """
+        if self._trie is None:
+            self._trie = self._build()
+        node = self._trie
+        match = None
+        for part in fname.split("/"):
+            node = node.get(part)
+            if node is None:
+                break
+            match = node.get(self._END, match)
+        return (match, self[match]) if match is not None else None
+
+def get_index(remap_dict):
+    """Retrieve a MountIndex for a remapping dictionary, avoiding rebuilding existing indexes.
+    """
+    return remap_dict if isinstance(remap_dict, MountIndex) else MountIndex(remap_dict)
+
+def _path_parts(path):
+    """Split a path into components, ignoring trailing separators on directories.
+    """
+    parts = path.split("/")
+    if len(parts) > 1 and parts[-1] == "":
+        parts = parts[:-1]
+    return parts
 
 def remap_fname(fname, context, remap_dict):
     """Remap a filename given potential remapping mount points.
     """
-    matches = []
-    for k, v in remap_dict.items():
-        if fname.startswith(k):
-            matches.append((k, v))
-    matches.sort(key=lambda x: len(x[0]), reverse=True)
-    remap_orig, remap_new = matches[0]
-    return fname.replace(remap_orig, remap_new)
+    remap_orig, remap_new = get_index(remap_dict).longest_prefix(fname)
+    rest = fname[len(remap_orig):]
+    if remap_orig.endswith("/") and rest and not remap_new.endswith("/"):
+        remap_new += "/"
+    return remap_new + rest
 
 def walk_files(xs, f, remap_dict, context=None, pass_dirs=False):
     """Walk a set of input arguments, calling f on any files in the given remapping dictionary.
@@ -57,6 +120,7 @@ def walk_files(xs, f, remap_dict, context=None, pass_dirs=False):
 
     context keeps track of the nested set of keys associated with a file.
     """
+    remap_dict = get_index(remap_dict)
     if isinstance(xs, (list, tuple)):
         return [walk_files(x, f, remap_dict, context, pass_dirs) for x in xs]
     elif isinstance(xs, dict):
@@ -70,7 +134,7 @@ def walk_files(xs, f, remap_dict, context=None, pass_dirs=False):
                 cur_context = context[:] + [k]
                 out[k] = walk_files(v, f, remap_dict, cur_context, pass_dirs)
         return out
-    elif xs and isinstance(xs, six.string_types) and xs.startswith(tuple(remap_dict.keys())):
+    elif xs and isinstance(xs, six.string_types) and remap_dict.longest_prefix(xs):
         return f(xs, context, remap_dict)
     elif (xs and isinstance(xs, six.string_types) and os.path.exists(xs) and
           (os.path.isfile(xs) or pass_dirs) and not remap_dict):
@@ -10,15 +10,17 @@ import sys
 import yaml
 
 from bcbio import log
-from bcbiovm.docker import manage, mounts, remap
-from bcbiovm.ship import reconstitute
+from bcbiovm.docker import limits, manage, mounts, remap
+from bcbiovm.shared import serialize, trace
+from bcbiovm.ship import ledger, reconstitute
 
 def do_analysis(args, dockerconf):
     """Run a full analysis on a local machine, utilizing multiple cores.
     """
     work_dir = os.getcwd()
-    with open(args.sample_config) as in_handle:
-        sample_config, dmounts = mounts.update_config(yaml.safe_load(in_handle), args.fcdir)
+    with trace.span("mounts.update_config"):
+        sample_config, dmounts = mounts.update_config(serialize.read(args.sample_config, "yaml"),
+                                                      args.fcdir)
     dmounts += mounts.prepare_system(args.datadir, dockerconf["biodata_dir"])
     dmounts.append("%s:%s" % (work_dir, dockerconf["work_dir"]))
     system_config, system_mounts = _read_system_config(dockerconf, args.systemconfig, args.datadir)
@@ -30,52 +32,166 @@ def do_analysis(args, dockerconf):
         yaml.dump(sample_config, out_handle, default_flow_style=False, allow_unicode=False)
     in_files = [os.path.join(dockerconf["work_dir"], os.path.basename(x)) for x in [system_cfile, sample_cfile]]
     log.setup_local_logging({"include_time": False})
-    manage.run_bcbio_cmd(args.image, dmounts + system_mounts,
+    manage.run_bcbio_cmd(args.image, mounts.minimize(dmounts + system_mounts),
                          in_files + ["--numcores", str(args.numcores), "--workdir=%s" % dockerconf["work_dir"]])
 
 def do_runfn(fn_name, fn_args, cmd_args, parallel, dockerconf, ports=None):
     """"Run a single defined function inside a docker container, returning results.
     """
+    trace.setup()
+    try:
+        with trace.span("run.do_runfn", fn_name=fn_name), ledger.context(_ledger_dir(cmd_args), fn_name):
+            return _do_runfn(fn_name, fn_args, cmd_args, parallel, dockerconf, ports)
+    finally:
+        trace.flush()
+
+def _ledger_dir(cmd_args):
+    """Work directory to record transfers in, the shared work directory if available.
+    """
+    return cmd_args["pack"].get("workdir") or os.getcwd()
+
+def _do_runfn(fn_name, fn_args, cmd_args, parallel, dockerconf, ports=None):
+    with trace.span("reconstitute.prep_datadir"):
+        datadir, fn_args = reconstitute.prep_datadir(cmd_args["pack"], fn_args)
+    with trace.span("reconstitute.prep_workdir"):
+        work_dir, fn_args, finalizer, in_place = reconstitute.prep_workdir(cmd_args["pack"], parallel, fn_args)
+    reconstitute.prep_systemconfig(datadir, fn_args)
+    all_mounts = _runfn_mounts(cmd_args, datadir, work_dir, dockerconf, in_place)
+
+    argfile, docker_argfile, outfile = _write_runfn_argfile(fn_name, fn_args, work_dir, all_mounts, dockerconf)
+    cur_limits = limits.from_parallel(fn_name, limits.job_parallel(parallel, fn_args))
+    with trace.span("manage.run_bcbio_cmd"):
+        manage.run_bcbio_cmd(cmd_args["image"], all_mounts,
+                             ["runfn", fn_name, docker_argfile],
+                             ports=ports, pooled=True, limits=cur_limits)
+    out = _read_runfn_outfile(outfile, all_mounts)
+    for f in [argfile, outfile]:
+        if os.path.exists(f):
+            os.remove(f)
+    with trace.span("reconstitute.finalizer"):
+        out = finalizer(out)
+    return out
+
+def do_runfn_batch(items):
+    """Run a batch of runfn wrapper items inside a single docker container.
+
+    Items are runfn wrapper arguments, [fn_name, dockerconf, cmd_args, parallel, *fn_args],
+    sharing the same docker configuration, command arguments and parallel settings.
+    Avoids starting a container for each small, quick function: the functions share a
+    prepared work directory and a single argument file, and run in order inside one
+    container. Returns outputs in the same order as the items.
+
+    bcbio's runners call wrappers with a single item, so callers group items to batch.
+    Non-shared filesystem packs run each item separately.
+    """
+    if not items:
+        return []
+    _, dockerconf, cmd_args, parallel = items[0][:4]
+    if any(list(x[1:4]) != [dockerconf, cmd_args, parallel] for x in items):
+        raise ValueError("Batched runfn items need the same docker configuration, "
+                         "arguments and parallel settings")
+    if cmd_args["pack"]["type"] != "shared":
+        return [do_runfn(x[0], list(x[4:]), cmd_args, parallel, dockerconf) for x in items]
+    trace.setup()
+    fn_names = [x[0] for x in items]
+    try:
+        with trace.span("run.do_runfn_batch", size=len(items)), \
+             ledger.context(_ledger_dir(cmd_args), ",".join(sorted(set(fn_names)))):
+            return _do_runfn_batch(fn_names, [list(x[4:]) for x in items], cmd_args, parallel, dockerconf)
+    finally:
+        trace.flush()
+
+def _do_runfn_batch(fn_names, all_args, cmd_args, parallel, dockerconf):
+    with trace.span("reconstitute.prep_datadir"):
+        datadir, all_args = reconstitute.prep_datadir(cmd_args["pack"], all_args)
+    with trace.span("reconstitute.prep_workdir"):
+        work_dir, all_args, finalizer, in_place = reconstitute.prep_workdir(cmd_args["pack"], parallel,
+                                                                            all_args)
+    reconstitute.prep_systemconfig(datadir, all_args[0])
+    all_mounts = _runfn_mounts(cmd_args, datadir, work_dir, dockerconf, in_place)
+    batch_args = [[fn_name, fn_args] for fn_name, fn_args in zip(fn_names, all_args)]
+    argfile, docker_argfile, outfile = _write_runfn_argfile("batch", batch_args, work_dir, all_mounts,
+                                                            dockerconf)
+    # Run the largest item's limits, since items run one at a time
+    cur_limits = max((limits.from_parallel(fn_name, limits.job_parallel(parallel, fn_args))
+                      for fn_name, fn_args in zip(fn_names, all_args)),
+                     key=lambda x: (x.get("memory", 0), x.get("cpus", 0)))
+    with trace.span("manage.run_cmd"):
+        manage.run_cmd(cmd_args["image"], all_mounts,
+                       ["bcbio_python", "-c", _RUNFN_BATCH_SCRIPT, docker_argfile,
+                        os.path.join(dockerconf["work_dir"], os.path.basename(outfile))],
+                       pooled=True, limits=cur_limits)
+    out = _read_runfn_outfile(outfile, all_mounts)
+    for f in [argfile, outfile]:
+        if os.path.exists(f):
+            os.remove(f)
+    with trace.span("reconstitute.finalizer"):
+        out = finalizer(out)
+    return out
+
+# Run each function in a batch argument file, as bcbio_nextgen.py runfn does for a single function
+_RUNFN_BATCH_SCRIPT = """
+import contextlib, os, sys, yaml
+from bcbio import log, utils
+from bcbio.distributed import multitasks
+from bcbio.pipeline import config_utils
+argfile, outfile = sys.argv[1:3]
+with open(argfile) as in_handle:
+    items = yaml.safe_load(in_handle)
+out = []
+with utils.chdir(os.path.dirname(argfile)):
+    with contextlib.closing(log.setup_local_logging(parallel={"wrapper": "runfn"})):
+        for fn_name, fn_args in items:
+            out.append(getattr(multitasks, fn_name)(*config_utils.merge_resources(fn_args)))
+with open(outfile, "w") as out_handle:
+    yaml.safe_dump(out, out_handle, default_flow_style=False, allow_unicode=False)
+"""
+
+def _runfn_mounts(cmd_args, datadir, work_dir, dockerconf, in_place=None):
+    """Retrieve docker mounts needed to run functions in a work directory.
+
+    in_place are directories of inputs used directly from the shared filesystem
+    rather than copied into the work directory.
+    """
     dmounts = []
     if cmd_args.get("sample_config"):
-        with open(cmd_args["sample_config"]) as in_handle:
-            _, dmounts = mounts.update_config(yaml.safe_load(in_handle), cmd_args["fcdir"])
-    datadir, fn_args = reconstitute.prep_datadir(cmd_args["pack"], fn_args)
+        with trace.span("mounts.update_config"):
+            _, dmounts = mounts.update_config(serialize.read(cmd_args["sample_config"], "yaml"),
+                                              cmd_args["fcdir"])
     if "orig_systemconfig" in cmd_args:
         orig_sconfig = _get_system_configfile(cmd_args["orig_systemconfig"], datadir)
         orig_galaxydir = os.path.dirname(orig_sconfig)
         dmounts.append("%s:%s" % (orig_galaxydir, orig_galaxydir))
-    work_dir, fn_args, finalizer = reconstitute.prep_workdir(cmd_args["pack"], parallel, fn_args)
     dmounts += mounts.prepare_system(datadir, dockerconf["biodata_dir"])
-    reconstitute.prep_systemconfig(datadir, fn_args)
     _, system_mounts = _read_system_config(dockerconf, cmd_args["systemconfig"], datadir)
 
     dmounts.append("%s:%s" % (work_dir, dockerconf["work_dir"]))
+    dmounts.extend("%s:%s" % (d, d) for d in in_place or [])
     homedir = pwd.getpwuid(os.getuid()).pw_dir
     dmounts.append("%s:%s" % (homedir, homedir))
-    all_mounts = dmounts + system_mounts
+    return mounts.minimize(dmounts + system_mounts)
 
+def _write_runfn_argfile(fn_name, fn_args, work_dir, all_mounts, dockerconf):
+    """Write function arguments remapped into docker, returning argument and output files.
+
+    Always YAML, since bcbio_nextgen.py runfn writes CWL outputs for JSON argument files.
+    """
     argfile = os.path.join(work_dir, "runfn-%s-%s.yaml" % (fn_name, uuid.uuid4()))
-    with open(argfile, "w") as out_handle:
-        yaml.safe_dump(remap.external_to_docker(fn_args, all_mounts),
-                       out_handle, default_flow_style=False, allow_unicode=False)
+    with trace.span("remap.external_to_docker"):
+        docker_fn_args = remap.external_to_docker(fn_args, all_mounts)
+    with trace.span("runfn.write_argfile"):
+        serialize.write(docker_fn_args, argfile, "yaml")
     docker_argfile = os.path.join(dockerconf["work_dir"], os.path.basename(argfile))
     outfile = "%s-out%s" % os.path.splitext(argfile)
-    out = None
-    manage.run_bcbio_cmd(cmd_args["image"], all_mounts,
-                         ["runfn", fn_name, docker_argfile],
-                         ports=ports)
+    return argfile, docker_argfile, outfile
+
+def _read_runfn_outfile(outfile, all_mounts):
     if os.path.exists(outfile):
-        with open(outfile) as in_handle:
-            out = remap.docker_to_external(yaml.safe_load(in_handle), all_mounts)
+        with trace.span("remap.docker_to_external"):
+            return remap.docker_to_external(serialize.read(outfile), all_mounts)
     else:
         print("Subprocess in docker container failed")
         sys.exit(1)
-    out = finalizer(out)
-    for f in [argfile, outfile]:
-        if os.path.exists(f):
-            os.remove(f)
-    return out
 
 def local_system_config(systemconfig, datadir, work_dir):
     """Create a ready to run local system configuration file.
@@ -0,0 +1,162 @@
+"""Supervise multiple runfn containers running at once on a single machine.
+
+Lets a large single machine run bcbio parallel steps in containers without
+IPython. An asyncio loop starts containers in submission order while cores and
+memory requested in each item's parallel configuration fit within the host
+capacity, holding back remaining items until running containers finish.
+Cores and memory in use are reserved in node-local state, so separate
+supervisors, like concurrent Clusterk runfn processes, share the host
+capacity rather than each assuming they own the machine. Container output
+streams to the log prefixed with the item and function name. If the run is
+cancelled or an item fails, all containers started by the supervisor are
+removed.
+
+Items are runfn wrapper arguments: [fn_name, dockerconf, cmd_args, parallel, *fn_args].
+"""
+import asyncio
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from bcbio.log import logger
+from bcbiovm.docker import engine, limits, manage, run
+from bcbiovm.shared import nodestate
+
+LABEL = "bcbio-vm.supervisor"
+RESOURCE_STATE = "supervisor-resources"
+
+def host_capacity():
+    """Retrieve cores and memory, in GB, available on this machine.
+    """
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    memory = None
+    if os.path.exists("/proc/meminfo"):
+        with open("/proc/meminfo") as in_handle:
+            for line in in_handle:
+                if line.startswith("MemTotal:"):
+                    memory = float(line.split()[1]) / (1024 * 1024)
+    return cores or 1, memory
+
+def job_resources(parallel):
+    """Cores and memory, in GB, requested by a single job.
+    """
+    cores = float(parallel.get("cores_per_job") or parallel.get("cores") or 1)
+    memory = float(parallel.get("mem") or 0)
+    return cores, memory
+
+class Supervisor(object):
+    """Run runfn items in containers, accounting for cores and memory used on the host.
+    """
+    def __init__(self, cores=None, memory=None, max_containers=None, poll=5):
+        host_cores, host_memory = host_capacity()
+        self.cores = float(cores or host_cores)
+        self.memory = float(memory or host_memory or 0)
+        self.max_containers = int(max_containers or self.cores)
+        self.labels = {LABEL: str(uuid.uuid4())}
+        self.poll = poll
+        self._running = 0
+        self._cond = None
+
+    def _fits(self, used, cores, memory):
+        # Always allow a single job, even if it requests more than the host has
+        if not used:
+            return True
+        return (len(used) < self.max_containers and
+                sum(x["cores"] for x in used) + cores <= self.cores and
+                (not self.memory or sum(x["memory"] for x in used) + memory <= self.memory))
+
+    def _reserve(self, key, cores, memory):
+        """Reserve cores and memory in node-wide accounting, returning True if they fit.
+        """
+        with nodestate.lock(RESOURCE_STATE):
+            state = nodestate.active(nodestate.read(RESOURCE_STATE))
+            fits = self._fits(list(state.values()), cores, memory)
+            if fits:
+                state[key] = {"cores": cores, "memory": memory}
+                self._running = len(state)
+            nodestate.write(RESOURCE_STATE, state)
+        return fits
+
+    def _unreserve(self, key):
+        with nodestate.lock(RESOURCE_STATE):
+            state = nodestate.active(nodestate.read(RESOURCE_STATE))
+            state.pop(key, None)
+            nodestate.write(RESOURCE_STATE, state)
+
+    async def _acquire(self, cores, memory):
+        """Wait for cores and memory to free up, checking other supervisors on the node every poll seconds.
+        """
+        key = "%s-%s" % (os.getpid(), uuid.uuid4())
+        async with self._cond:
+            while not self._reserve(key, cores, memory):
+                try:
+                    await asyncio.wait_for(self._cond.wait(), self.poll)
+                except asyncio.TimeoutError:
+                    pass
+        return key
+
+    async def _release(self, key):
+        async with self._cond:
+            self._unreserve(key)
+            self._cond.notify_all()
+
+    async def run(self, items):
+        """Run all items, returning outputs in the same order.
+        """
+        self._cond = asyncio.Condition()
+        loop = asyncio.get_event_loop()
+        executor = ThreadPoolExecutor(self.max_containers)
+        tasks = []
+        try:
+            for i, item in enumerate(items):
+                key = await self._acquire(*job_resources(limits.job_parallel(item[3], item[4:])))
+                tasks.append(asyncio.ensure_future(self._run_item(loop, executor, i, item, key)))
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await loop.run_in_executor(None, self.cleanup)
+            raise
+        finally:
+            executor.shutdown(wait=False)
+
+    async def _run_item(self, loop, executor, i, item, key):
+        try:
+            return await loop.run_in_executor(executor, self._run_sync, i, item)
+        finally:
+            await self._release(key)
+
+    def _run_sync(self, i, item):
+        fn_name, dockerconf, cmd_args, parallel = item[:4]
+        logger.info("Starting %s in docker, %s containers running on node" % (fn_name, self._running))
+        with manage.run_context(labels=self.labels, log_prefix="[%s:%s] " % (i, fn_name)):
+            return run.do_runfn(fn_name, list(item[4:]), cmd_args, parallel, dockerconf)
+
+    def cleanup(self):
+        """Remove any containers still running from this supervisor.
+        """
+        if not engine.is_available():
+            return
+        try:
+            cids = engine.list_containers(self.labels)
+        except (engine.EngineError, EnvironmentError):
+            return
+        for cid in cids:
+            logger.info("Removing docker container %s" % cid)
+            try:
+                engine.remove_container(cid)
+            except (engine.EngineError, EnvironmentError):
+                pass
+
+def run_items(items, cores=None, memory=None, max_containers=None, poll=5):
+    """Run runfn items simultaneously in containers, returning outputs in order.
+    """
+    supervisor = Supervisor(cores, memory, max_containers, poll)
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(supervisor.run(items))
+    except KeyboardInterrupt:
+        supervisor.cleanup()
+        raise
+    finally:
+        loop.close()
@@ -0,0 +1,104 @@
+"""Run containers as the external user without creating the user inside each container.
+
+By default, containers start with /sbin/createsetuser, which adds a matching user
+and group before running commands. This adds latency to every task and
+serializes on passwd file edits. Setting BCBIO_DOCKER_USER_MODE=mapped instead
+runs containers with --user uid:gid, mounting passwd and group files generated
+once per node and cached in node-local state. The home directory inside the
+container is the external home directory, used directly when already mounted
+and otherwise provided by an empty directory from node-local state.
+
+Use the default createsetuser mode for images needing additional user setup.
+"""
+import grp
+import os
+import platform
+import pwd
+
+from bcbiovm.shared import nodestate
+
+USER_STATE = "usermap"
+
+def is_enabled():
+    return (os.environ.get("BCBIO_DOCKER_USER_MODE", "createsetuser") == "mapped"
+            and platform.system() != "Darwin")
+
+def _ids():
+    user = pwd.getpwuid(os.getuid())
+    group = grp.getgrgid(os.getgid())
+    return user, group
+
+def home_dir():
+    """Home directory inside the container, matching the external home directory.
+    """
+    user, _ = _ids()
+    return os.path.normpath(user.pw_dir)
+
+def user_spec():
+    user, group = _ids()
+    return "%s:%s" % (user.pw_uid, group.gr_gid)
+
+def env_vars():
+    user, _ = _ids()
+    return ["HOME=%s" % home_dir(), "USER=%s" % user.pw_name, "LOGNAME=%s" % user.pw_name]
+
+def login_cmd(cmd):
+    """Run a command through a login shell from the home directory.
+
+    Picks up PATH and other settings from /etc/profile, which createsetuser
+    otherwise provides.
+    """
+    return ["bash", "-l", "-c", 'cd "$HOME" 2> /dev/null; exec "$@"', "bash"] + cmd
+
+def add_mounts(cur_mounts):
+    """Add mounts for the external user to the mounts for a container.
+    """
+    return list(set(cur_mounts)) + [m for m in mounts(cur_mounts) if m not in cur_mounts]
+
+def mounts(cur_mounts=None):
+    """Mounts providing passwd, group and home directory entries for the external user.
+
+    Files are generated on first use and reused by later containers on the node.
+    Skips the home directory if cur_mounts already provide it, since docker
+    rejects duplicate mount points.
+    """
+    user, group = _ids()
+    base_dir = os.path.join(nodestate.state_dir(), "%s-%s-%s" % (USER_STATE, user.pw_uid, group.gr_gid))
+    passwd_file = os.path.join(base_dir, "passwd")
+    group_file = os.path.join(base_dir, "group")
+    local_home = os.path.join(base_dir, "home")
+    if not os.path.exists(passwd_file):
+        with nodestate.lock(USER_STATE):
+            if not os.path.exists(passwd_file):
+                _write_user_files(base_dir, passwd_file, group_file, local_home, user, group)
+    out = ["%s:/etc/passwd:ro" % passwd_file, "%s:/etc/group:ro" % group_file]
+    if not _is_mounted(home_dir(), cur_mounts or []):
+        out.append("%s:%s" % (local_home, home_dir()))
+    return out
+
+def _is_mounted(dname, cur_mounts):
+    """Check if a directory inside the container is a mount point or within one.
+    """
+    for m in cur_mounts:
+        dest = os.path.normpath(m.split(":")[1])
+        if dname == dest or dname.startswith(dest.rstrip("/") + "/"):
+            return True
+    return False
+
+def _write_user_files(base_dir, passwd_file, group_file, local_home, user, group):
+    for d in [base_dir, local_home]:
+        if not os.path.exists(d):
+            os.makedirs(d)
+    passwd = ["root:x:0:0:root:/root:/bin/bash",
+              "nobody:x:65534:65534:nobody:/nonexistent:/usr/sbin/nologin"]
+    groups = ["root:x:0:", "nogroup:x:65534:"]
+    if user.pw_uid != 0:
+        passwd.append("%s:x:%s:%s:%s:%s:/bin/bash" % (user.pw_name, user.pw_uid, group.gr_gid,
+                                                      user.pw_name, home_dir()))
+    if group.gr_gid != 0:
+        groups.append("%s:x:%s:%s" % (group.gr_name, group.gr_gid, user.pw_name))
+    for fname, lines in [(group_file, groups), (passwd_file, passwd)]:
+        tx_file = "%s.%s.tmp" % (fname, os.getpid())
+        with open(tx_file, "w") as out_handle:
+            out_handle.write("\n".join(lines) + "\n")
+        os.rename(tx_file, fname)
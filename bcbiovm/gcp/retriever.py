@@ -1,6 +1,5 @@
 """Integration with Google Cloud Storage, using gsutil.
 """
-import fnmatch
 import io
 import os
 import subprocess
@@ -8,6 +7,7 @@ import subprocess
 import toolz as tz
 
 from bcbio import utils
+from bcbiovm.shared import catalog
 from bcbiovm.shared import retriever as sret
 
 # ## Google Cloud specific functionality
@@ -51,29 +51,27 @@ def _open_remote(file_ref):
     """
     return io.StringIO(_run_gsutil(["cat", file_ref]).decode())
 
-def _find_file(config, prefix=None):
+def _find_file(config, prefix=None, remote_files_fn=None):
     """Resolve a file in the remote files.
 
     prefix allows queries for directories like reference locations.
-    Looks for exact matches then tries to find a file recursively in a folder
+    Looks for exact matches then tries to find a file recursively in a folder.
+    remote_files_fn retrieves the listing, for reuse by other object stores.
     """
-    remote_files = _get_remote_files(config)
-
-    def glob_match(f1, f2):
-        """Check for wildcard glob style matches.
-        """
-        if f1.find("*") >= 0:
-            if fnmatch.fnmatch(f2, "*/%s" % f1):
-                return True
+    remote_files = (remote_files_fn or _get_remote_files)(config)
+    files = catalog.get("paths", remote_files)
 
     def get_file(f):
         # find any files as prefixes, exact matches or globs
-        out = []
-        for fname in remote_files:
-            if prefix and fname.startswith(os.path.join(prefix, f)):
-                out = [os.path.join(prefix, f)]
-            elif fname == f or glob_match(f, fname) or fname.endswith("/" + f):
-                out.append(fname)
+        matches = set(files.exact(f)) | set(files.endswith(f))
+        if f.find("*") >= 0:
+            matches |= set(files.glob(f))
+        matches = sorted(matches)
+        prefix_matches = files.startswith(os.path.join(prefix, f)) if prefix else []
+        if prefix_matches:
+            out = [os.path.join(prefix, f)] + [files.paths[i] for i in matches if i > prefix_matches[-1]]
+        else:
+            out = [files.paths[i] for i in matches]
         if len(out) == 1:
             return out[0]
         elif len(out) > 1:
@@ -81,14 +79,10 @@ def _find_file(config, prefix=None):
     return get_file
 
 def _list(config):
-    remote_files = _get_remote_files(config)
+    files = catalog.get("paths", _get_remote_files(config))
 
     def do(d):
-        out = []
-        for fname in remote_files:
-            if fname.startswith(d):
-                out.append(fname)
-        return out
+        return [files.paths[i] for i in files.startswith(d)]
     return do
 
 # ## API: General functionality
@@ -24,7 +24,9 @@ def _get_ipython_cmdline(args):
         cmd += ["-r", "timelimit=0"]
     for opt_arg in ["timeout", "retries", "tag", "tmpdir", "fcdir", "systemconfig"]:
         if getattr(args, opt_arg):
-            cmd += ["--%s" % opt_arg, str(getattr(args, opt_arg))]
+            cmd += ["--%s" % opt_arg.replace("_", "-"), str(getattr(args, opt_arg))]
+    for setting in args.stage:
+        cmd += ["--stage", setting]
     return " ".join(cmd)
 
 def submit_script(args):
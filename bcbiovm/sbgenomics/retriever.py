@@ -7,6 +7,7 @@ import shutil
 
 import toolz as tz
 
+from bcbiovm.shared import catalog
 from bcbiovm.shared import retriever as sret
 
 # ## Seven Bridges specific functionality
@@ -92,26 +93,20 @@ def _open_remote(config):
     return _do
 
 def _find_file(config, startswith=False):
-    remote_files = _get_remote_files(config)
+    files = catalog.get("paths", _get_remote_files(config))
     def get_file(f):
         if _is_remote(f):
             f = _get_id_fname(f)[-1]
-        for fname, fid in remote_files:
-            if fname == f:
-                return "%s:%s/%s" % (KEY, fid, fname)
-            elif startswith and fname.startswith(f):
-                return "%s:%s/%s" % (KEY, fid, f)
+        matches = files.startswith(f) if startswith else files.exact(f)
+        if matches:
+            return "%s:%s/%s" % (KEY, files.values[matches[0]], f)
     return get_file
 
 def _list(config):
-    remote_files = _get_remote_files(config)
+    files = catalog.get("paths", _get_remote_files(config))
     def do(d):
-        out = []
-        dfname = _get_id_fname(d)[-1]
-        for fname, fid in remote_files:
-            if fname.startswith(dfname):
-                out.append("%s:%s/%s" % (KEY, fid, fname))
-        return out
+        return ["%s:%s/%s" % (KEY, files.values[i], files.paths[i])
+                for i in files.startswith(_get_id_fname(d)[-1])]
     return do
 
 # ## API: General functionality
@@ -0,0 +1,125 @@
+"""Indexed catalog of remote file listings, for resolving inputs in retrievers.
+
+Retrievers resolve sample and reference files against a listing of every file
+in remote buckets, folders or collections. Checking each query against every
+listed file is slow for large inputs against large buckets, so the catalog
+indexes a listing once for lookups by:
+
+  exact       full path, with a hash map
+  basename    file name, with a hash map
+  endswith    paths ending with "/name", using a suffix trie of reversed path components
+  startswith  directory or path prefixes, using a sorted list of paths
+  glob        paths matching "*/pattern", narrowing candidates to file names ending
+              with the literal end of the pattern, using a sorted list of reversed names
+
+Queries return indexes into the listing in listing order, so retrievers keep
+their existing preference for earlier matches.
+
+`get` caches catalogs for reuse across queries against the same listing, keeping
+recently used catalogs up to BCBIO_VM_CATALOG_ENTRIES (default 5000000) total
+listed files.
+"""
+import bisect
+import collections
+import fnmatch
+import os
+import re
+
+class Catalog(object):
+    """Index of (path, value) entries from a remote file listing.
+    """
+    _END = None
+
+    def __init__(self, entries):
+        self.paths = []
+        self.values = []
+        for entry in entries:
+            path, value = entry if isinstance(entry, (list, tuple)) else (entry, None)
+            self.paths.append(path)
+            self.values.append(value)
+        self._by_path = {}
+        self._by_basename = {}
+        self._suffixes = {}
+        for i, path in enumerate(self.paths):
+            self._by_path.setdefault(path, []).append(i)
+            parts = path.split("/")
+            self._by_basename.setdefault(parts[-1], []).append(i)
+            node = self._suffixes
+            for depth, part in enumerate(reversed(parts)):
+                node = node.setdefault(part, {})
+                # Only paths with further components end with "/" plus the components so far
+                if depth < len(parts) - 1:
+                    node.setdefault(self._END, []).append(i)
+        self._sorted = sorted((p, i) for i, p in enumerate(self.paths))
+        self._reversed_names = sorted(name[::-1] for name in self._by_basename)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def exact(self, path):
+        return list(self._by_path.get(path, []))
+
+    def basename(self, name):
+        return list(self._by_basename.get(name, []))
+
+    def endswith(self, name):
+        """Retrieve entries with paths ending in "/name".
+        """
+        node = self._suffixes
+        for part in reversed(name.split("/")):
+            node = node.get(part)
+            if node is None:
+                return []
+        return list(node.get(self._END, []))
+
+    def startswith(self, prefix):
+        """Retrieve entries with paths starting with a prefix, like a directory.
+        """
+        out = []
+        for path, i in self._sorted[bisect.bisect_left(self._sorted, (prefix,)):]:
+            if not path.startswith(prefix):
+                break
+            out.append(i)
+        return sorted(out)
+
+    def glob(self, pattern):
+        """Retrieve entries with paths matching a glob, anywhere below the top level.
+
+        Matches fnmatch of "*/pattern". Narrows candidates to basenames ending with
+        any literal text at the end of the pattern before checking full paths.
+        """
+        tail = re.split(r"[*?\[\]]", pattern)[-1].rsplit("/", 1)[-1]
+        full_pattern = "*/%s" % pattern
+        out = []
+        for name in self._names_ending(tail):
+            out.extend(i for i in self._by_basename[name] if fnmatch.fnmatchcase(self.paths[i], full_pattern))
+        return sorted(out)
+
+    def _names_ending(self, tail):
+        """Retrieve basenames ending with tail, as the range of reversed names starting with it reversed.
+        """
+        rtail = tail[::-1]
+        i = bisect.bisect_left(self._reversed_names, rtail)
+        while i < len(self._reversed_names) and self._reversed_names[i].startswith(rtail):
+            yield self._reversed_names[i][::-1]
+            i += 1
+
+_cache = collections.OrderedDict()
+
+def get(name, listing, entries_fn=None):
+    """Retrieve a catalog for a remote listing, building it once per listing.
+
+    name distinguishes catalogs built from the same listing with different
+    entries_fn, which converts the listing into (path, value) entries. Least
+    recently used catalogs drop once cached catalogs exceed the entry limit.
+    """
+    key = (name, id(listing), len(listing))
+    if key in _cache:
+        _cache[key] = _cache.pop(key)
+    else:
+        # Keep a reference to the listing so its id is not reused while cached
+        _cache[key] = (listing, Catalog(entries_fn(listing) if entries_fn else listing))
+        max_entries = int(os.environ.get("BCBIO_VM_CATALOG_ENTRIES", 5000000))
+        while len(_cache) > 1 and sum(len(c) for _, c in _cache.values()) > max_entries:
+            _cache.popitem(last=False)
+    return _cache[key][1]
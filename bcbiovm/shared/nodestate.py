@@ -0,0 +1,69 @@
+"""Small JSON state files shared between bcbio_vm processes on a single node.
+
+Stored in node-local temporary space, so concurrent runfn processes and IPython
+engines on a machine can share lookups and resources. Writes are atomic and
+callers coordinate read-modify-write updates with `lock`.
+"""
+import contextlib
+import fcntl
+import json
+import os
+import tempfile
+
+def state_dir():
+    """Retrieve the node-local state directory for the current user.
+    """
+    out_dir = os.environ.get("BCBIO_VM_NODE_DIR",
+                             os.path.join(tempfile.gettempdir(), "bcbio-vm-%s" % os.getuid()))
+    if not os.path.exists(out_dir):
+        try:
+            os.makedirs(out_dir)
+        except OSError:
+            if not os.path.isdir(out_dir):
+                raise
+    return out_dir
+
+def state_file(name):
+    return os.path.join(state_dir(), "%s.json" % name)
+
+@contextlib.contextmanager
+def lock(name):
+    """Exclusive lock on a named state file, across processes on this node.
+    """
+    with open(state_file(name) + ".lock", "w") as lock_handle:
+        fcntl.flock(lock_handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_handle, fcntl.LOCK_UN)
+
+def read(name):
+    cur_file = state_file(name)
+    if os.path.exists(cur_file):
+        try:
+            with open(cur_file) as in_handle:
+                return json.load(in_handle)
+        except ValueError:
+            pass
+    return {}
+
+def write(name, data):
+    """Atomically replace a state file so readers never see partial writes.
+    """
+    cur_file = state_file(name)
+    tx_file = "%s.%s.tmp" % (cur_file, os.getpid())
+    with open(tx_file, "w") as out_handle:
+        json.dump(data, out_handle)
+    os.rename(tx_file, cur_file)
+
+def active(state):
+    """Keep entries keyed by "<pid>-<id>" whose process is still running.
+    """
+    out = {}
+    for key, info in state.items():
+        try:
+            os.kill(int(key.split("-")[0]), 0)
+        except OSError:
+            continue
+        out[key] = info
+    return out
@@ -0,0 +1,84 @@
+"""Read and write function arguments and outputs passed between bcbio processes.
+
+Argument files for multi-sample functions carry full configuration and resource
+dictionaries, so serialization speed matters. YAML uses the libyaml C loaders
+and dumpers when PyYAML is built with them. JSON and msgpack are faster
+alternatives for files passed between host processes, selected by file
+extension or with `serialize_format` in Clusterk wrapper arguments, set with
+`bcbio_vm.py clusterk --serialize-format`.
+
+Argument files passed into containers are always YAML: bcbio_nextgen.py runfn
+treats JSON argument files as CWL inputs and writes CWL outputs for them.
+"""
+import json
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as _YamlLoader, CSafeDumper as _YamlDumper
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader, SafeDumper as _YamlDumper
+
+FORMAT_KEY = "serialize_format"
+EXTENSIONS = {"yaml": ".yaml", "json": ".json", "msgpack": ".msgpack"}
+_EXT_FORMATS = {".yaml": "yaml", ".yml": "yaml", ".json": "json", ".msgpack": "msgpack", ".mpk": "msgpack"}
+
+def get_format(fname=None, parallel=None, default="yaml"):
+    """Retrieve serialization format from a file extension or a configuration with `serialize_format`.
+    """
+    if fname:
+        for ext, fmt in _EXT_FORMATS.items():
+            if fname.endswith(ext):
+                return fmt
+    fmt = (parallel or {}).get(FORMAT_KEY) or default
+    if fmt not in EXTENSIONS:
+        raise ValueError("Unexpected serialization format %s, expected one of: %s" %
+                         (fmt, ", ".join(sorted(EXTENSIONS.keys()))))
+    return fmt
+
+def extension(fmt):
+    return EXTENSIONS[fmt]
+
+def read(fname, fmt=None):
+    fmt = fmt or get_format(fname)
+    if fmt == "msgpack":
+        msgpack = _get_msgpack()
+        with open(fname, "rb") as in_handle:
+            return msgpack.unpackb(in_handle.read(), raw=False)
+    with open(fname) as in_handle:
+        return loads(in_handle.read(), fmt)
+
+def write(data, fname, fmt=None):
+    fmt = fmt or get_format(fname)
+    if fmt == "msgpack":
+        msgpack = _get_msgpack()
+        with open(fname, "wb") as out_handle:
+            out_handle.write(msgpack.packb(data, use_bin_type=True))
+    else:
+        with open(fname, "w") as out_handle:
+            out_handle.write(dumps(data, fmt))
+    return fname
+
+def loads(data, fmt="yaml"):
+    if fmt == "json":
+        return json.loads(data)
+    elif fmt == "msgpack":
+        return _get_msgpack().unpackb(data, raw=False)
+    else:
+        return yaml.load(data, Loader=_YamlLoader)
+
+def dumps(data, fmt="yaml"):
+    if fmt == "json":
+        return json.dumps(data)
+    elif fmt == "msgpack":
+        return _get_msgpack().packb(data, use_bin_type=True)
+    else:
+        return yaml.dump(data, Dumper=_YamlDumper, default_flow_style=False, allow_unicode=False)
+
+def _get_msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise ImportError("msgpack serialization requires the msgpack python library: "
+                          "conda install msgpack-python")
+    return msgpack
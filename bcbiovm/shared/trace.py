@@ -0,0 +1,83 @@
+"""Record timing of processing phases as Chrome trace-event JSON.
+
+Tracing is enabled with `setup`, either from a `--trace` command line file or
+the BCBIO_VM_TRACE environment variable. The output opens in chrome://tracing
+or https://ui.perfetto.dev. Include `{pid}` in the file name to write separate
+traces from multiple processes, like IPython engines, sharing an environment.
+
+When tracing is off `span` only checks a single value, so instrumented code
+pays almost nothing. Events are appended to the output in the JSON array trace
+format, which viewers read without the closing bracket, so long running
+processes flush them as they go instead of holding every span until exit.
+"""
+import atexit
+import contextlib
+import json
+import os
+import threading
+import time
+
+ENV_VAR = "BCBIO_VM_TRACE"
+MAX_EVENTS = 1000
+
+_state = {"out_file": None, "events": [], "started": False}
+_lock = threading.Lock()
+
+def setup(out_file=None):
+    """Enable tracing to the given output file, falling back to the environment.
+    """
+    out_file = out_file or os.environ.get(ENV_VAR)
+    if out_file and not _state["out_file"]:
+        _state["out_file"] = os.path.abspath(out_file.replace("{pid}", str(os.getpid())))
+        atexit.register(write)
+    return _state["out_file"]
+
+def is_enabled():
+    return _state["out_file"] is not None
+
+@contextlib.contextmanager
+def span(name, **args):
+    """Trace a phase of processing. Spans nest, giving nested timings in the output.
+    """
+    if _state["out_file"] is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        event = {"name": name, "ph": "X", "cat": "bcbiovm",
+                 "ts": int(start * 1e6), "dur": int((time.time() - start) * 1e6),
+                 "pid": os.getpid(), "tid": threading.current_thread().ident}
+        if args:
+            event["args"] = {k: str(v) for k, v in args.items()}
+        with _lock:
+            _state["events"].append(event)
+        if len(_state["events"]) >= MAX_EVENTS:
+            flush()
+
+def flush():
+    """Append collected trace events to the output file, starting a new file on the first flush.
+    """
+    with _lock:
+        if not _state["out_file"] or not _state["events"]:
+            return _state["out_file"]
+        events, _state["events"] = _state["events"], []
+        if not _state["started"]:
+            out_dir = os.path.dirname(_state["out_file"])
+            if out_dir and not os.path.exists(out_dir):
+                os.makedirs(out_dir)
+        with open(_state["out_file"], "a" if _state["started"] else "w") as out_handle:
+            out_handle.write(",\n" if _state["started"] else "[\n")
+            out_handle.write(",\n".join(json.dumps(e) for e in events))
+        _state["started"] = True
+    return _state["out_file"]
+
+def write():
+    """Write remaining trace events at exit, closing the JSON array.
+    """
+    flush()
+    if _state["started"]:
+        with open(_state["out_file"], "a") as out_handle:
+            out_handle.write("\n]\n")
+    return _state["out_file"]
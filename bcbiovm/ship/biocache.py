@@ -0,0 +1,150 @@
+"""Node-local cache of biodata files retrieved from S3.
+
+Without a cache, each runfn on a node downloads genome indexes again into its
+own working directory. Cached files are keyed by bucket, key, ETag and size, so
+files updated in the bucket are retrieved again, and are hardlinked into each
+task's directory. A lock on each file lets concurrent containers on a node
+share a single download. Least recently used files are removed when the cache
+grows past its maximum size. Enable by setting a cache directory on the same
+filesystem as task working directories:
+
+  BCBIO_VM_BIODATA_CACHE=/mnt/work/biodata-cache  cache directory (unset or 0 disables)
+  BCBIO_VM_BIODATA_CACHE_SIZE=100                 maximum cache size in GB
+
+Files on a different filesystem from the cache download directly, bypassing
+the cache, since they cannot be hardlinked and symlinks into the cache would
+not resolve inside containers. The maximum size limits files held by the
+cache: evicted files still hardlinked into task directories keep using disk
+space until those directories are removed.
+"""
+import contextlib
+import fcntl
+import os
+import shutil
+import time
+import uuid
+
+from bcbiovm.shared import nodestate
+
+CACHE_STATE = "biodata-cache"
+
+def is_enabled():
+    return os.environ.get("BCBIO_VM_BIODATA_CACHE", "").lower() not in ["", "0", "false", "no"]
+
+def cache_dir():
+    return os.environ["BCBIO_VM_BIODATA_CACHE"]
+
+def max_size():
+    return int(float(os.environ.get("BCBIO_VM_BIODATA_CACHE_SIZE", 100)) * 1024 * 1024 * 1024)
+
+def key_info(bucket_name, keynames):
+    """Retrieve ETag and size of S3 keys, listing each folder once.
+    """
+    import boto
+    bucket = boto.connect_s3().get_bucket(bucket_name, validate=False)
+    keynames = set(keynames)
+    out = {}
+    for folder in set(os.path.dirname(k) for k in keynames):
+        for key in bucket.list(prefix="%s/" % folder if folder else "", delimiter="/"):
+            if key.name in keynames:
+                out[key.name] = (key.etag.strip('"'), int(key.size))
+    return out
+
+def fetch_fn(info, download_fn):
+    """Wrap a download function to retrieve files through the node cache.
+
+    download_fn takes the output file, key name, bucket and retries, like
+    reconstitute._transfer_s3. Keys missing from info, or with outputs on a
+    different filesystem from the cache, are downloaded directly.
+    """
+    def _fetch(out_fname, keyname, bucket, retries=0):
+        _safe_makedir(cache_dir())
+        _safe_makedir(os.path.dirname(out_fname) or ".")
+        if keyname not in info or not _same_device(cache_dir(), os.path.dirname(out_fname) or "."):
+            return download_fn(out_fname, keyname, bucket, retries)
+        etag, size = info[keyname]
+        cache_file = os.path.join(cache_dir(), bucket, os.path.dirname(keyname),
+                                  "%s-%s-%s" % (etag, size, os.path.basename(keyname)))
+        _safe_makedir(os.path.dirname(cache_file))
+        with _file_lock(cache_file):
+            if os.path.exists(cache_file) and os.path.getsize(cache_file) != size:
+                os.remove(cache_file)
+            if not os.path.exists(cache_file):
+                download_fn(cache_file, keyname, bucket, retries)
+            _record_access(cache_file, size)
+            _link(cache_file, out_fname)
+        evict()
+    return _fetch
+
+def _same_device(dname1, dname2):
+    return os.stat(dname1).st_dev == os.stat(dname2).st_dev
+
+def evict():
+    """Remove least recently used files until the cache fits in the maximum size.
+
+    Skips files locked by another process, which are being downloaded or linked.
+    """
+    limit = max_size()
+    with nodestate.lock(CACHE_STATE):
+        state = dict((f, v) for f, v in nodestate.read(CACHE_STATE).items() if os.path.exists(f))
+        total = sum(v["size"] for v in state.values())
+        for fname, info in sorted(state.items(), key=lambda x: x[1]["atime"]):
+            if total <= limit:
+                break
+            if _remove_unlocked(fname):
+                total -= info["size"]
+                del state[fname]
+        nodestate.write(CACHE_STATE, state)
+
+def _record_access(fname, size):
+    with nodestate.lock(CACHE_STATE):
+        state = nodestate.read(CACHE_STATE)
+        state[fname] = {"size": size, "atime": time.time()}
+        nodestate.write(CACHE_STATE, state)
+
+def _link(cache_file, out_fname):
+    """Hardlink a cached file into place, copying it if hardlinks fail on the same filesystem.
+
+    Never symlinks, since the cache directory is not mounted into containers
+    and eviction would leave dangling links.
+    """
+    tx_fname = "%s.%s.tmp" % (out_fname, uuid.uuid4())
+    try:
+        try:
+            os.link(cache_file, tx_fname)
+        except OSError:
+            shutil.copyfile(cache_file, tx_fname)
+        os.rename(tx_fname, out_fname)
+    finally:
+        if os.path.exists(tx_fname):
+            os.remove(tx_fname)
+
+@contextlib.contextmanager
+def _file_lock(fname):
+    with open(fname + ".lock", "w") as lock_handle:
+        fcntl.flock(lock_handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_handle, fcntl.LOCK_UN)
+
+def _remove_unlocked(fname):
+    with open(fname + ".lock", "w") as lock_handle:
+        try:
+            fcntl.flock(lock_handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            return False
+        try:
+            if os.path.exists(fname):
+                os.remove(fname)
+            return True
+        finally:
+            fcntl.flock(lock_handle, fcntl.LOCK_UN)
+
+def _safe_makedir(dname):
+    if not os.path.exists(dname):
+        try:
+            os.makedirs(dname)
+        except OSError:
+            if not os.path.isdir(dname):
+                raise
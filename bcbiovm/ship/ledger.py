@@ -0,0 +1,128 @@
+"""Record file transfers from packing, unpacking and staging as a JSONL ledger.
+
+Each process writes records to `transfers/<host>-<pid>.jsonl` in the work
+directory, with one record per file:
+
+  op          s3_put, s3_get or copy
+  src, dst    source and destination file or S3 key
+  bytes       bytes transferred
+  duration    seconds taken
+  throughput  bytes per second
+  skipped     true if already present at the destination
+  method      copy method used (rename, reflink, copy_file_range...), for copies
+  task        function name running the transfer
+  node        host name
+
+Recording happens within `context`, set when running a function. Transfers in
+worker threads pass along the context from `current`. `bcbio_vm.py transfers
+summary` aggregates the ledger by function and node.
+"""
+from __future__ import print_function
+import collections
+import contextlib
+import glob
+import json
+import os
+import socket
+import threading
+import time
+
+LEDGER_DIR = "transfers"
+
+_context = threading.local()
+_lock = threading.Lock()
+
+@contextlib.contextmanager
+def context(work_dir, task):
+    """Record transfers from this thread into the work directory ledger, labelled by task.
+    """
+    prev = current()
+    _context.info = {"work_dir": work_dir, "task": task}
+    try:
+        yield
+    finally:
+        _context.info = prev
+
+def current():
+    """Retrieve the ledger context for this thread, to pass to worker threads.
+    """
+    return getattr(_context, "info", None)
+
+def ledger_file(work_dir):
+    return os.path.join(work_dir, LEDGER_DIR, "%s-%s.jsonl" % (socket.gethostname(), os.getpid()))
+
+def record(op, src, dst, nbytes, duration, skipped=False, method=None, ctx=None):
+    """Append a transfer to the ledger, if recording in the current or given context.
+    """
+    ctx = ctx or current()
+    if not ctx or not ctx.get("work_dir"):
+        return
+    rec = {"op": op, "src": src, "dst": dst, "bytes": nbytes, "duration": round(duration, 4),
+           "throughput": round(nbytes / duration, 1) if duration > 0 else None,
+           "skipped": skipped, "task": ctx.get("task"), "node": socket.gethostname(),
+           "time": time.time()}
+    if method:
+        rec["method"] = method
+    out_file = ledger_file(ctx["work_dir"])
+    with _lock:
+        if not os.path.exists(os.path.dirname(out_file)):
+            try:
+                os.makedirs(os.path.dirname(out_file))
+            except OSError:
+                if not os.path.isdir(os.path.dirname(out_file)):
+                    raise
+        with open(out_file, "a") as out_handle:
+            out_handle.write(json.dumps(rec) + "\n")
+
+def read(work_dir):
+    """Retrieve all records from ledgers in a work directory.
+    """
+    for fname in sorted(glob.glob(os.path.join(work_dir, LEDGER_DIR, "*.jsonl"))):
+        with open(fname) as in_handle:
+            for line in in_handle:
+                line = line.strip()
+                if line:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        pass
+
+def summarize(records, key):
+    """Aggregate records by a key, like task or node.
+    """
+    out = collections.OrderedDict()
+    for rec in records:
+        cur = out.setdefault((rec.get(key) or "unknown", rec["op"]),
+                             {"files": 0, "skipped": 0, "bytes": 0, "duration": 0.0})
+        cur["files"] += 1
+        if rec.get("skipped"):
+            cur["skipped"] += 1
+        else:
+            cur["bytes"] += rec.get("bytes") or 0
+            cur["duration"] += rec.get("duration") or 0.0
+    return out
+
+# ## Command line
+
+def setup_cmd(subparsers):
+    parser_sub = subparsers.add_parser("transfers", help="Summarize file transfers recorded during runs")
+    parser_t = parser_sub.add_subparsers(title="[transfer ledger actions]")
+    parser = parser_t.add_parser("summary", help="Summarize transfers by function and node")
+    parser.add_argument("--workdir", default=os.getcwd(),
+                        help="Work directory of the run, containing the transfers ledger")
+    parser.set_defaults(func=summary)
+
+def summary(args):
+    records = list(read(args.workdir))
+    if not records:
+        print("No transfers recorded in %s" % os.path.join(args.workdir, LEDGER_DIR))
+        return
+    for key, title in [("task", "function"), ("node", "node")]:
+        print("%-30s %-7s %7s %8s %12s %10s %10s" % (title, "op", "files", "skipped", "Mb", "time(s)", "Mb/s"))
+        for (name, op), info in sorted(summarize(records, key).items(),
+                                       key=lambda x: x[1]["duration"], reverse=True):
+            mb = info["bytes"] / (1024.0 * 1024.0)
+            print("%-30s %-7s %7s %8s %12.1f %10.1f %10s" %
+                  (name, op, info["files"], info["skipped"], mb, info["duration"],
+                   "%.1f" % (mb / info["duration"]) if info["duration"] > 0 else "-"))
+        print()
@@ -1,27 +1,61 @@
 """Prepare a running process to execute remotely, moving files as necessary to shared infrastructure.
+
+With content addressed S3 packing, files are stored once per bucket under the
+SHA-256 of their contents and a manifest, passed along with the arguments, maps
+logical S3 paths to content keys. Shipping unchanged inputs from multiple runs
+or directories only updates the manifest.
+
+With bundling, files smaller than the bundle size in each folder are shipped
+together as a single uncompressed tar object. An index of each file's bundle,
+data offset and size travels with the arguments, so reconstitute retrieves
+each bundle once and extracts files locally.
 """
+import collections
+import hashlib
+import io
 import os
+import shutil
 import subprocess
+import tarfile
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
 
 import toolz as tz
 
 from bcbio import utils
 from bcbiovm.docker import remap
+from bcbiovm.shared import nodestate
+from bcbiovm.ship import ledger
 from bcbio.pipeline import config_utils
 
-def shared_filesystem(workdir, datadir, tmpdir=None):
+CAS_FOLDER = "cas/sha256"
+MANIFEST_KEY = "pack_manifest"
+BUNDLE_KEY = "pack_bundles"
+HASH_STATE = "content-hashes"
+
+def shared_filesystem(workdir, datadir, tmpdir=None, staging=None):
     """Enable running processing within an optional temporary directory.
 
     workdir is assumed to be available on a shared filesystem, so we don't
-    require any work to prepare.
+    require any work to prepare. staging holds thresholds for deciding which
+    inputs copy into tmpdir, see bcbiovm.ship.staging.
     """
-    return {"type": "shared", "workdir": workdir, "tmpdir": tmpdir, "datadir": datadir}
+    return {"type": "shared", "workdir": workdir, "tmpdir": tmpdir, "datadir": datadir,
+            "staging": staging or {}}
 
-def prep_s3(biodata_bucket, run_bucket, output_folder):
+def prep_s3(biodata_bucket, run_bucket, output_folder, content_addressed=False, bundle_size=None):
     """Prepare configuration for shipping to S3.
+
+    bundle_size, in bytes, bundles smaller files in each folder into a single object.
     """
-    return {"type": "S3", "buckets": {"run": run_bucket, "biodata": biodata_bucket},
-            "folders": {"output": output_folder}}
+    out = {"type": "S3", "buckets": {"run": run_bucket, "biodata": biodata_bucket},
+           "folders": {"output": output_folder}}
+    if content_addressed:
+        out["content_addressed"] = True
+    if bundle_size:
+        out["bundle_size"] = int(bundle_size)
+    return out
 
 def send_run(args, config):
     if config.get("type") == "S3":
@@ -52,12 +86,31 @@ def send_output(config, out_file):
 
 def to_s3(args, config):
     """Ship required processing files to S3 for running on non-shared filesystem Amazon instances.
+
+    Plans all transfers up front, listing each destination folder once to find
+    existing keys, then uploads missing files simultaneously with
+    BCBIO_VM_S3_THREADS (default 8) uploads at once.
     """
     import boto
     dir_to_s3 = _prep_s3_directories(args, config["buckets"])
     conn = boto.connect_s3()
-    args = _remove_empty(remap.walk_files(args, _remap_and_ship(conn), dir_to_s3, pass_dirs=True))
-    return args
+    threads = int(os.environ.get("BCBIO_VM_S3_THREADS", 8))
+    bundle_dir = tempfile.mkdtemp(prefix="bcbio-bundles-")
+    try:
+        transfers, manifest, bundles = _plan_s3_transfers(conn, args, dir_to_s3, config.get("content_addressed"),
+                                                          threads, config.get("bundle_size"), bundle_dir)
+        _ship_s3(transfers, threads)
+    finally:
+        shutil.rmtree(bundle_dir, ignore_errors=True)
+    args = remap.walk_files(args, _remap_s3, dir_to_s3, pass_dirs=True)
+    if manifest or bundles:
+        datai, data = config_utils.get_dataarg(args)
+        if manifest:
+            data[MANIFEST_KEY] = manifest
+        if bundles:
+            data[BUNDLE_KEY] = bundles
+        args[datai] = data
+    return _remove_empty(args)
 
 def _remove_empty(xs):
     """Remove null values in a nested set of arguments, eliminates unpassed values in S3.
@@ -90,28 +143,191 @@ def _get_s3_bucket(conn, bucket_name):
             raise
     return bucket
 
-def _remap_and_ship(conn):
-    """Remap a file into an S3 bucket and key, shipping if not present.
+def _remap_s3(orig_fname, context, remap_dict):
+    """Remap a file into an S3 bucket and key.
+    """
+    if os.path.isfile(orig_fname):
+        dirname = os.path.normpath(os.path.dirname(os.path.abspath(orig_fname)))
+        store = remap_dict[dirname]
+        s3_name = "s3://%s/%s/%s" % (store["bucket"], store["folder"], os.path.basename(orig_fname))
+    # Drop directory information since we only deal with files in S3
+    else:
+        s3_name = None
+    return s3_name
+
+def _plan_s3_transfers(conn, args, dir_to_s3, content_addressed=False, threads=1,
+                       bundle_size=None, bundle_dir=None):
+    """Retrieve files, plus indexes, not yet present in S3 as (fname, bucket, keyname).
 
-    Uploads files if not present in the specified bucket, using server side encryption.
-    Uses gof3r for parallel multipart upload.
+    Lists each destination folder once instead of checking every key individually.
+    Also returns the manifest of logical S3 paths to content keys, for content
+    addressed packing, and the index of bundled files, when bundling small files.
     """
-    def _work(orig_fname, context, remap_dict):
+    files = []
+    def _get_files(orig_fname, context, remap_dict):
         if os.path.isfile(orig_fname):
             dirname = os.path.normpath(os.path.dirname(os.path.abspath(orig_fname)))
             store = remap_dict[dirname]
-            bucket = _get_s3_bucket(conn, store["bucket"])
+            # file_plus_index includes expected index names, whether or not they exist
             for fname in utils.file_plus_index(orig_fname):
-                keyname = "%s/%s" % (store["folder"], os.path.basename(fname))
-                key = bucket.get_key(keyname)
-                if not key:
-                    _put_s3(fname, keyname, store["bucket"])
-            s3_name = "s3://%s/%s/%s" % (store["bucket"], store["folder"], os.path.basename(orig_fname))
-        # Drop directory information since we only deal with files in S3
+                if os.path.exists(fname):
+                    files.append((fname, store["bucket"], store["folder"]))
+    remap.walk_files(args, _get_files, dir_to_s3, pass_dirs=True)
+    buckets = {}
+    existing = {}
+    def _is_shipped(bucket_name, folder, keyname):
+        if bucket_name not in buckets:
+            buckets[bucket_name] = _get_s3_bucket(conn, bucket_name)
+        if (bucket_name, folder) not in existing:
+            existing[(bucket_name, folder)] = set(k.name for k in
+                                                  buckets[bucket_name].list(prefix="%s/" % folder))
+        if keyname in existing[(bucket_name, folder)]:
+            return True
+        existing[(bucket_name, folder)].add(keyname)
+        return False
+    out = []
+    bundles = {}
+    if bundle_size:
+        files, bundles, out = _bundle_small_files(files, bundle_size, bundle_dir, _is_shipped)
+    digests = _file_digests(set(x[0] for x in files), threads) if content_addressed else {}
+    manifest = {}
+    for fname, bucket_name, folder in files:
+        keyname = "%s/%s" % (folder, os.path.basename(fname))
+        if content_addressed:
+            content_key = _content_key(digests[fname])
+            manifest["s3://%s/%s" % (bucket_name, keyname)] = content_key
+            folder, keyname = os.path.dirname(content_key), content_key
+        if not _is_shipped(bucket_name, folder, keyname):
+            out.append((fname, bucket_name, keyname))
+        else:
+            ledger.record("s3_put", fname, "s3://%s/%s" % (bucket_name, keyname), os.path.getsize(fname), 0,
+                          skipped=True)
+    return out, manifest, bundles
+
+def _bundle_small_files(files, bundle_size, bundle_dir, is_shipped=None):
+    """Combine files smaller than bundle_size in each folder into tar bundles.
+
+    Returns the remaining files to ship, an index of logical S3 paths to the
+    bundle path, data offset and size, and transfers for bundles not yet in S3.
+    Bundles are named by their contents, so unchanged folders reuse previously
+    shipped bundles without rewriting them locally. Bundles keep this name with
+    content addressed packing, since the name already identifies the contents.
+    """
+    by_folder = collections.OrderedDict()
+    out = []
+    for fname, bucket_name, folder in files:
+        if os.path.getsize(fname) < bundle_size:
+            by_folder.setdefault((bucket_name, folder), collections.OrderedDict())[os.path.basename(fname)] = fname
+        else:
+            out.append((fname, bucket_name, folder))
+    index = {}
+    transfers = []
+    for (bucket_name, folder), members in by_folder.items():
+        if len(members) < 2:
+            out.extend((fname, bucket_name, folder) for fname in members.values())
+            continue
+        members = sorted(members.items())
+        h = hashlib.sha1()
+        for name, fname in members:
+            st = os.stat(fname)
+            h.update(("%s\t%s\t%s\n" % (name, st.st_size, st.st_mtime)).encode())
+        bundle_base = "bcbio-bundle-%s.tar" % h.hexdigest()
+        keyname = "%s/%s" % (folder, bundle_base)
+        bundle_name = "s3://%s/%s" % (bucket_name, keyname)
+        offsets = _bundle_offsets(members)
+        for name, offset, size in offsets:
+            index["s3://%s/%s/%s" % (bucket_name, folder, name)] = [bundle_name, offset, size]
+        if is_shipped and is_shipped(bucket_name, folder, keyname):
+            ledger.record("s3_put", os.path.dirname(members[0][1]), bundle_name,
+                          sum(x[2] for x in offsets), 0, skipped=True)
+            continue
+        bundle_file = os.path.join(bundle_dir, folder.replace("/", "_"), bundle_base)
+        if not os.path.exists(os.path.dirname(bundle_file)):
+            os.makedirs(os.path.dirname(bundle_file))
+        with tarfile.open(bundle_file, "w") as tar:
+            for name, fname in members:
+                tar.add(fname, arcname=name, recursive=False)
+        transfers.append((bundle_file, bucket_name, keyname))
+    return out, index, transfers
+
+def _bundle_offsets(members):
+    """Retrieve the name, data offset and size of each member as written to a bundle.
+
+    Sums the header and padded data blocks tarfile writes, so the index is
+    available without building bundles that are already in S3.
+    """
+    tar = tarfile.open(fileobj=io.BytesIO(), mode="w")
+    offset = 0
+    out = []
+    for name, fname in members:
+        info = tar.gettarinfo(fname, arcname=name)
+        offset += len(info.tobuf(tar.format, tar.encoding, tar.errors))
+        out.append((info.name, offset, info.size))
+        offset += -(-info.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+    return out
+
+def _content_key(digest):
+    return "%s/%s/%s" % (CAS_FOLDER, digest[:2], digest)
+
+def _file_digests(fnames, threads=1):
+    """Retrieve SHA-256 digests of files, streaming contents in blocks.
+
+    Digests are cached on the node by path, size and modification time, so
+    re-shipping unchanged files does not read them again.
+    """
+    def _stat_key(fname):
+        st = os.stat(fname)
+        return [st.st_size, st.st_mtime]
+    with nodestate.lock(HASH_STATE):
+        cache = nodestate.read(HASH_STATE)
+    out = {}
+    need = []
+    for fname in fnames:
+        cached = cache.get(os.path.abspath(fname))
+        if cached and cached[:2] == _stat_key(fname):
+            out[fname] = cached[2]
         else:
-            s3_name = None
-        return s3_name
-    return _work
+            need.append(fname)
+    if need:
+        pool = ThreadPool(max(1, min(threads, len(need))))
+        try:
+            digests = pool.map(_sha256, need)
+        finally:
+            pool.close()
+        with nodestate.lock(HASH_STATE):
+            cache = nodestate.read(HASH_STATE)
+            for fname, digest in zip(need, digests):
+                out[fname] = digest
+                cache[os.path.abspath(fname)] = _stat_key(fname) + [digest]
+            nodestate.write(HASH_STATE, cache)
+    return out
+
+def _sha256(fname):
+    h = hashlib.sha256()
+    with open(fname, "rb") as in_handle:
+        for block in iter(lambda: in_handle.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _ship_s3(transfers, threads):
+    """Upload files to S3 with a bounded number of simultaneous transfers.
+
+    Uses gof3r for parallel multipart upload of each file, with server side encryption.
+    """
+    if not transfers:
+        return
+    ctx = ledger.current()
+    def _do(transfer):
+        fname, bucket, keyname = transfer
+        start = time.time()
+        _put_s3(fname, keyname, bucket)
+        ledger.record("s3_put", fname, "s3://%s/%s" % (bucket, keyname), os.path.getsize(fname),
+                      time.time() - start, ctx=ctx)
+    pool = ThreadPool(max(1, min(threads, len(transfers))))
+    try:
+        pool.map(_do, transfers)
+    finally:
+        pool.close()
 
 def _prep_s3_directories(args, buckets):
     """Map input directories into stable S3 buckets and folders for storing files.
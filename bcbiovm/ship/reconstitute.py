@@ -3,10 +3,13 @@
 Handles copying or linking files into a work directory, running an analysis,
 then handing off outputs to ship back to subsequent processing steps.
 """
+import collections
 import os
 import uuid
-import shutil
 import subprocess
+import threading
+import time
+from multiprocessing.pool import ThreadPool
 
 import toolz as tz
 import yaml
@@ -16,22 +19,29 @@ from bcbio.distributed.transaction import file_transaction
 from bcbio.log import logger
 from bcbio.pipeline import config_utils
 from bcbiovm.docker import remap
+from bcbiovm.ship import biocache, ledger, staging
 from bcbiovm.ship import pack as ship_n_pack
 
 def prep_workdir(pack, parallel, args):
     """Unpack necessary files and directories into a temporary structure for processing
+
+    Returns the work directory, remapped arguments, a finalizer for outputs and
+    directories of inputs used in place, which need mounting into the container.
     """
     if pack["type"] == "shared":
-        workdir, remap_dict, new_args = _create_workdir_shared(pack["workdir"], args, parallel, pack["tmpdir"])
-        return workdir, new_args, _shared_finalizer(new_args, workdir, remap_dict, parallel)
+        workdir, remap_dict, new_args, in_place = _create_workdir_shared(pack["workdir"], args, parallel,
+                                                                         pack["tmpdir"], pack.get("staging"))
+        return workdir, new_args, _shared_finalizer(new_args, workdir, remap_dict, parallel), in_place
     elif pack["type"] == "S3":
         workdir, new_args = _unpack_s3(pack["buckets"]["run"], args)
         datai, data = config_utils.get_dataarg(new_args)
+        data.pop(ship_n_pack.MANIFEST_KEY, None)
+        data.pop(ship_n_pack.BUNDLE_KEY, None)
         if "dirs" not in data:
             data["dirs"] = {}
         data["dirs"]["work"] = workdir
         new_args[datai] = data
-        return workdir, new_args, ship_n_pack.send_run_integrated(pack)
+        return workdir, new_args, ship_n_pack.send_run_integrated(pack), []
     else:
         raise ValueError("Cannot handle work directory preparation type: %s" % pack)
 
@@ -39,7 +49,7 @@ def prep_datadir(pack, args):
     if "datadir" in pack:
         return pack["datadir"], args
     elif pack["type"] == "S3":
-        return _unpack_s3(pack["buckets"]["biodata"], args)
+        return _unpack_s3(pack["buckets"]["biodata"], args, cache=biocache.is_enabled())
     else:
         raise ValueError("Cannot handle biodata directory preparation type: %s" % pack)
 
@@ -65,18 +75,99 @@ def get_output(target_file, pconfig):
 
 # ## S3
 
-def _transfer_s3(out_fname, keyname, bucket):
+def _transfer_s3(out_fname, keyname, bucket, retries=0):
+    """Download a key to a local file, writing to a temporary file and moving into place.
+
+    gof3r retrieves each file with parallel ranged GETs.
+    """
     if not os.path.exists(out_fname):
         utils.safe_makedir(os.path.dirname(out_fname))
-        with file_transaction(out_fname) as tx_out_fname:
-            subprocess.check_call(["gof3r", "get", "-p", tx_out_fname,
-                                   "-k", keyname, "-b", bucket])
+        for attempt in range(retries + 1):
+            try:
+                with file_transaction(out_fname) as tx_out_fname:
+                    subprocess.check_call(["gof3r", "get", "-p", tx_out_fname,
+                                           "-k", keyname, "-b", bucket])
+                break
+            except subprocess.CalledProcessError:
+                if attempt >= retries:
+                    raise
+                logger.info("Retrying download of s3://%s/%s, attempt %s" % (bucket, keyname, attempt + 2))
+                time.sleep(2 ** attempt)
+
+def _transfer_s3_all(transfers, bucket, cache=False):
+    """Download all required files for a task simultaneously, reporting progress per file.
+
+    Uses BCBIO_VM_S3_THREADS (default 8) simultaneous downloads, retrying failed
+    downloads BCBIO_VM_S3_RETRIES (default 3) times. With cache, retrieves files
+    through the node-local cache in bcbiovm.ship.biocache.
+    """
+    transfers = list(collections.OrderedDict(transfers).items())
+    for out_fname, keyname in transfers:
+        if os.path.exists(out_fname):
+            ledger.record("s3_get", "s3://%s/%s" % (bucket, keyname), out_fname, os.path.getsize(out_fname), 0,
+                          skipped=True)
+    transfers = [(f, k) for f, k in transfers if not os.path.exists(f)]
+    if not transfers:
+        return
+    fetch = (biocache.fetch_fn(biocache.key_info(bucket, [k for _, k in transfers]), _transfer_s3)
+             if cache else _transfer_s3)
+    threads = int(os.environ.get("BCBIO_VM_S3_THREADS", 8))
+    retries = int(os.environ.get("BCBIO_VM_S3_RETRIES", 3))
+    finished = []
+    lock = threading.Lock()
+    ctx = ledger.current()
+    def _do(transfer):
+        out_fname, keyname = transfer
+        start = time.time()
+        fetch(out_fname, keyname, bucket, retries)
+        ledger.record("s3_get", "s3://%s/%s" % (bucket, keyname), out_fname, os.path.getsize(out_fname),
+                      time.time() - start, ctx=ctx)
+        with lock:
+            finished.append(out_fname)
+            logger.info("Retrieved %s from S3 (%s/%s, %.1fMb in %.1fs)" %
+                        (os.path.basename(out_fname), len(finished), len(transfers),
+                         os.path.getsize(out_fname) / (1024.0 * 1024.0), time.time() - start))
+    pool = ThreadPool(max(1, min(threads, len(transfers))))
+    try:
+        pool.map(_do, transfers)
+    finally:
+        pool.close()
 
-def _unpack_s3(bucket, args):
+def _get_pack_info(args, key):
+    """Retrieve packing information passed with arguments, like the content manifest or bundle index.
+    """
+    if not args:
+        return {}
+    _, data = config_utils.get_dataarg(args)
+    return data.get(key) or {}
+
+def _extract_bundles(bundled):
+    """Extract files from downloaded bundles, using the offset and size of each file.
+    """
+    for bundle_file, members in bundled.items():
+        with open(bundle_file, "rb") as in_handle:
+            for out_fname, offset, size in members:
+                if not os.path.exists(out_fname):
+                    utils.safe_makedir(os.path.dirname(out_fname))
+                    in_handle.seek(offset)
+                    with file_transaction(out_fname) as tx_out_fname:
+                        with open(tx_out_fname, "wb") as out_handle:
+                            out_handle.write(in_handle.read(size))
+        os.remove(bundle_file)
+
+def _unpack_s3(bucket, args, cache=False):
     """Create local directory in current directory with pulldowns from S3.
+
+    Files packed by content resolve to their content keys through the manifest,
+    which also identifies the index files that exist. Small files packed into
+    bundles download once per bundle and extract locally.
     """
     local_dir = utils.safe_makedir(os.path.join(os.getcwd(), bucket))
     remote_key = "s3://%s" % bucket
+    manifest = _get_pack_info(args, ship_n_pack.MANIFEST_KEY)
+    bundles = _get_pack_info(args, ship_n_pack.BUNDLE_KEY)
+    transfers = []
+    bundled = collections.defaultdict(list)
     def _get_s3(orig_fname, context, remap_dict):
         """Pull down s3 published data locally for processing.
         """
@@ -86,13 +177,24 @@ def _unpack_s3(bucket, args):
             else:
                 cur_dir = local_dir
             for fname in utils.file_plus_index(orig_fname):
+                # Content addressed packing lists every shipped file, so skip indexes never shipped
+                if fname != orig_fname and manifest and fname not in manifest and fname not in bundles:
+                    continue
                 out_fname = fname.replace(remote_key, cur_dir)
-                keyname = fname.replace(remote_key + "/", "")
-                _transfer_s3(out_fname, keyname, bucket)
+                if fname in bundles and not os.path.exists(out_fname):
+                    bundle_name, offset, size = bundles[fname]
+                    bundle_file = os.path.join(local_dir, ".bundles", os.path.basename(bundle_name))
+                    bundled[bundle_file].append((out_fname, offset, size))
+                    fname = bundle_name
+                    out_fname = bundle_file
+                keyname = manifest.get(fname, fname.replace(remote_key + "/", ""))
+                transfers.append((out_fname, keyname))
             return orig_fname.replace(remote_key, cur_dir)
         else:
             return orig_fname
     new_args = remap.walk_files(args, _get_s3, {remote_key: local_dir})
+    _transfer_s3_all(transfers, bucket, cache)
+    _extract_bundles(bundled)
     return local_dir, new_args
 
 # ## Shared filesystem
@@ -101,31 +203,39 @@ def _remap_dict_shared(workdir, new_workdir, args):
     """Prepare a remap dictionary with directories we should potential copy files from.
     """
     ignore_keys = set(["algorithm"])
-    out = {workdir: new_workdir}
+    out = remap.MountIndex({workdir: new_workdir})
     def _update_remap(fname, context, remap_dict):
         """Updated list of directories we should potentially be remapping in.
         """
-        if not fname.startswith(tuple(out.keys())) and context and context[0] not in ignore_keys:
+        if not out.longest_prefix(fname) and context and context[0] not in ignore_keys:
             dirname = os.path.normpath(os.path.dirname(fname))
             local_dir = utils.safe_makedir(os.path.join(new_workdir, "external", str(len(out))))
             out[dirname] = local_dir
     remap.walk_files(args, _update_remap, {})
     return out
 
-def _create_workdir_shared(workdir, args, parallel, tmpdir=None):
+def _create_workdir_shared(workdir, args, parallel, tmpdir=None, stage_settings=None):
     """Create a work directory given inputs from the shared filesystem.
 
     If tmpdir is not None, we create a local working directory within the
     temporary space so IO and processing occurs there, remapping the input
-    argument paths at needed.
+    argument paths at needed. Inputs the staging policy leaves on the shared
+    filesystem keep their paths, and their directories return for mounting.
     """
     if not tmpdir:
-        return workdir, {}, args
+        return workdir, {}, args, []
     else:
+        staging.wait_removals()
         new_workdir = utils.safe_makedir(os.path.join(tmpdir, "bcbio-work-%s" % uuid.uuid1()))
         remap_dict = _remap_dict_shared(workdir, new_workdir, args)
-        new_args = remap.walk_files(args, _remap_copy_file(parallel), remap_dict)
-        return new_workdir, remap_dict, new_args
+        copies = []
+        in_place = set([])
+        new_args = remap.walk_files(args, _remap_copy_file(parallel, copies,
+                                                           staging.policy(stage_settings, new_workdir),
+                                                           in_place),
+                                    remap_dict)
+        staging.copy_files(copies)
+        return new_workdir, remap_dict, new_args, sorted(in_place)
 
 def is_required_resource(context, parallel):
     fresources = parallel.get("fresources")
@@ -136,21 +246,27 @@ def is_required_resource(context, parallel):
             return True
     return False
 
-def _remap_copy_file(parallel):
-    """Remap file names and copy into temporary directory as needed.
+def _remap_copy_file(parallel, copies, stage_fn=None, in_place=None):
+    """Remap file names, collecting files to copy into the temporary directory.
 
-    Handles simultaneous transfer of associated indexes.
+    Handles simultaneous transfer of associated indexes. Adds (source, destination)
+    pairs to copies for running with bcbiovm.ship.staging. stage_fn, from
+    staging.policy, leaves files it rejects in place on the shared filesystem,
+    adding their directories to in_place.
     """
     def _do(fname, context, orig_to_temp):
         new_fname = remap.remap_fname(fname, context, orig_to_temp)
         if os.path.isfile(fname):
             if is_required_resource(context, parallel):
+                if stage_fn and not stage_fn(fname):
+                    if in_place is not None:
+                        in_place.add(os.path.dirname(os.path.abspath(fname)))
+                    return fname
                 logger.info("YES: %s: %s" % (context, fname))
                 utils.safe_makedir(os.path.dirname(new_fname))
                 for ext in ["", ".idx", ".gbi", ".tbi", ".bai"]:
                     if os.path.exists(fname + ext):
-                        if not os.path.exists(new_fname + ext):
-                            shutil.copyfile(fname + ext, new_fname + ext)
+                        copies.append((fname + ext, new_fname + ext))
             else:
                 logger.info("NO: %s: %s" % (context, fname))
         elif os.path.isdir(fname):
@@ -160,14 +276,21 @@ def _remap_copy_file(parallel):
 
 def _shared_finalizer(args, workdir, remap_dict, parallel):
     """Cleanup temporary working directory, copying missing files back to the shared workdir.
+
+    Outputs write back simultaneously, moving with a rename on the same filesystem
+    and verifying copies, set with BCBIO_VM_STAGE_VERIFY as size (default),
+    checksum or none. Returns once outputs are in place, removing the temporary
+    directory in the background.
     """
     def _do(out):
         if remap_dict:
-            new_remap_dict = {v: k for k, v in remap_dict.items()}
-            new_out = (remap.walk_files(out, _remap_copy_file(parallel), new_remap_dict)
+            new_remap_dict = remap.MountIndex((v, k) for k, v in remap_dict.items())
+            copies = []
+            new_out = (remap.walk_files(out, _remap_copy_file(parallel, copies), new_remap_dict)
                        if out else None)
+            staging.copy_files(copies, move=True, verify=os.environ.get("BCBIO_VM_STAGE_VERIFY", "size"))
             if os.path.exists(workdir):
-                shutil.rmtree(workdir)
+                staging.remove_async(workdir)
             return new_out
         else:
             return out
@@ -0,0 +1,326 @@
+"""Copy files into and out of local temporary space for processing.
+
+Staging large BAMs and indexes into --tmpdir, and copying outputs back, is a
+large part of the wall time for short tasks. Files copy simultaneously, using
+the cheapest method available for each:
+
+  - reflink (FICLONE) clone on filesystems supporting copy on write
+  - hardlink on the same filesystem, if BCBIO_VM_STAGE_HARDLINK=1. Only safe when
+    processing never modifies files in place.
+  - copy_file_range, copying only data regions so sparse files stay sparse
+  - standard read and write copies otherwise
+
+Destination files with the same size and modification time as the source are
+skipped. BCBIO_VM_STAGE_THREADS sets the number of simultaneous copies (default 4).
+
+Writing outputs back can move files with a rename when on the same filesystem,
+and verify copies by size or checksum. Verifying also syncs each output, and the
+directory it moves into, to disk so outputs are durable when the task returns.
+Renames keep the original file, so only need syncing.
+
+Temporary work directories are removed in the background. The next staging in
+the same process, and process exit, wait for pending removals to finish.
+
+`policy` decides which inputs are worth copying at all. Small files and randomly
+accessed files, like indexes or BAMs with a .bai, copy to local disk. Large
+files without an index, like FASTQs streamed once, stay on the shared filesystem
+unless local space is plentiful and the shared filesystem reads them quickly.
+Files left in place are mounted into the container from their original
+directories. Thresholds are set with `bcbio_vm.py ipython --stage key=value`
+and travel with the shared filesystem pack configuration:
+
+  small_mb (512)         always copy files up to this size
+  large_gb (10)          leave unindexed files of this size or more in place
+  min_free_gb (50)       local space to keep free after copying large files
+  max_copy_seconds (60)  copy large files expected to copy in this time
+"""
+import errno
+import fcntl
+import os
+import shutil
+import threading
+import time
+import uuid
+import zlib
+
+from bcbio.log import logger
+from bcbiovm.ship import ledger
+from multiprocessing.pool import ThreadPool
+
+FICLONE = 0x40049409
+BLOCK_SIZE = 16 * 1024 * 1024
+INDEX_EXTS = [".bai", ".crai", ".csi", ".tbi", ".gbi", ".idx", ".fai"]
+POLICY_DEFAULTS = {"small_mb": 512, "large_gb": 10, "min_free_gb": 50, "max_copy_seconds": 60}
+THROUGHPUT_SAMPLE = 64 * 1024 * 1024
+
+def copy_files(pairs, threads=None, move=False, verify=None):
+    """Copy (source, destination) pairs simultaneously, returning the method used for each.
+    """
+    pairs = list(dict((dst, src) for src, dst in pairs).items())
+    if not pairs:
+        return []
+    threads = threads or int(os.environ.get("BCBIO_VM_STAGE_THREADS", 4))
+    ctx = ledger.current()
+    def _do(pair):
+        dst, src = pair
+        start = time.time()
+        method = copy_file(src, dst, move, verify)
+        ledger.record("copy", src, dst, os.path.getsize(dst), time.time() - start,
+                      skipped=method == "skip", method=method, ctx=ctx)
+        return method
+    pool = ThreadPool(max(1, min(threads, len(pairs))))
+    try:
+        return pool.map(_do, pairs)
+    finally:
+        pool.close()
+
+_removals = []
+_removals_lock = threading.Lock()
+
+def remove_async(dname):
+    """Remove a directory in the background, returning the thread doing the removal.
+    """
+    t = threading.Thread(target=shutil.rmtree, args=(dname,), kwargs={"ignore_errors": True})
+    with _removals_lock:
+        _removals[:] = [x for x in _removals if x.is_alive()]
+        _removals.append(t)
+    t.start()
+    return t
+
+def wait_removals():
+    """Wait for directories removing in the background to finish.
+    """
+    with _removals_lock:
+        pending = list(_removals)
+        del _removals[:]
+    for t in pending:
+        t.join()
+
+def is_current(src, dst):
+    """Check if a destination has the same size and modification time as the source.
+    """
+    if not os.path.exists(dst):
+        return False
+    src_st, dst_st = os.stat(src), os.stat(dst)
+    return src_st.st_size == dst_st.st_size and int(src_st.st_mtime) == int(dst_st.st_mtime)
+
+def copy_file(src, dst, move=False, verify=None):
+    """Copy a single file, writing to a temporary file and moving into place.
+
+    move renames the source into place when on the same filesystem. verify, either
+    size or checksum, checks copies against the source and syncs them, and the
+    destination directory, to disk.
+    Returns the method used: skip, rename, reflink, hardlink, copy_file_range or copy.
+    """
+    if is_current(src, dst):
+        return "skip"
+    dst_dir = os.path.dirname(dst)
+    if dst_dir and not os.path.exists(dst_dir):
+        try:
+            os.makedirs(dst_dir)
+        except OSError:
+            if not os.path.isdir(dst_dir):
+                raise
+    if move and _same_device(src, dst_dir):
+        try:
+            os.rename(src, dst)
+        except OSError:
+            pass
+        else:
+            if verify in ["size", "checksum"]:
+                _sync(dst)
+                _sync(dst_dir)
+            return "rename"
+    tx_dst = "%s.%s.tmp" % (dst, uuid.uuid4())
+    try:
+        if _use_hardlink() and _same_device(src, dst_dir):
+            try:
+                os.link(src, tx_dst)
+                os.rename(tx_dst, dst)
+                return "hardlink"
+            except OSError:
+                pass
+        method = _copy_data(src, tx_dst)
+        shutil.copystat(src, tx_dst)
+        if verify in ["size", "checksum"]:
+            _verify(src, tx_dst, verify)
+        os.rename(tx_dst, dst)
+        if verify in ["size", "checksum"]:
+            _sync(dst_dir)
+        return method
+    finally:
+        if os.path.exists(tx_dst):
+            os.remove(tx_dst)
+
+def _verify(src, tx_dst, method):
+    """Sync a copied file to disk, then check it matches the source.
+    """
+    _sync(tx_dst)
+    if os.path.getsize(src) != os.path.getsize(tx_dst):
+        raise IOError("Copy of %s has size %s, expected %s" % (src, os.path.getsize(tx_dst),
+                                                                os.path.getsize(src)))
+    if method == "checksum" and _checksum(src) != _checksum(tx_dst):
+        raise IOError("Copy of %s does not match checksum of original" % src)
+
+def _sync(fname):
+    """Flush a file, or a directory's entries, to disk.
+
+    Some filesystems do not support syncing directories, which is not an error.
+    """
+    fd = os.open(fname or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    except OSError as e:
+        if e.errno not in [errno.EINVAL, errno.EBADF, errno.ENOTSUP]:
+            raise
+    finally:
+        os.close(fd)
+
+def _checksum(fname):
+    cur = 1
+    with open(fname, "rb") as in_handle:
+        for block in iter(lambda: in_handle.read(BLOCK_SIZE), b""):
+            cur = zlib.adler32(block, cur)
+    return cur & 0xffffffff
+
+def _use_hardlink():
+    return os.environ.get("BCBIO_VM_STAGE_HARDLINK", "").lower() in ["1", "true", "yes"]
+
+def _same_device(src, dst_dir):
+    return os.stat(src).st_dev == os.stat(dst_dir or ".").st_dev
+
+def _copy_data(src, dst):
+    with open(src, "rb") as in_handle:
+        with open(dst, "wb") as out_handle:
+            try:
+                fcntl.ioctl(out_handle.fileno(), FICLONE, in_handle.fileno())
+                return "reflink"
+            except (IOError, OSError):
+                pass
+            size = os.fstat(in_handle.fileno()).st_size
+            method = "copy"
+            for start, end in _data_regions(in_handle.fileno(), size):
+                method = _copy_range(in_handle.fileno(), out_handle.fileno(), start, end)
+            out_handle.truncate(size)
+            return method
+
+def _data_regions(fd, size):
+    """Retrieve (start, end) regions of a file containing data, skipping holes in sparse files.
+    """
+    if not hasattr(os, "SEEK_DATA"):
+        return [(0, size)]
+    out = []
+    pos = 0
+    while pos < size:
+        try:
+            start = os.lseek(fd, pos, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                break
+            return [(0, size)]
+        end = os.lseek(fd, start, os.SEEK_HOLE)
+        out.append((start, end))
+        pos = end
+    return out
+
+def _copy_range(in_fd, out_fd, start, end):
+    """Copy a region between files, within the kernel with copy_file_range if available.
+    """
+    pos = start
+    if hasattr(os, "copy_file_range"):
+        try:
+            while pos < end:
+                copied = os.copy_file_range(in_fd, out_fd, min(BLOCK_SIZE, end - pos), pos, pos)
+                if copied == 0:
+                    break
+                pos += copied
+            if pos >= end:
+                return "copy_file_range"
+        except OSError:
+            pass
+    while pos < end:
+        os.lseek(in_fd, pos, os.SEEK_SET)
+        os.lseek(out_fd, pos, os.SEEK_SET)
+        data = os.read(in_fd, min(BLOCK_SIZE, end - pos))
+        if not data:
+            break
+        while data:
+            written = os.write(out_fd, data)
+            data = data[written:]
+            pos += written
+    return "copy"
+
+# ## Staging policy
+
+def parse_settings(settings):
+    """Parse key=value staging policy thresholds from the command line.
+    """
+    out = {}
+    for setting in settings or []:
+        key, _, value = setting.partition("=")
+        if key not in POLICY_DEFAULTS:
+            raise ValueError("Unexpected staging setting %s, expected one of: %s" %
+                             (setting, ", ".join(sorted(POLICY_DEFAULTS))))
+        out[key] = float(value)
+    return out
+
+def policy(settings, dest_dir):
+    """Retrieve a function deciding if an input file should copy into dest_dir.
+
+    The returned function takes a file name and returns True to copy it, logging
+    each decision and keeping track of space used by large files.
+    """
+    config = dict((k, float((settings or {}).get(k, v))) for k, v in POLICY_DEFAULTS.items())
+    state = {"planned": 0, "throughput": {}}
+    lock = threading.Lock()
+    def _decide(fname):
+        size = os.path.getsize(fname)
+        if _is_random_access(fname):
+            stage, reason = True, "randomly accessed"
+        elif size <= config["small_mb"] * 1024 * 1024:
+            stage, reason = True, "small file"
+        elif size < config["large_gb"] * 1024 * 1024 * 1024:
+            stage, reason = True, "below large file threshold"
+        else:
+            with lock:
+                free = _free_space(dest_dir) - state["planned"] - size
+                throughput = _read_throughput(fname, state["throughput"])
+                copy_time = size / throughput if throughput else None
+                stage = (free > config["min_free_gb"] * 1024 * 1024 * 1024 and copy_time is not None
+                         and copy_time <= config["max_copy_seconds"])
+                if stage:
+                    state["planned"] += size
+            reason = ("large streamed file, %.1fGb free, %s" %
+                      (free / (1024.0 * 1024.0 * 1024.0),
+                       "%.0fMb/s read" % (throughput / (1024.0 * 1024.0)) if throughput else "no throughput"))
+        logger.info("%s: %s (%s, %.1fMb)" % ("Staging to local disk" if stage else "Leaving on shared filesystem",
+                                             fname, reason, size / (1024.0 * 1024.0)))
+        return stage
+    return _decide
+
+def _is_random_access(fname):
+    if any(fname.endswith(ext) for ext in INDEX_EXTS):
+        return True
+    base = os.path.splitext(fname)[0]
+    return any(os.path.exists(fname + ext) or os.path.exists(base + ext) for ext in INDEX_EXTS)
+
+def _free_space(dname):
+    st = os.statvfs(dname)
+    return st.f_bavail * st.f_frsize
+
+def _read_throughput(fname, cache):
+    """Measure read throughput from the shared filesystem, in bytes per second, once per directory.
+    """
+    dname = os.path.dirname(fname)
+    if dname not in cache:
+        start = time.time()
+        read = 0
+        with open(fname, "rb") as in_handle:
+            while read < THROUGHPUT_SAMPLE:
+                data = in_handle.read(BLOCK_SIZE)
+                if not data:
+                    break
+                read += len(data)
+        elapsed = time.time() - start
+        cache[dname] = read / elapsed if elapsed > 0 else None
+    return cache[dname]
@@ -8,69 +8,74 @@ This script builds the command line options for bcbio_vm.py, which you can see b
 running `bcbio_vm.py -h`. For each specific command, like `install`, we'll have a function to
 prepare the command line arguments (`_install_cmd`) and a function to do the actual
 work (`cmd_install`).
+
+Sub-commands are registered lazily in `COMMANDS` and `AWS_COMMANDS`. Only the
+selected sub-command builds its full argument parser and imports the modules it
+needs, so frequently called commands like `runfn` avoid importing CWL, AWS and
+plotting dependencies on every start up.
 """
 from __future__ import print_function
 import argparse
+import collections
+import functools
+import importlib
 import os
 import sys
 import warnings
 
-import yaml
-
-from bcbio.cwl import main as cwl_main
-from bcbio.cwl import tool as cwl_tool
-from bcbio.distributed import clargs
-from bcbio.workflow import template
-from bcbiovm.arvados import retriever as arvados_retriever
-from bcbiovm.dnanexus import retriever as dx_retriever
-from bcbiovm.sbgenomics import retriever as sb_retriever
-from bcbiovm.gcp import retriever as gs_retriever
-from bcbiovm.aws import (ansible_inputs, cluster, common, iam, icel, vpc, info,
-                         s3retriever, cromwell)
-from bcbiovm.docker import defaults, devel, install, manage, mounts, run
-from bcbiovm.ipython import batchprep
-from bcbiovm.shared import localref
-from bcbiovm.ship import pack
-
 warnings.simplefilter("ignore", UserWarning, 1155)  # Stop warnings from matplotlib.use()
 
 def cmd_install(args):
+    from bcbiovm.docker import defaults, install
     args = defaults.update_check_args(args, "bcbio-nextgen not upgraded.",
                                       need_datadir=args.install_data)
-    install.full(args, devel.DOCKER)
+    install.full(args, defaults.DOCKER)
 
 def cmd_run(args):
-    args = defaults.update_check_args(args, "Could not run analysis.")
-    args = install.docker_image_arg(args)
-    run.do_analysis(args, devel.DOCKER)
+    from bcbiovm.docker import defaults, install, run
+    from bcbiovm.shared import trace
+    trace.setup(args.trace)
+    with trace.span("defaults.update_check_args"):
+        args = defaults.update_check_args(args, "Could not run analysis.")
+    with trace.span("install.docker_image_arg"):
+        args = install.docker_image_arg(args)
+    with trace.span("run.do_analysis"):
+        run.do_analysis(args, defaults.DOCKER)
 
 def cmd_ipython(args):
-    args = defaults.update_check_args(args, "Could not run IPython parallel analysis.")
-    args = install.docker_image_arg(args)
+    from bcbio.distributed import clargs
+    from bcbiovm.docker import defaults, install, mounts, run
+    from bcbiovm.ship import pack, staging
+    from bcbiovm.shared import serialize, trace
+    trace.setup(args.trace)
+    with trace.span("defaults.update_check_args"):
+        args = defaults.update_check_args(args, "Could not run IPython parallel analysis.")
+    with trace.span("install.docker_image_arg"):
+        args = install.docker_image_arg(args)
     parallel = clargs.to_parallel(args, "bcbiovm.docker")
     parallel["wrapper"] = "runfn"
-    with open(args.sample_config) as in_handle:
-        ready_config, _ = mounts.normalize_config(yaml.safe_load(in_handle), args.fcdir)
+    with trace.span("mounts.normalize_config"):
+        ready_config, _ = mounts.normalize_config(serialize.read(args.sample_config, "yaml"), args.fcdir)
     work_dir = os.getcwd()
     ready_config_file = os.path.join(work_dir, "%s-ready%s" %
                                      (os.path.splitext(os.path.basename(args.sample_config))))
-    with open(ready_config_file, "w") as out_handle:
-        yaml.safe_dump(ready_config, out_handle, default_flow_style=False, allow_unicode=False)
+    serialize.write(ready_config, ready_config_file, "yaml")
     work_dir = os.getcwd()
     systemconfig = run.local_system_config(args.systemconfig, args.datadir, work_dir)
-    cur_pack = pack.shared_filesystem(work_dir, args.datadir, args.tmpdir)
-    parallel["wrapper_args"] = [devel.DOCKER, {"sample_config": ready_config_file,
-                                               "fcdir": args.fcdir,
-                                               "pack": cur_pack,
-                                               "systemconfig": systemconfig,
-                                               "image": args.image}]
+    cur_pack = pack.shared_filesystem(work_dir, args.datadir, args.tmpdir, staging.parse_settings(args.stage))
+    parallel["wrapper_args"] = [defaults.DOCKER, {"sample_config": ready_config_file,
+                                                  "fcdir": args.fcdir,
+                                                  "pack": cur_pack,
+                                                  "systemconfig": systemconfig,
+                                                  "image": args.image}]
     # For testing, run on a local ipython cluster
     parallel["run_local"] = parallel.get("queue") == "localrun"
 
     from bcbio.pipeline import main
-    main.run_main(work_dir, run_info_yaml=ready_config_file,
-                  config_file=systemconfig, fc_dir=args.fcdir,
-                  parallel=parallel)
+    with trace.span("main.run_main"):
+        main.run_main(work_dir, run_info_yaml=ready_config_file,
+                      config_file=systemconfig, fc_dir=args.fcdir,
+                      parallel=parallel)
 
     # Approach for running main function inside of docker
     # Could be useful for architectures where we can spawn docker jobs from docker
@@ -79,39 +84,61 @@ def cmd_ipython(args):
     #             "sample_config": args.sample_config, "fcdir": args.fcdir,
     #             "orig_systemconfig": args.systemconfig}
     # main_args = [work_dir, ready_config_file, systemconfig, args.fcdir, parallel]
-    # run.do_runfn("run_main", main_args, cmd_args, parallel, devel.DOCKER)
+    # run.do_runfn("run_main", main_args, cmd_args, parallel, defaults.DOCKER)
 
 def cmd_clusterk(args):
+    from bcbiovm.clusterk import main as clusterk_main
+    from bcbiovm.docker import defaults, install
     args = defaults.update_check_args(args, "Could not run Clusterk parallel analysis.")
     args = install.docker_image_arg(args)
-    clusterk_main.run(args, devel.DOCKER)
+    clusterk_main.run(args, defaults.DOCKER)
 
 def cmd_runfn(args):
-    args = defaults.update_check_args(args, "Could not run bcbio-nextgen function.")
-    args = install.docker_image_arg(args)
-    with open(args.parallel) as in_handle:
-        parallel = yaml.safe_load(in_handle)
-    with open(args.runargs) as in_handle:
-        runargs = yaml.safe_load(in_handle)
+    from bcbiovm.docker import defaults, install, run
+    from bcbiovm.ship import pack
+    from bcbiovm.shared import serialize, trace
+    trace.setup(args.trace)
+    with trace.span("defaults.update_check_args"):
+        args = defaults.update_check_args(args, "Could not run bcbio-nextgen function.")
+    with trace.span("install.docker_image_arg"):
+        args = install.docker_image_arg(args)
+    with trace.span("runfn.read_args"):
+        parallel = serialize.read(args.parallel)
+        runargs = serialize.read(args.runargs)
     cmd_args = {"systemconfig": args.systemconfig, "image": args.image, "pack": parallel["pack"]}
-    out = run.do_runfn(args.fn_name, runargs, cmd_args, parallel, devel.DOCKER)
+    out = run.do_runfn(args.fn_name, runargs, cmd_args, parallel, defaults.DOCKER)
     out_file = "%s-out%s" % os.path.splitext(args.runargs)
-    with open(out_file, "w") as out_handle:
-        yaml.safe_dump(out, out_handle, default_flow_style=False, allow_unicode=False)
-    pack.send_output(parallel["pack"], out_file)
+    with trace.span("runfn.write_output"):
+        serialize.write(out, out_file, serialize.get_format(args.runargs, parallel))
+        pack.send_output(parallel["pack"], out_file)
 
 def cmd_server(args):
+    from bcbiovm.docker import defaults, install, manage
     args = defaults.update_check_args(args, "Could not run server.")
     args = install.docker_image_arg(args)
-    ports = ["%s:%s" % (args.port, devel.DOCKER["port"])]
+    ports = ["%s:%s" % (args.port, defaults.DOCKER["port"])]
     print("Running server on port %s. Press ctrl-c to exit." % args.port)
-    manage.run_bcbio_cmd(args.image, [], ["server", "--port", str(devel.DOCKER["port"])],
+    manage.run_bcbio_cmd(args.image, [], ["server", "--port", str(defaults.DOCKER["port"])],
                          ports)
 
 def cmd_save_defaults(args):
+    from bcbiovm.docker import defaults
     defaults.save(args)
 
+def _get_integrations():
+    """Retrieve remote file integrations used for preparing CWL and template inputs.
+    """
+    from bcbiovm.arvados import retriever as arvados_retriever
+    from bcbiovm.aws import s3retriever
+    from bcbiovm.dnanexus import retriever as dx_retriever
+    from bcbiovm.gcp import retriever as gs_retriever
+    from bcbiovm.sbgenomics import retriever as sb_retriever
+    from bcbiovm.shared import localref
+    return {"arvados": arvados_retriever, "s3": s3retriever, "sbgenomics": sb_retriever,
+            "dnanexus": dx_retriever, "gs": gs_retriever, "local": localref}
+
 def _install_cmd(subparsers, name):
+    from bcbiovm.docker import devel
     parser_i = subparsers.add_parser(name, help="Install or upgrade bcbio-nextgen docker container and data.")
     parser_i = devel.add_biodata_args(parser_i)
     parser_i.add_argument("--data", help="Install or upgrade data dependencies",
@@ -122,6 +149,8 @@ def _install_cmd(subparsers, name):
                           action="store_true", default=False)
     parser_i.add_argument("--image", help="Docker image name to use, could point to compatible pre-installed image.",
                           default=None)
+    parser_i.add_argument("--image-cache", help="Shared directory of docker image tarballs to load the image from, "
+                          "saving the image there if not present", default=None)
     parser_i.add_argument("--cores", help="Cores to use for parallel data prep processes", default=1, type=int)
     parser_i.set_defaults(func=cmd_install)
 
@@ -141,12 +170,25 @@ def _std_run_args(parser):
     parser = _std_config_args(parser)
     return parser
 
+def _serialize_args(parser):
+    parser.add_argument("--serialize-format", choices=["yaml", "json", "msgpack"],
+                        help="Format for function argument and output files passed to Clusterk tasks. "
+                             "Defaults to yaml.")
+    return parser
+
+def _trace_args(parser):
+    parser.add_argument("--trace", help="Write a Chrome trace-event JSON file with timings of processing phases. "
+                        "Can also be enabled with the BCBIO_VM_TRACE environment variable.")
+    return parser
+
 def _run_cmd(subparsers):
     parser_r = subparsers.add_parser("run", help="Run an automated analysis on the local machine.")
     parser_r = _std_run_args(parser_r)
+    parser_r = _trace_args(parser_r)
     parser_r.set_defaults(func=cmd_run)
 
 def _cwl_cmd(subparsers):
+    from bcbio.cwl import main as cwl_main
     parser = subparsers.add_parser("cwl", help="Generate Common Workflow Language (CWL) from configuration inputs")
     parser.add_argument("--systemconfig", help="Global YAML configuration file specifying system details. "
                         "Defaults to installed bcbio_system.yaml.")
@@ -154,11 +196,11 @@ def _cwl_cmd(subparsers):
     parser.add_argument('--add-container-tag',
                         help="Add a container revision tag to CWL ('quay_lookup` retrieves lates from quay.io)",
                         default=None)
-    parser.set_defaults(integrations={"arvados": arvados_retriever, "s3": s3retriever, "sbgenomics": sb_retriever,
-                                      "dnanexus": dx_retriever, "gs": gs_retriever, "local": localref})
+    parser.set_defaults(integrations=_get_integrations())
     parser.set_defaults(func=cwl_main.run)
 
 def _cwlrun_cmd(subparsers):
+    from bcbio.cwl import tool as cwl_tool
     parser = subparsers.add_parser("cwlrun", help="Run Common Workflow Language (CWL) inputs with a specified tool")
     parser.add_argument("tool", help="CWL tool to run", choices=["cwltool", "arvados", "toil", "bunny", "funnel",
                                                                  "cromwell", "sbg", "wes"])
@@ -204,35 +246,41 @@ def _add_ipython_args(parser):
     parser.add_argument("-t", "--tag", help="Tag name to label jobs on the cluster",
                         default="")
     parser.add_argument("--tmpdir", help="Path of local on-machine temporary directory to process in.")
+    parser.add_argument("--stage", action="append", default=[],
+                        help="Thresholds for copying inputs into --tmpdir as key=value: small_mb, large_gb, "
+                             "min_free_gb and max_copy_seconds. Can specify multiple times.")
     return parser
 
 def _run_ipython_cmd(subparsers):
     parser = subparsers.add_parser("ipython", help="Run on a cluster using IPython parallel.")
     parser = _add_ipython_args(parser)
+    parser = _trace_args(parser)
     parser.set_defaults(func=cmd_ipython)
 
 def _run_ipythonprep_cmd(subparsers):
+    from bcbiovm.ipython import batchprep
     parser = subparsers.add_parser("ipythonprep", help="Prepare a batch script to run bcbio on a scheduler.")
     parser = _add_ipython_args(parser)
     parser.set_defaults(func=batchprep.submit_script)
 
 def _template_cmd(subparsers):
+    from bcbio.workflow import template
     parser = subparsers.add_parser("template",
                                    help="Create a bcbio sample.yaml file from a standard template and inputs")
     parser = template.setup_args(parser)
     parser = _std_config_args(parser)
     parser.add_argument('--relpaths', help="Convert inputs into relative paths to the work directory",
                         action='store_true', default=False)
-    parser.set_defaults(integrations={"arvados": arvados_retriever, "s3": s3retriever, "sbgenomics": sb_retriever,
-                                      "dnanexus": dx_retriever, "gs": gs_retriever, "local": localref})
+    parser.set_defaults(integrations=_get_integrations())
     parser.set_defaults(func=template.setup)
 
 def _runfn_cmd(subparsers):
     parser = subparsers.add_parser("runfn", help="Run a specific bcbio-nextgen function with provided arguments")
     parser = _std_config_args(parser)
     parser.add_argument("fn_name", help="Name of the function to run")
-    parser.add_argument("parallel", help="JSON/YAML file describing the parallel environment")
-    parser.add_argument("runargs", help="JSON/YAML file with arguments to the function")
+    parser.add_argument("parallel", help="JSON/YAML/msgpack file describing the parallel environment")
+    parser.add_argument("runargs", help="JSON/YAML/msgpack file with arguments to the function")
+    parser = _trace_args(parser)
     parser.set_defaults(func=cmd_runfn)
 
 def _run_clusterk_cmd(subparsers):
@@ -241,6 +289,11 @@ def _run_clusterk_cmd(subparsers):
     parser.add_argument("run_bucket", help="Name of the S3 bucket to use for storing run information")
     parser.add_argument("biodata_bucket", help="Name of the S3 bucket to use for storing biodata like genomes")
     parser.add_argument("-q", "--queue", help="Clusterk queue to run jobs on.", default="default")
+    parser.add_argument("--content-addressed", action="store_true", default=False,
+                        help="Store shipped files in S3 by content, uploading identical files only once.")
+    parser.add_argument("--bundle-kb", type=int, default=0,
+                        help="Ship files smaller than this size, in KB, as a single bundle per directory.")
+    parser = _serialize_args(parser)
     parser.set_defaults(func=cmd_clusterk)
 
 def _server_cmd(subparsers):
@@ -256,7 +309,12 @@ def _config_cmd(subparsers):
 def _elasticluster_cmd(subparsers):
     subparsers.add_parser("elasticluster", help="Interface to standard elasticluster commands")
 
+def _devel_cmd(subparsers):
+    from bcbiovm.docker import devel
+    devel.setup_cmd(subparsers)
+
 def _graph_cmd(subparsers):
+    from bcbiovm.aws import common
     from bcbiovm.graph import graph
     parser = subparsers.add_parser("graph",
                                    help="Generate system graphs "
@@ -280,18 +338,13 @@ def _graph_cmd(subparsers):
                         help="Serialize plot information for later faster inspection")
     parser.set_defaults(func=graph.bootstrap)
 
-def _aws_cmd(subparsers):
+def _aws_cmd(subparsers, argv):
     parser_c = subparsers.add_parser("aws", help="Automate resources for running bcbio on AWS")
     awssub = parser_c.add_subparsers(title="[aws commands]")
-    cromwell.setup_cmd(awssub)
-    cluster.setup_cmd(awssub)
-    info.setup_cmd(awssub)
-    ansible_inputs.setup_cmd(awssub)
-    _aws_iam_cmd(awssub)
-    _aws_vpc_cmd(awssub)
-    icel.setup_cmd(awssub)
+    add_lazy_cmds(awssub, AWS_COMMANDS, argv)
 
 def _aws_iam_cmd(awsparser):
+    from bcbiovm.aws import common, iam
     parser = awsparser.add_parser("iam", help="Create IAM user and policies")
     parser.add_argument("--econfig", help="Elasticluster bcbio configuration file",
                         default=common.DEFAULT_EC_CONFIG)
@@ -305,6 +358,7 @@ def _aws_iam_cmd(awsparser):
     parser.set_defaults(func=iam.bootstrap)
 
 def _aws_vpc_cmd(awsparser):
+    from bcbiovm.aws import common, vpc
     parser = awsparser.add_parser("vpc",
                                   help="Create VPC and associated resources",
                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -322,32 +376,101 @@ def _aws_vpc_cmd(awsparser):
                              "in CIDR notation (a.b.c.d/e)")
     parser.set_defaults(func=vpc.bootstrap)
 
+def _module_cmd(module_name):
+    """Set up a sub-command using the `setup_cmd` function of a module, importing it on demand.
+    """
+    def _setup(subparsers):
+        importlib.import_module(module_name).setup_cmd(subparsers)
+    return _setup
+
+# ## Lazy sub-command registry
+
+LazyCmd = collections.namedtuple("LazyCmd", ["name", "help", "setup", "nested"])
+
+def _cmd(name, help, setup, nested=False):
+    """Register a sub-command. Nested commands receive the remaining arguments for their own selection.
+    """
+    return LazyCmd(name, help, setup, nested)
+
+COMMANDS = [
+    _cmd("template", "Create a bcbio sample.yaml file from a standard template and inputs", _template_cmd),
+    _cmd("cwl", "Generate Common Workflow Language (CWL) from configuration inputs", _cwl_cmd),
+    _cmd("cwlrun", "Run Common Workflow Language (CWL) inputs with a specified tool", _cwlrun_cmd),
+    _cmd("install", "Install or upgrade bcbio-nextgen docker container and data.",
+         functools.partial(_install_cmd, name="install")),
+    _cmd("upgrade", "Install or upgrade bcbio-nextgen docker container and data.",
+         functools.partial(_install_cmd, name="upgrade")),
+    _cmd("run", "Run an automated analysis on the local machine.", _run_cmd),
+    _cmd("ipython", "Run on a cluster using IPython parallel.", _run_ipython_cmd),
+    _cmd("ipythonprep", "Prepare a batch script to run bcbio on a scheduler.", _run_ipythonprep_cmd),
+    # _cmd("clusterk", "Run on Amazon web services using Clusterk.", _run_clusterk_cmd),
+    # _cmd("server", "Persistent REST server receiving requests via the specified port.", _server_cmd),
+    _cmd("runfn", "Run a specific bcbio-nextgen function with provided arguments", _runfn_cmd),
+    _cmd("devel", "Utilities to help with developing using bcbio inside of containers", _devel_cmd),
+    _cmd("aws", "Automate resources for running bcbio on AWS", _aws_cmd, nested=True),
+    _cmd("elasticluster", "Interface to standard elasticluster commands", _elasticluster_cmd),
+    _cmd("transfers", "Summarize file transfers recorded during runs", _module_cmd("bcbiovm.ship.ledger")),
+    # _cmd("graph", "Generate system graphs (CPU/memory/network/disk I/O consumption) from bcbio runs",
+    #      _graph_cmd),
+    _cmd("saveconfig", "Save standard configuration variables for current user. "
+         "Avoids need to specify on the command line in future runs.", _config_cmd)]
+
+AWS_COMMANDS = [
+    _cmd("cromwell", "Setup AWS batch environment for running Cromwell", _module_cmd("bcbiovm.aws.cromwell")),
+    _cmd("cluster", "Run and manage AWS clusters", _module_cmd("bcbiovm.aws.cluster")),
+    _cmd("info", "Information on existing AWS clusters", _module_cmd("bcbiovm.aws.info")),
+    _cmd("ansible", "Create AWS resources for running ansible scripts",
+         _module_cmd("bcbiovm.aws.ansible_inputs")),
+    _cmd("iam", "Create IAM user and policies", _aws_iam_cmd),
+    _cmd("vpc", "Create VPC and associated resources", _aws_vpc_cmd),
+    _cmd("icel", "Create scratch filesystem using Intel Cloud Edition for Lustre",
+         _module_cmd("bcbiovm.aws.icel"))]
+
+# global options which take a value, and precede the sub-command name
+GLOBAL_VALUE_OPTS = set(["--datadir"])
+
+def _selected_cmd(argv, names):
+    """Identify the sub-command chosen on the command line, with the arguments following it.
+    """
+    skip_next = False
+    for i, arg in enumerate(argv):
+        if skip_next:
+            skip_next = False
+        elif arg in names:
+            return arg, argv[i + 1:]
+        elif arg in GLOBAL_VALUE_OPTS:
+            skip_next = True
+        elif not arg.startswith("-"):
+            break
+    return None, []
+
+def add_lazy_cmds(subparsers, cmds, argv):
+    """Add sub-commands, only fully building the selected one.
+
+    Unselected commands get a placeholder parser with their help text, so usage
+    output lists all commands without importing their dependencies.
+    """
+    selected, rest = _selected_cmd(argv, [c.name for c in cmds])
+    for cmd in cmds:
+        if cmd.name != selected:
+            subparsers.add_parser(cmd.name, help=cmd.help)
+        elif cmd.nested:
+            cmd.setup(subparsers, rest)
+        else:
+            cmd.setup(subparsers)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Automatic installation for bcbio-nextgen pipelines, with docker.")
     parser.add_argument("--datadir", help="Directory with genome data and associated files.",
                         type=lambda x: (os.path.abspath(os.path.expanduser(x))))
     subparsers = parser.add_subparsers(title="[sub-commands]")
-    _template_cmd(subparsers)
-    _cwl_cmd(subparsers)
-    _cwlrun_cmd(subparsers)
-    _install_cmd(subparsers, name="install")
-    _install_cmd(subparsers, name="upgrade")
-    _run_cmd(subparsers)
-    _run_ipython_cmd(subparsers)
-    _run_ipythonprep_cmd(subparsers)
-    #_run_clusterk_cmd(subparsers)
-    # _server_cmd(subparsers)
-    _runfn_cmd(subparsers)
-    devel.setup_cmd(subparsers)
-    _aws_cmd(subparsers)
-    _elasticluster_cmd(subparsers)
-    #_graph_cmd(subparsers)
-    _config_cmd(subparsers)
+    add_lazy_cmds(subparsers, COMMANDS, sys.argv[1:])
     if len(sys.argv) == 1:
         parser.print_help()
     else:
         if len(sys.argv) > 1 and sys.argv[1] == "elasticluster":
+            from bcbiovm.aws import common
             sys.exit(common.wrap_elasticluster(sys.argv[1:]))
         else:
             args = parser.parse_args()
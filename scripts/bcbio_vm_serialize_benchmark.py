@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""Benchmark serialization of runfn argument files for increasing sample counts.
+
+Builds argument lists shaped like multi-sample bcbio function calls, with full
+configuration, resource and file dictionaries per sample, then times writing
+and reading them with each available format. Pure Python YAML is included as
+the baseline used before bcbiovm.shared.serialize.
+
+Usage:
+  bcbio_vm_serialize_benchmark.py [--samples 1,10,100,1000] [--repeats N]
+"""
+from __future__ import print_function
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import yaml
+
+from bcbiovm.shared import serialize
+
+def sample_data(i, work_dir="/mnt/work", datadir="/mnt/biodata"):
+    """Prepare a realistic bcbio sample dictionary, as passed to runfn functions.
+    """
+    ref_dir = os.path.join(datadir, "genomes", "Hsapiens", "hg38")
+    name = "sample%04d" % i
+    return {"description": name, "lane": str(i), "analysis": "variant2", "genome_build": "hg38",
+            "rgnames": {"sample": name, "rg": name, "lane": str(i), "pl": "illumina",
+                        "pu": "%s_%s" % (i, name), "lb": None},
+            "files": [os.path.join(work_dir, "input", "%s_R%s.fastq.gz" % (name, r)) for r in [1, 2]],
+            "dirs": {"work": work_dir, "galaxy": os.path.join(datadir, "galaxy"),
+                     "fastq": os.path.join(work_dir, "input"),
+                     "config": os.path.join(work_dir, "config")},
+            "work_bam": os.path.join(work_dir, "align", name, "%s-sort.bam" % name),
+            "reference": {"fasta": {"base": os.path.join(ref_dir, "seq", "hg38.fa")},
+                          "bwa": {"indexes": [os.path.join(ref_dir, "bwa", "hg38.fa.%s" % e)
+                                              for e in ["amb", "ann", "bwt", "pac", "sa"]]},
+                          "snpeff": {"GRCh38.86": os.path.join(ref_dir, "snpeff", "GRCh38.86")},
+                          "genome_context": [os.path.join(ref_dir, "coverage", "problem_regions",
+                                                          "GA4GH", "%s.bed.gz" % c)
+                                             for c in ["test2", "gc15", "gc85", "low_complexity"]]},
+            "genome_resources": {"version": 21, "aliases": {"ensembl": "homo_sapiens_vep_93_GRCh38",
+                                                            "human": True, "snpeff": "GRCh38.86"},
+                                 "variation": {k: os.path.join(ref_dir, "variation", "%s.vcf.gz" % k)
+                                               for k in ["dbsnp", "cosmic", "clinvar", "esp", "exac",
+                                                         "gnomad_exome", "lcr", "polyx", "train_hapmap"]}},
+            "config": {"algorithm": {"aligner": "bwa", "mark_duplicates": True, "recalibrate": False,
+                                     "realign": False, "variantcaller": ["gatk-haplotype", "freebayes"],
+                                     "tools_on": ["gemini"], "coverage_interval": "genome",
+                                     "num_cores": 16, "validate_regions": None},
+                       "resources": {p: {"cores": 16, "memory": "3G", "jvm_opts": ["-Xms750m", "-Xmx3500m"]}
+                                     for p in ["default", "gatk", "bwa", "samtools", "freebayes",
+                                               "snpeff", "vep", "qualimap", "picard"]}},
+            "metadata": {"batch": "batch%s" % (i % 10), "phenotype": "tumor" if i % 2 else "normal"}}
+
+def run_args(num_samples):
+    return [[sample_data(i)] for i in range(num_samples)]
+
+def _pure_yaml_write(data, fname):
+    with open(fname, "w") as out_handle:
+        yaml.safe_dump(data, out_handle, default_flow_style=False, allow_unicode=False)
+
+def _pure_yaml_read(fname):
+    with open(fname) as in_handle:
+        return yaml.safe_load(in_handle)
+
+def _formats():
+    out = [("yaml-python", ".yaml", _pure_yaml_write, _pure_yaml_read)]
+    for fmt in ["yaml", "json", "msgpack"]:
+        try:
+            serialize.dumps({}, fmt)
+        except ImportError:
+            continue
+        out.append((fmt, serialize.extension(fmt),
+                    lambda data, fname, fmt=fmt: serialize.write(data, fname, fmt),
+                    lambda fname, fmt=fmt: serialize.read(fname, fmt)))
+    return out
+
+def _time(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.time()
+        fn()
+        times.append(time.time() - start)
+    return min(times)
+
+def main(sample_counts, repeats):
+    work_dir = tempfile.mkdtemp()
+    try:
+        print("%-8s %-12s %10s %10s %10s" % ("samples", "format", "write(s)", "read(s)", "size(kb)"))
+        for num_samples in sample_counts:
+            data = run_args(num_samples)
+            for name, ext, writer, reader in _formats():
+                fname = os.path.join(work_dir, "runfn-args%s" % ext)
+                write_time = _time(lambda: writer(data, fname), repeats)
+                read_time = _time(lambda: reader(fname), repeats)
+                assert reader(fname) == data
+                print("%-8s %-12s %10.4f %10.4f %10.1f" % (num_samples, name, write_time, read_time,
+                                                          os.path.getsize(fname) / 1024.0))
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark runfn argument file serialization")
+    parser.add_argument("--samples", default="1,10,100,1000",
+                        help="Comma separated sample counts to benchmark")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of runs per measurement")
+    args = parser.parse_args()
+    main([int(x) for x in args.samples.split(",")], args.repeats)
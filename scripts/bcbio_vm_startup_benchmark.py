@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""Benchmark command line start up time for bcbio_vm.py sub-commands.
+
+Runs each sub-command in a fresh interpreter and reports wall time and the
+number of modules imported while building the argument parser and dispatching.
+Commands run with `-h` so they exit after parser set up without needing inputs,
+which isolates the import and parser construction cost paid on every call.
+
+Usage:
+  bcbio_vm_startup_benchmark.py [--repeats N] [--script path/to/bcbio_vm.py]
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+COMMANDS = [["-h"], ["runfn", "-h"], ["run", "-h"], ["aws", "info", "-h"]]
+
+_DRIVER = """
+import atexit, json, runpy, sys
+base = set(sys.modules)
+def _report():
+    sys.stderr.write("BENCHMARK %%s\\n" %% json.dumps({"imports": len(set(sys.modules) - base)}))
+atexit.register(_report)
+sys.argv = [%r] + %r
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+def run_command(script, cmd):
+    """Run a single bcbio_vm.py invocation, returning wall time and modules imported.
+    """
+    start = time.time()
+    proc = subprocess.Popen([sys.executable, "-c", _DRIVER % (script, cmd)],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, stderr = proc.communicate()
+    elapsed = time.time() - start
+    imports = None
+    for line in stderr.decode(errors="ignore").split("\n"):
+        if line.startswith("BENCHMARK "):
+            imports = json.loads(line.split(" ", 1)[1])["imports"]
+    if imports is None:
+        sys.stderr.write(stderr.decode(errors="ignore"))
+    return elapsed, imports
+
+def main(script, repeats):
+    print("%-20s %10s %10s %8s" % ("command", "median(s)", "min(s)", "imports"))
+    for cmd in COMMANDS:
+        times = []
+        imports = None
+        for _ in range(repeats):
+            elapsed, imports = run_command(script, cmd)
+            times.append(elapsed)
+        times.sort()
+        print("%-20s %10.3f %10.3f %8s" % (" ".join(cmd), times[len(times) // 2], times[0],
+                                           imports if imports is not None else "failed"))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark bcbio_vm.py start up time")
+    parser.add_argument("--repeats", type=int, default=5, help="Number of runs per command")
+    parser.add_argument("--script", help="bcbio_vm.py script to benchmark",
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "bcbio_vm.py"))
+    args = parser.parse_args()
+    main(args.script, args.repeats)
@@ -1,11 +1,19 @@
 import collections
 import contextlib
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler
 import io
+import json
 import os
+import re
 import shutil
+import socketserver
+import struct
 import subprocess
 import tarfile
+import tempfile
+import threading
+import urllib.parse
 
 import pytest
 import requests
@@ -117,3 +125,97 @@ def _download_to_dir(url, dirname):
     subprocess.check_call(["tar", "-xzvpf", os.path.basename(url)])
     shutil.move(os.path.basename(dirname), dirname)
     os.remove(os.path.basename(url))
+
+
+# Fake docker engine API, implementing the few endpoints used by bcbiovm
+
+class FakeEngine(object):
+    """Implement the few docker engine endpoints used by bcbiovm.
+    """
+    def __init__(self):
+        self.images = {"quay.io/bcbio/bcbio-vc:latest": "sha256:1234"}
+        self.containers = {}
+        self.created = 0
+        self.logs = [b"line one\n", b"line two\n"]
+        self.exit_code = 0
+
+    def handle(self, method, path, body):
+        path, _, query = path.partition("?")
+        params = urllib.parse.parse_qs(query)
+        m = re.match(r"/images/(.+)/json$", path)
+        if method == "GET" and m:
+            image = m.group(1)
+            image = image if ":" in image.split("/")[-1] else image + ":latest"
+            if image in self.images:
+                return 200, {"Id": self.images[image]}
+            return 404, {"message": "No such image: %s" % image}
+        if method == "GET" and path == "/images/json":
+            refs = json.loads(params.get("filters", ["{}"])[0]).get("reference", [])
+            return 200, [{"Id": image_id} for image, image_id in sorted(self.images.items())
+                         if not refs or any(image == ref or image.startswith(ref + ":") for ref in refs)]
+        if method == "POST" and path == "/containers/create":
+            if body["Image"] not in self.images and body["Image"] + ":latest" not in self.images:
+                return 404, {"message": "No such image: %s" % body["Image"]}
+            cid = "c%s" % self.created
+            self.created += 1
+            self.containers[cid] = body
+            return 201, {"Id": cid}
+        if method == "GET" and path == "/containers/json":
+            filters = json.loads(params.get("filters", ["{}"])[0]).get("label", [])
+            return 200, [{"Id": cid} for cid, body in self.containers.items()
+                         if all(f in ["%s=%s" % x for x in (body.get("Labels") or {}).items()]
+                                for f in filters)]
+        m = re.match(r"/containers/(\w+)(/\w+)?$", path)
+        if m and m.group(1) in self.containers:
+            action = m.group(2)
+            if method == "POST" and action == "/start":
+                return 204, None
+            elif method == "POST" and action == "/wait":
+                return 200, {"StatusCode": self.exit_code}
+            elif method == "GET" and action == "/logs":
+                return 200, b"".join(struct.pack(">BxxxL", 1, len(x)) + x for x in self.logs)
+            elif method == "DELETE" and action is None:
+                del self.containers[m.group(1)]
+                return 204, None
+        return 404, {"message": "not found"}
+
+
+def _make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        def address_string(self):
+            return "local"
+
+        def log_message(self, *args):
+            pass
+
+        def _respond(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length)) if length else None
+            status, data = fake.handle(self.command, self.path, body)
+            if data is not None and not isinstance(data, bytes):
+                data = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(data or b"")))
+            self.end_headers()
+            if data:
+                self.wfile.write(data)
+        do_GET = do_POST = do_DELETE = _respond
+    return Handler
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def fake_engine(monkeypatch):
+    fake = FakeEngine()
+    sock = os.path.join(tempfile.mkdtemp(), "docker.sock")
+    server = _Server(sock, _make_handler(fake))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    monkeypatch.setenv("DOCKER_HOST", "unix://%s" % sock)
+    yield fake
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,56 @@
+"""Test the node-local cache of biodata files.
+"""
+import os
+
+import pytest
+
+from bcbiovm.ship import biocache
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    monkeypatch.setenv("BCBIO_VM_NODE_DIR", str(tmp_path / "node"))
+    monkeypatch.setenv("BCBIO_VM_BIODATA_CACHE", str(tmp_path / "cache"))
+    downloads = []
+    def download(out_fname, keyname, bucket, retries=0):
+        downloads.append(out_fname)
+        with open(out_fname, "w") as out_handle:
+            out_handle.write("ACGT")
+    return biocache.fetch_fn({"genomes/hg38.fa": ("etag1", 4)}, download), downloads
+
+
+def test_disabled_by_default(monkeypatch):
+    monkeypatch.delenv("BCBIO_VM_BIODATA_CACHE", raising=False)
+    assert not biocache.is_enabled()
+
+
+def test_fetch_shares_downloads(cache, tmp_path):
+    fetch, downloads = cache
+    for task in ["t1", "t2"]:
+        fetch(str(tmp_path / task / "hg38.fa"), "genomes/hg38.fa", "biodata")
+    assert len(downloads) == 1
+    assert not os.path.islink(str(tmp_path / "t2" / "hg38.fa"))
+    assert os.stat(str(tmp_path / "t2" / "hg38.fa")).st_nlink == 3
+
+
+def test_fetch_other_filesystem(cache, tmp_path, monkeypatch):
+    fetch, downloads = cache
+    monkeypatch.setattr(biocache, "_same_device", lambda d1, d2: False)
+    out_fname = str(tmp_path / "t1" / "hg38.fa")
+    fetch(out_fname, "genomes/hg38.fa", "biodata")
+    assert downloads == [out_fname]
+    assert os.listdir(str(tmp_path / "cache")) == []
+    assert not os.path.islink(out_fname) and os.path.getsize(out_fname) == 4
+
+
+def test_fetch_without_hardlinks(cache, tmp_path, monkeypatch):
+    fetch, downloads = cache
+    def no_link(*args):
+        raise OSError("Too many links")
+    monkeypatch.setattr(os, "link", no_link)
+    for task in ["t1", "t2"]:
+        fetch(str(tmp_path / task / "hg38.fa"), "genomes/hg38.fa", "biodata")
+    assert len(downloads) == 1 and downloads[0].startswith(str(tmp_path / "cache"))
+    out_fname = str(tmp_path / "t2" / "hg38.fa")
+    assert not os.path.islink(out_fname) and os.path.getsize(out_fname) == 4
+    assert [f for f in os.listdir(str(tmp_path / "t2")) if f.endswith(".tmp")] == []
@@ -0,0 +1,59 @@
+"""Test indexed lookups in remote file listings against linear scans.
+"""
+import collections
+import fnmatch
+import random
+
+import pytest
+
+from bcbiovm.shared import catalog
+
+PARTS = ["a", "b", "ref", "x.bam", "x.bam.bai", "s1.fq.gz", "genome", "hg38", "data", "data2"]
+
+
+@pytest.fixture
+def listing():
+    rand = random.Random(42)
+    return ["/".join(rand.choice(PARTS) for _ in range(rand.randint(1, 4))) for _ in range(500)]
+
+
+def _linear(listing, match_fn):
+    return [i for i, path in enumerate(listing) if match_fn(path)]
+
+
+def test_exact(listing):
+    files = catalog.Catalog(listing)
+    for query in set(listing[:50]) | set(["missing", "a/b/missing"]):
+        assert files.exact(query) == _linear(listing, lambda p: p == query)
+
+
+def test_endswith(listing):
+    files = catalog.Catalog(listing)
+    for query in PARTS + ["a/x.bam", "hg38/genome", "data", "ata2", "ref/b/x.bam.bai"]:
+        assert files.endswith(query) == _linear(listing, lambda p: p.endswith("/" + query))
+
+
+def test_startswith(listing):
+    files = catalog.Catalog(listing)
+    for query in PARTS + ["a/", "data/", "data2/", "ref/a", "", "r"]:
+        assert files.startswith(query) == _linear(listing, lambda p: p.startswith(query))
+
+
+def test_glob(listing):
+    files = catalog.Catalog(listing)
+    for query in ["*.bam", "*.bai", "ref/*.bam", "b/*", "s1*", "g*e", "*a2", "*/genome",
+                  "x.ba?", "data[0-9]", "*", "hg38/*/x.bam"]:
+        assert files.glob(query) == _linear(listing, lambda p: fnmatch.fnmatchcase(p, "*/%s" % query))
+
+
+def test_get_reuses_and_bounds(listing, monkeypatch):
+    monkeypatch.setattr(catalog, "_cache", collections.OrderedDict())
+    monkeypatch.setenv("BCBIO_VM_CATALOG_ENTRIES", str(len(listing) * 2))
+    first = catalog.get("paths", listing)
+    assert catalog.get("paths", listing) is first
+    others = [list(listing) for _ in range(3)]
+    for other in others:
+        catalog.get("paths", other)
+    assert sum(len(c) for _, c in catalog._cache.values()) <= len(listing) * 2
+    assert catalog.get("paths", others[-1]) is catalog._cache[("paths", id(others[-1]), len(listing))][1]
+    assert ("paths", id(listing), len(listing)) not in catalog._cache
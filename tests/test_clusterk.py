@@ -0,0 +1,72 @@
+"""Test running tasks with the argument shapes bcbio's Clusterk runners pass.
+"""
+import os
+
+import pytest
+
+from bcbiovm.clusterk import clusterktasks, multitasks
+from bcbiovm.docker import supervisor
+from bcbiovm.shared import serialize
+from bcbiovm.ship import pack, reconstitute
+
+
+@pytest.fixture
+def clusterk_run(tmp_path, monkeypatch):
+    """Run tasks locally, recording the files bcbio_vm.py runfn would receive.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(pack, "send_run", lambda args, config: args)
+    monkeypatch.setattr(reconstitute, "get_output", lambda out_file, config: out_file)
+    calls = []
+    def _fake_runfn(fn_name, parallel_file, arg_file):
+        parallel = serialize.read(parallel_file)
+        runargs = serialize.read(arg_file)
+        calls.append((fn_name, parallel_file, arg_file, parallel))
+        out_file = "%s-out%s" % os.path.splitext(arg_file)
+        serialize.write([[dict(runargs[0], done=True)]], out_file, serialize.get_format(arg_file, parallel))
+    monkeypatch.setattr(clusterktasks, "_test_clusterk", _fake_runfn)
+    return calls
+
+
+def _parallel(fmt=None):
+    wrap_args = {"sample_config": "/work/sample-ready.yaml", "docker_config": {"image_url": "bcbio/bcbio"},
+                 "fcdir": None, "datadir": "/data", "systemconfig": "/data/bcbio_system.yaml",
+                 serialize.FORMAT_KEY: fmt}
+    return {"type": "clusterk", "module": "bcbiovm.clusterk", "wrapper": "runfn",
+            "pack": {"type": "S3"}, "wrapper_args": [wrap_args]}
+
+
+@pytest.mark.parametrize("fmt", [None, "yaml", "json"])
+def test_runfn_wrapper_args(clusterk_run, fmt):
+    parallel = _parallel(fmt)
+    out = clusterktasks.runfn("process_alignment", {"queue": "default"}, parallel.get("wrapper_args"),
+                              parallel, [{"description": "s1"}])
+    assert out == [[{"description": "s1", "done": True}]]
+    fn_name, parallel_file, arg_file, task_parallel = clusterk_run[0]
+    assert fn_name == "process_alignment"
+    assert arg_file.endswith(serialize.extension(fmt or "yaml"))
+    assert task_parallel["pack"] == {"type": "S3"}
+    assert task_parallel[serialize.FORMAT_KEY] == (fmt or "yaml")
+    assert not os.path.exists(arg_file) and not os.path.exists(parallel_file)
+
+
+def test_multitasks_runfn_wrapper_args(tmp_path, monkeypatch):
+    monkeypatch.setenv("BCBIO_VM_NODE_DIR", str(tmp_path))
+    calls = []
+    def _do_runfn(fn_name, fn_args, cmd_args, parallel, dockerconf):
+        calls.append((fn_name, cmd_args, parallel, dockerconf))
+        return [[dict(fn_args[0], done=True)]]
+    monkeypatch.setattr(supervisor.run, "do_runfn", _do_runfn)
+    parallel = _parallel()
+    parallel["wrapper_args"][0]["pack"] = parallel["pack"]
+    # bcbio's multiprocessing runner splices wrapper_args and passes only fresources and checkpointed
+    wrap_parallel = {"fresources": [], "checkpointed": False}
+    out = multitasks.runfn(*(["process_alignment"] + parallel["wrapper_args"] + [wrap_parallel] +
+                             [{"description": "s1"}]))
+    assert out == [[{"description": "s1", "done": True}]]
+    fn_name, cmd_args, task_parallel, dockerconf = calls[0]
+    assert fn_name == "process_alignment"
+    assert cmd_args["pack"] == {"type": "S3"}
+    assert cmd_args["image"] == "bcbio/bcbio"
+    assert task_parallel == wrap_parallel
+    assert dockerconf == {"image_url": "bcbio/bcbio"}
@@ -0,0 +1,63 @@
+"""Test the docker engine API client against a fake engine socket server.
+"""
+from bcbiovm.docker import engine
+
+
+def test_inspect_image(fake_engine):
+    assert engine.is_available()
+    assert engine.inspect_image("quay.io/bcbio/bcbio-vc")["Id"] == "sha256:1234"
+    assert engine.inspect_image("quay.io/bcbio/bcbio-vc:missing") is None
+
+
+def test_run_container(fake_engine):
+    lines = []
+    result = engine.run_container("quay.io/bcbio/bcbio-vc", ["bcbio_nextgen.py", "version"],
+                                  binds=["/data:/data"], ports=["8085:8085"], log_fn=lines.append)
+    assert result.exit_code == 0 and result.error is None
+    assert lines == ["line one", "line two"]
+    assert fake_engine.containers == {}
+
+
+def test_run_container_errors(fake_engine):
+    fake_engine.exit_code = 3
+    result = engine.run_container("quay.io/bcbio/bcbio-vc", ["false"])
+    assert result.exit_code == 3
+    result = engine.run_container("missing/image", ["true"])
+    assert result.cid is None and "No such image" in result.error
+
+
+def test_run_container_limits(fake_engine):
+    created = []
+    orig_handle = fake_engine.handle
+    def handle(method, path, body):
+        if path == "/containers/create":
+            created.append(body)
+        return orig_handle(method, path, body)
+    fake_engine.handle = handle
+    engine.run_container("quay.io/bcbio/bcbio-vc", ["true"],
+                         limits={"cpus": 2.0, "memory": 4 * 1024 ** 3, "cpuset_cpus": "0,1",
+                                 "blkio_weight": 800})
+    host_config = created[0]["HostConfig"]
+    assert host_config["NanoCpus"] == 2 * 10 ** 9
+    assert host_config["Memory"] == host_config["MemorySwap"] == 4 * 1024 ** 3
+    assert host_config["CpusetCpus"] == "0,1" and host_config["BlkioWeight"] == 800
+
+
+def test_exec_never_started(fake_engine):
+    fake_engine.containers["c0"] = {"Image": "quay.io/bcbio/bcbio-vc"}
+    result = engine.exec_run("c0", ["true"])
+    assert result.cid is None and result.error
+
+
+def test_list_images(fake_engine):
+    fake_engine.images = {"quay.io/bcbio/bcbio-vc:1.2.9": "sha256:5678"}
+    assert engine.inspect_image("quay.io/bcbio/bcbio-vc") is None
+    assert engine.list_images("quay.io/bcbio/bcbio-vc") == ["sha256:5678"]
+    assert engine.list_images("quay.io/bcbio/other") == []
+
+
+def test_create_container_auto_remove(fake_engine):
+    cid = engine.create_container("quay.io/bcbio/bcbio-vc", ["true"], auto_remove=True)
+    assert fake_engine.containers[cid]["HostConfig"]["AutoRemove"] is True
+    cid = engine.create_container("quay.io/bcbio/bcbio-vc", ["true"])
+    assert "AutoRemove" not in fake_engine.containers[cid]["HostConfig"]
@@ -0,0 +1,26 @@
+"""Test checking for local docker images before installing or running.
+"""
+import argparse
+
+import pytest
+
+from bcbiovm.docker import install
+
+
+@pytest.fixture
+def images(fake_engine, monkeypatch, tmp_path):
+    monkeypatch.setenv("BCBIO_VM_NODE_DIR", str(tmp_path))
+    fake_engine.images = {"quay.io/bcbio/bcbio-vc:1.2.9": "sha256:5678"}
+    return fake_engine
+
+
+def test_untagged_image_matches_any_tag(images):
+    assert install._check_docker_image(argparse.Namespace(image="quay.io/bcbio/bcbio-vc"))
+
+
+def test_tagged_image_matches_tag(images):
+    assert install._check_docker_image(argparse.Namespace(image="quay.io/bcbio/bcbio-vc:1.2.9"))
+    assert not install._check_docker_image(argparse.Namespace(image="quay.io/bcbio/bcbio-vc:latest"),
+                                           raise_error=False)
+    with pytest.raises(ValueError):
+        install._check_docker_image(argparse.Namespace(image="quay.io/bcbio/other"))
@@ -0,0 +1,40 @@
+"""Test recording and summarizing file transfers.
+"""
+import os
+import threading
+
+from bcbiovm.ship import ledger
+
+
+def test_record_and_read(tmp_path):
+    work_dir = str(tmp_path)
+    ledger.record("copy", "/in/a.bam", "/tmp/a.bam", 100, 1.0)
+    assert list(ledger.read(work_dir)) == []
+    with ledger.context(work_dir, "process_alignment"):
+        ledger.record("copy", "/in/a.bam", "/tmp/a.bam", 100, 2.0, method="reflink")
+        ctx = ledger.current()
+        t = threading.Thread(target=ledger.record, args=("s3_get", "s3://run/b.vcf", "/tmp/b.vcf", 50, 0),
+                             kwargs={"skipped": True, "ctx": ctx})
+        t.start()
+        t.join()
+    assert ledger.current() is None
+    with open(os.path.join(work_dir, ledger.LEDGER_DIR, "other.jsonl"), "w") as out_handle:
+        out_handle.write("\n{not json\n")
+    records = list(ledger.read(work_dir))
+    assert [(r["op"], r["task"], r["skipped"]) for r in records] == [("copy", "process_alignment", False),
+                                                                    ("s3_get", "process_alignment", True)]
+    assert records[0]["method"] == "reflink" and records[0]["throughput"] == 50.0
+    assert records[1]["throughput"] is None
+
+
+def test_summarize():
+    records = [{"op": "copy", "task": "align", "node": "n1", "bytes": 100, "duration": 2.0},
+               {"op": "copy", "task": "align", "node": "n2", "bytes": 300, "duration": 1.0},
+               {"op": "copy", "task": "align", "node": "n1", "bytes": 50, "duration": 0, "skipped": True},
+               {"op": "s3_get", "task": None, "node": "n1", "bytes": 10, "duration": 0.5}]
+    by_task = ledger.summarize(records, "task")
+    assert list(by_task.keys()) == [("align", "copy"), ("unknown", "s3_get")]
+    assert by_task[("align", "copy")] == {"files": 3, "skipped": 1, "bytes": 400, "duration": 3.0}
+    by_node = ledger.summarize(records, "node")
+    assert by_node[("n1", "copy")] == {"files": 2, "skipped": 1, "bytes": 100, "duration": 2.0}
+    assert by_node[("n1", "s3_get")]["bytes"] == 10
@@ -0,0 +1,27 @@
+"""Test resource limits for runfn containers.
+"""
+from bcbiovm.docker import limits
+
+
+def test_job_parallel_from_sample_config():
+    data = {"config": {"algorithm": {"num_cores": 4},
+                       "parallel": {"cores_per_job": 8, "mem": 3.5, "num_jobs": 2}}}
+    parallel = limits.job_parallel({"fresources": [], "checkpointed": False}, [[data], "other"])
+    assert parallel["cores_per_job"] == 8 and parallel["mem"] == 3.5
+    assert "num_jobs" not in parallel
+    assert limits.job_parallel({"cores_per_job": 2}, [data])["cores_per_job"] == 2
+
+
+def test_job_parallel_multiprocessing_cores():
+    data = {"config": {"algorithm": {"num_cores": 4}}}
+    assert limits.job_parallel({}, [data])["cores_per_job"] == 4
+    assert limits.job_parallel({}, ["no data"]) == {}
+
+
+def test_memory_swap(monkeypatch):
+    memory = limits.from_parallel("align", {"mem": 2})["memory"]
+    assert limits.from_parallel("align", {"mem": 2})["memory_swap"] == 2 * memory
+    monkeypatch.setenv("BCBIO_DOCKER_MEMORY_SWAP", "0")
+    assert limits.from_parallel("align", {"mem": 2})["memory_swap"] == memory
+    monkeypatch.setenv("BCBIO_DOCKER_MEMORY_SWAP", "-1")
+    assert limits.from_parallel("align", {"mem": 2})["memory_swap"] == -1
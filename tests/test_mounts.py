@@ -0,0 +1,84 @@
+"""Test planning of docker mounts for input directories.
+"""
+from bcbiovm.docker import mounts
+
+
+def _identity(dirs, opts=""):
+    return ["%s:%s%s" % (d, d, opts) for d in dirs]
+
+
+def test_minimize_collapses_common_parent():
+    dirs = ["/data/project/s%s" % i for i in range(4)]
+    assert mounts.minimize(_identity(dirs), max_mounts=2) == ["/data/project:/data/project"]
+    assert mounts.minimize(_identity(dirs + ["/data/project/s1/sub"]), max_mounts=10) == _identity(dirs)
+
+
+def test_minimize_refuses_system_and_image_parents():
+    for base in ["/usr/local", "/var/lib", "/opt/conda", "/srv", "/usr/local/share"]:
+        dirs = ["%s/a/x" % base, "%s/b/y" % base]
+        assert mounts.minimize(_identity(dirs), max_mounts=1) == _identity(dirs), base
+    dirs = ["/home/user1/data", "/home/user2/data"]
+    assert mounts.minimize(_identity(dirs), max_mounts=1) == _identity(dirs)
+    dirs = ["/data1/x", "/data2/y"]
+    assert mounts.minimize(_identity(dirs), max_mounts=1) == _identity(dirs)
+
+
+def test_minimize_custom_forbidden():
+    dirs = ["/mnt/shared/a", "/mnt/shared/b"]
+    assert mounts.minimize(_identity(dirs), max_mounts=1, forbidden=["/mnt/shared/a/inner"]) == \
+        _identity(dirs)
+    assert mounts.minimize(_identity(dirs), max_mounts=1, forbidden=["/mnt/other"]) == \
+        ["/mnt/shared:/mnt/shared"]
+
+
+def test_minimize_keeps_options():
+    ro = _identity(["/data/ref/a", "/data/ref/b"], ":ro")
+    assert mounts.minimize(ro, max_mounts=1) == ["/data/ref:/data/ref:ro"]
+    out = mounts.minimize(ro + _identity(["/data/ref"]), max_mounts=10)
+    assert out == ["/data/ref:/data/ref"]
+    out = mounts.minimize(_identity(["/data/in"], ":ro") + _identity(["/data/in"]), max_mounts=10)
+    assert out == ["/data/in:/data/in"]
+    out = mounts.minimize(_identity(["/data/ref"], ":ro") + _identity(["/data/ref/out"]), max_mounts=10)
+    assert out == ["/data/ref/out:/data/ref/out", "/data/ref:/data/ref:ro"]
+
+
+def test_minimize_remapped_destinations():
+    dirs = ["/mnt/work/a", "/mnt/work/b"]
+    other = ["/scratch/biodata:/mnt/work/biodata"]
+    assert mounts.minimize(_identity(dirs) + other, max_mounts=1) == _identity(dirs) + other
+
+
+def test_path_cache(tmp_path):
+    cache = mounts.PathCache()
+    fname = tmp_path / "in.bam"
+    assert not cache.exists(str(fname))
+    fname.write_text(u"x")
+    # Existence checks are cached for the life of the normalization
+    assert not cache.exists(str(fname))
+    assert mounts.PathCache().exists(str(fname))
+    link = tmp_path / "link.bam"
+    link.symlink_to(fname)
+    assert cache.realpath(str(link)) == str(fname.resolve())
+
+
+def test_normalize_config_threads(tmp_path):
+    ref_dir = tmp_path / "ref"
+    ref_dir.mkdir()
+    (ref_dir / "regions.bed").write_text(u"chr1\t1\t10\n")
+    details = []
+    for i in range(4):
+        fq = tmp_path / ("s%s.fq" % i)
+        fq.write_text(u"@r\nA\n+\nI\n")
+        (tmp_path / ("l%s.fq" % i)).symlink_to(fq)
+        details.append({"description": "s%s" % i, "files": ["l%s.fq" % i],
+                        "algorithm": {"variant_regions": "ref/regions.bed", "variantcaller": "gatk"}})
+    serial, serial_dirs = mounts.normalize_config({"details": [dict(d) for d in details]},
+                                                  str(tmp_path), threads=1)
+    threaded, threaded_dirs = mounts.normalize_config({"details": [dict(d) for d in details]},
+                                                      str(tmp_path), threads=3)
+    assert serial == threaded
+    assert serial_dirs == threaded_dirs
+    real_dir = str(tmp_path.resolve())
+    assert serial["details"][2]["files"] == [real_dir + "/s2.fq"]
+    assert serial["details"][2]["algorithm"]["variant_regions"] == real_dir + "/ref/regions.bed"
+    assert serial["details"][2]["algorithm"]["variantcaller"] == "gatk"
@@ -0,0 +1,130 @@
+"""Test packing inputs for shipping to S3.
+"""
+import os
+
+import pytest
+
+from bcbiovm.docker import remap
+from bcbiovm.ship import pack, reconstitute
+
+
+def _write(fname, content):
+    with open(str(fname), "wb") as out_handle:
+        out_handle.write(content)
+    return str(fname)
+
+
+def _files(tmp_path):
+    contents = {"a.txt": b"a" * 10, "b.vcf": b"b" * 700, "c.bed": b"", "big.bam": b"x" * 5000}
+    return contents, [(_write(tmp_path / name, data), "run-bucket", "inputs")
+                      for name, data in sorted(contents.items())]
+
+
+def test_bundle_index_round_trip(tmp_path):
+    contents, files = _files(tmp_path)
+    bundle_dir = tmp_path / "bundles"
+    out, index, transfers = pack._bundle_small_files(files, 1024, str(bundle_dir))
+    assert out == [(str(tmp_path / "big.bam"), "run-bucket", "inputs")]
+    assert len(transfers) == 1
+    bundle_file, bucket, keyname = transfers[0]
+    assert keyname == "inputs/%s" % os.path.basename(bundle_file)
+    out_dir = tmp_path / "extracted"
+    bundled = {bundle_file: []}
+    for name in ["a.txt", "b.vcf", "c.bed"]:
+        bundle_name, offset, size = index["s3://run-bucket/inputs/%s" % name]
+        assert bundle_name == "s3://run-bucket/%s" % keyname
+        bundled[bundle_file].append((str(out_dir / name), offset, size))
+    reconstitute._extract_bundles(bundled)
+    for name in ["a.txt", "b.vcf", "c.bed"]:
+        with open(str(out_dir / name), "rb") as in_handle:
+            assert in_handle.read() == contents[name]
+    assert not os.path.exists(bundle_file)
+
+
+def test_bundle_already_shipped(tmp_path):
+    _, files = _files(tmp_path)
+    bundle_dir = tmp_path / "bundles"
+    _, index, transfers = pack._bundle_small_files(files, 1024, str(bundle_dir))
+    checked = []
+    def _is_shipped(bucket_name, folder, keyname):
+        checked.append(keyname)
+        return True
+    out, shipped_index, shipped_transfers = pack._bundle_small_files(files, 1024, str(bundle_dir / "again"),
+                                                                     _is_shipped)
+    assert shipped_index == index
+    assert shipped_transfers == []
+    assert checked == [transfers[0][2]]
+    assert not os.path.exists(str(bundle_dir / "again"))
+
+
+class _Key(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class _FakeBucket(object):
+    """Bucket listing existing keys by prefix, standing in for boto S3 buckets.
+    """
+    def __init__(self, keys):
+        self.keys = keys
+        self.listed = []
+
+    def list(self, prefix=""):
+        self.listed.append(prefix)
+        return [_Key(k) for k in self.keys if k.startswith(prefix)]
+
+
+class _FakeConn(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+
+    def get_bucket(self, name):
+        return self.buckets[name]
+
+
+@pytest.fixture(autouse=True)
+def _fake_s3(monkeypatch):
+    monkeypatch.setattr(pack, "_get_s3_bucket", lambda conn, name: conn.get_bucket(name))
+
+
+def _s3_inputs(tmp_path):
+    in_dir = tmp_path / "work"
+    in_dir.mkdir()
+    fnames = [_write(in_dir / name, data) for name, data in
+              [("a.bam", b"a" * 100), ("b.vcf", b"b" * 100), ("c.vcf", b"a" * 100)]]
+    args = [{"config": {}, "align_bam": fnames[0], "vrn_files": fnames[1:]}]
+    return args, fnames, {str(in_dir): {"bucket": "run", "folder": "work"}}
+
+
+def test_plan_s3_transfers(tmp_path):
+    args, fnames, dir_to_s3 = _s3_inputs(tmp_path)
+    bucket = _FakeBucket(["work/b.vcf", "other/a.bam"])
+    out, manifest, bundles = pack._plan_s3_transfers(_FakeConn({"run": bucket}), args, dir_to_s3)
+    assert sorted(out) == [(fnames[0], "run", "work/a.bam"), (fnames[2], "run", "work/c.vcf")]
+    assert bucket.listed == ["work/"]
+    assert manifest == {} and bundles == {}
+
+
+def test_content_manifest_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setenv("BCBIO_VM_NODE_DIR", str(tmp_path / "node"))
+    args, fnames, dir_to_s3 = _s3_inputs(tmp_path)
+    # a.bam has an index, b.vcf and c.vcf do not
+    _write(fnames[0] + ".bai", b"i" * 10)
+    bucket = _FakeBucket([])
+    out, manifest, _ = pack._plan_s3_transfers(_FakeConn({"run": bucket}), args, dir_to_s3,
+                                               content_addressed=True)
+    # a.bam and c.vcf have the same contents, so ship once
+    assert len(out) == 3
+    assert all(keyname.startswith(pack.CAS_FOLDER + "/") for _, _, keyname in out)
+    assert manifest["s3://run/work/a.bam"] == manifest["s3://run/work/c.vcf"]
+    s3_args = remap.walk_files(args, pack._remap_s3, dir_to_s3, pass_dirs=True)
+    s3_args[0][pack.MANIFEST_KEY] = manifest
+    requested = []
+    monkeypatch.setattr(reconstitute, "_transfer_s3_all",
+                        lambda transfers, bucket, cache=False: requested.extend(transfers))
+    monkeypatch.chdir(tmp_path)
+    local_dir, local_args = reconstitute._unpack_s3("run", s3_args)
+    assert local_args[0]["align_bam"] == os.path.join(local_dir, "work", "a.bam")
+    expected = [(os.path.join(local_dir, "work", name), manifest["s3://run/work/%s" % name])
+                for name in ["a.bam", "a.bam.bai", "b.vcf", "c.vcf"]]
+    assert sorted(requested) == sorted(expected)
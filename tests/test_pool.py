@@ -0,0 +1,31 @@
+"""Test the keepalive of pooled containers, running its shell commands locally.
+"""
+import subprocess
+import time
+
+from bcbiovm.docker import pool
+
+
+def test_keepalive_exits_when_idle(tmp_path):
+    start = time.time()
+    keepalive = subprocess.Popen(pool._keepalive_cmd(1, str(tmp_path), check=0.2))
+    assert keepalive.wait(timeout=10) == 0
+    assert time.time() - start < 5
+
+
+def test_keepalive_waits_for_running_exec(tmp_path):
+    keepalive = subprocess.Popen(pool._keepalive_cmd(1, str(tmp_path), check=0.2))
+    time.sleep(0.5)
+    start = time.time()
+    status = subprocess.call(pool._exec_cmd(["sh", "-c", "sleep 2; exit 3"], str(tmp_path)))
+    assert status == 3
+    assert keepalive.poll() is None
+    assert list(tmp_path.glob("busy.*")) == []
+    assert keepalive.wait(timeout=10) == 0
+    assert time.time() - start > 2
+
+
+def test_keepalive_ignores_stale_busy_markers(tmp_path):
+    (tmp_path / "busy.999999999").write_text(u"")
+    keepalive = subprocess.Popen(pool._keepalive_cmd(1, str(tmp_path), check=0.2))
+    assert keepalive.wait(timeout=10) == 0
@@ -0,0 +1,76 @@
+"""Test pre-warming docker images on cluster nodes.
+"""
+import pytest
+
+from bcbiovm.aws import prewarm
+from bcbiovm.docker import imagecache
+
+DIGEST = "sha256:" + "a" * 64
+
+
+class _Channel(object):
+    def __init__(self, status):
+        self.status = status
+
+    def recv_exit_status(self):
+        return self.status
+
+
+class _Stream(object):
+    def __init__(self, output, status=0):
+        self.output = output
+        self.channel = _Channel(status)
+
+    def read(self):
+        return self.output.encode()
+
+
+class _FakeClient(object):
+    """SSH client running no commands, failing those matching any of `fail`.
+    """
+    def __init__(self, fail):
+        self.fail = fail
+        self.cmds = []
+
+    def exec_command(self, cmd):
+        self.cmds.append(cmd)
+        if any(x in cmd for x in self.fail):
+            return None, _Stream("", 1), _Stream("no space left on device\n")
+        output = "quay.io/bcbio/bcbio-vc@%s\n" % DIGEST if "RepoDigests" in cmd else ""
+        return None, _Stream(output), _Stream("")
+
+    def close(self):
+        pass
+
+
+class _FakeNode(object):
+    name = "frontend001"
+
+    def __init__(self, client):
+        self.client = client
+
+    def connect(self, known_hosts_file=None):
+        return self.client
+
+
+class _FakeCluster(object):
+    known_hosts_file = None
+
+
+@pytest.mark.parametrize("fail", [[], ["docker save"]])
+def test_prewarm_node_save(fail):
+    client = _FakeClient(["docker load"] + fail)
+    out = prewarm._prewarm_node(_FakeCluster(), _FakeNode(client), "quay.io/bcbio/bcbio-vc", DIGEST,
+                                "/mnt/work/images", save=True)
+    assert out["ok"] and out["digest"] == DIGEST
+    assert "docker save quay.io/bcbio/bcbio-vc:latest" in client.cmds[-1]
+    if fail:
+        assert out["cache_error"] == "image cache save failed: no space left on device"
+    else:
+        assert out["cache_error"] is None
+
+
+def test_save_cmd_tagged_reference():
+    for image, ref in [("quay.io/bcbio/bcbio-vc:1.2.8", "quay.io/bcbio/bcbio-vc:1.2.8"),
+                       ("localhost:5000/bcbio-vc", "localhost:5000/bcbio-vc:latest")]:
+        assert "docker save %s " % ref in imagecache.save_cmd("/c", image, DIGEST)
@@ -0,0 +1,39 @@
+"""Test remapping file paths between the host and docker containers.
+"""
+from bcbiovm.docker import remap
+
+
+def test_longest_prefix_component_boundaries():
+    index = remap.MountIndex({"/data": "/mnt/data", "/data/sub": "/mnt/sub", "/data2": "/mnt/data2"})
+    assert index.longest_prefix("/data/file.bam") == ("/data", "/mnt/data")
+    assert index.longest_prefix("/data/sub/file.bam") == ("/data/sub", "/mnt/sub")
+    assert index.longest_prefix("/data2/file.bam") == ("/data2", "/mnt/data2")
+    assert index.longest_prefix("/data3/file.bam") is None
+    assert index.longest_prefix("/data") == ("/data", "/mnt/data")
+
+
+def test_longest_prefix_root_and_trailing_separator():
+    index = remap.MountIndex({"/": "/mnt", "/data/": "/work"})
+    assert index.longest_prefix("/data/file.bam") == ("/data/", "/work")
+    assert index.longest_prefix("/other/file.bam") == ("/", "/mnt")
+    assert remap.remap_fname("/other/file.bam", None, index) == "/mnt/other/file.bam"
+    assert remap.remap_fname("/data/file.bam", None, index) == "/work/file.bam"
+
+
+def test_index_updates():
+    index = remap.MountIndex({"/data": "/mnt/data"})
+    assert index.longest_prefix("/data2/file.bam") is None
+    index["/data2"] = "/mnt/data2"
+    assert index.longest_prefix("/data2/file.bam") == ("/data2", "/mnt/data2")
+    del index["/data"]
+    assert index.longest_prefix("/data/file.bam") is None
+    index.update({"/data": "/other"})
+    assert remap.remap_fname("/data/file.bam", None, index) == "/other/file.bam"
+
+
+def test_external_to_docker():
+    mounts = ["/data:/mnt/data", "/data2:/mnt/data2", "/data/work:/work"]
+    args = {"files": ["/data/a.bam", "/data2/b.bam", "/data/work/c.vcf"], "name": "sample"}
+    assert remap.external_to_docker(args, mounts) == {"files": ["/mnt/data/a.bam", "/mnt/data2/b.bam",
+                                                                "/work/c.vcf"],
+                                                      "name": "sample"}
@@ -0,0 +1,64 @@
+"""Test running bcbio functions inside docker containers.
+"""
+import os
+
+import pytest
+
+from bcbiovm.docker import run
+from bcbiovm.shared import serialize
+
+
+def test_runfn_argfile_yaml(tmp_path):
+    dockerconf = {"work_dir": "/mnt/work"}
+    mounts = ["%s:/mnt/work" % tmp_path]
+    args = [{"config": {}, "align_bam": str(tmp_path / "a.bam")}]
+    argfile, docker_argfile, outfile = run._write_runfn_argfile("process_alignment", args, str(tmp_path),
+                                                                mounts, dockerconf)
+    assert argfile.endswith(".yaml") and outfile.endswith("-out.yaml")
+    assert docker_argfile.startswith("/mnt/work/runfn-process_alignment-")
+    assert serialize.read(argfile) == [{"config": {}, "align_bam": "/mnt/work/a.bam"}]
+
+
+def _batch_setup(tmp_path):
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    galaxy_dir = tmp_path / "data" / "galaxy"
+    galaxy_dir.mkdir(parents=True)
+    (galaxy_dir / "bcbio_system.yaml").write_text(u"resources: {}\n")
+    dockerconf = {"work_dir": "/mnt/work", "biodata_dir": "/mnt/biodata"}
+    cmd_args = {"systemconfig": None, "image": "quay.io/bcbio/bcbio-vc",
+                "pack": {"type": "shared", "workdir": str(work_dir), "datadir": str(tmp_path / "data"),
+                         "tmpdir": None}}
+    parallel = {"fresources": [], "checkpointed": False}
+    return str(work_dir), dockerconf, cmd_args, parallel
+
+
+def test_runfn_batch(tmp_path, monkeypatch):
+    work_dir, dockerconf, cmd_args, parallel = _batch_setup(tmp_path)
+    items = [["organize_samples", dockerconf, cmd_args, parallel, {"config": {}, "name": "s1"}],
+             ["prepare_sample", dockerconf, cmd_args, parallel,
+              {"config": {}, "files": [os.path.join(work_dir, "s2.fq")]}]]
+    commands = []
+    def _run_cmd(image, mounts, cmd, ports=None, pooled=False, limits=None):
+        commands.append(cmd)
+        argfile, outfile = [x.replace(dockerconf["work_dir"], work_dir) for x in cmd[3:5]]
+        batch = serialize.read(argfile)
+        assert [fn_name for fn_name, _ in batch] == ["organize_samples", "prepare_sample"]
+        assert batch[1][1][0]["files"] == ["/mnt/work/s2.fq"]
+        serialize.write([[[{"name": "s1", "out": "/mnt/work/s1.txt"}]],
+                         [[{"files": ["/mnt/work/s2-prep.fq"]}]]], outfile)
+    monkeypatch.setattr(run.manage, "run_cmd", _run_cmd)
+    out = run.do_runfn_batch(items)
+    assert len(commands) == 1 and commands[0][:2] == ["bcbio_python", "-c"]
+    assert out == [[[{"name": "s1", "out": os.path.join(work_dir, "s1.txt")}]],
+                   [[{"files": [os.path.join(work_dir, "s2-prep.fq")]}]]]
+    assert [f for f in os.listdir(work_dir) if f.startswith("runfn-")] == []
+
+
+def test_runfn_batch_mismatched_items(tmp_path):
+    _, dockerconf, cmd_args, parallel = _batch_setup(tmp_path)
+    items = [["organize_samples", dockerconf, cmd_args, parallel, {}],
+             ["prepare_sample", dockerconf, cmd_args, dict(parallel, checkpointed=True), {}]]
+    with pytest.raises(ValueError):
+        run.do_runfn_batch(items)
+    assert run.do_runfn_batch([]) == []
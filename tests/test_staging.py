@@ -0,0 +1,120 @@
+"""Test staging inputs into local temporary space.
+"""
+import os
+
+import pytest
+
+from bcbiovm.ship import staging
+
+
+def _write(fname, size):
+    with open(str(fname), "wb") as out_handle:
+        out_handle.write(b"x" * size)
+    return str(fname)
+
+
+def test_policy_small_and_indexed(tmp_path):
+    small = _write(tmp_path / "small.txt", 100)
+    bam = _write(tmp_path / "big.bam", 4096)
+    _write(tmp_path / "big.bam.bai", 10)
+    fq = _write(tmp_path / "big.fq.gz", 4096)
+    stage = staging.policy({"small_mb": 1024 / 1024.0 ** 2, "large_gb": 2048 / 1024.0 ** 3,
+                            "min_free_gb": 1024 ** 2}, str(tmp_path))
+    assert stage(small)
+    assert stage(bam)
+    assert stage(str(tmp_path / "big.bam.bai"))
+    assert not stage(fq)
+
+
+def test_policy_large_with_space(tmp_path):
+    fq = _write(tmp_path / "big.fq.gz", 4096)
+    settings = {"small_mb": 0, "large_gb": 2048 / 1024.0 ** 3, "min_free_gb": 0,
+                "max_copy_seconds": 3600}
+    assert staging.policy(settings, str(tmp_path))(fq)
+    settings["max_copy_seconds"] = 0
+    assert not staging.policy(settings, str(tmp_path))(fq)
+
+
+def test_policy_defaults(tmp_path):
+    fq = _write(tmp_path / "reads.fq.gz", 4096)
+    assert staging.policy(None, str(tmp_path))(fq)
+
+
+def test_parse_settings():
+    assert staging.parse_settings(["small_mb=256", "max_copy_seconds=30"]) == \
+        {"small_mb": 256.0, "max_copy_seconds": 30.0}
+    with pytest.raises(ValueError):
+        staging.parse_settings(["stage_small_mb=256"])
+
+
+def test_move_verified_rename(tmp_path):
+    src = _write(tmp_path / "out.vcf", 100)
+    dst = str(tmp_path / "final" / "out.vcf")
+    assert staging.copy_file(src, dst, move=True, verify="size") == "rename"
+    assert not (tmp_path / "out.vcf").exists()
+    assert (tmp_path / "final" / "out.vcf").stat().st_size == 100
+
+
+def test_wait_removals(tmp_path):
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    _write(work_dir / "tmp.txt", 100)
+    staging.remove_async(str(work_dir))
+    staging.wait_removals()
+    assert not work_dir.exists()
+    assert staging._removals == []
+
+
+def test_copy_file_methods(tmp_path, monkeypatch):
+    src = _write(tmp_path / "in.bam", 5000)
+    dst = str(tmp_path / "staged" / "in.bam")
+    assert staging.copy_file(src, dst) in ["reflink", "copy_file_range", "copy"]
+    with open(dst, "rb") as in_handle:
+        assert in_handle.read() == b"x" * 5000
+    assert staging.is_current(src, dst)
+    assert staging.copy_file(src, dst) == "skip"
+    monkeypatch.setenv("BCBIO_VM_STAGE_HARDLINK", "1")
+    linked = str(tmp_path / "linked" / "in.bam")
+    assert staging.copy_file(src, linked) == "hardlink"
+    assert os.path.samefile(src, linked)
+    assert os.listdir(str(tmp_path / "linked")) == ["in.bam"]
+
+
+def test_copy_file_verify(tmp_path, monkeypatch):
+    src = _write(tmp_path / "out.vcf", 100)
+    dst = str(tmp_path / "final" / "out.vcf")
+    assert staging.copy_file(src, dst, verify="checksum") != "skip"
+    def _corrupt(src, dst):
+        with open(dst, "wb") as out_handle:
+            out_handle.write(b"y" * 100)
+        return "copy"
+    monkeypatch.setattr(staging, "_copy_data", _corrupt)
+    dst = str(tmp_path / "final" / "corrupt.vcf")
+    with pytest.raises(IOError):
+        staging.copy_file(src, dst, verify="checksum")
+    assert os.listdir(str(tmp_path / "final")) == ["out.vcf"]
+
+
+def test_copy_sparse_file(tmp_path, monkeypatch):
+    size = 64 * 1024 * 1024
+    src = str(tmp_path / "sparse.img")
+    with open(src, "wb") as out_handle:
+        out_handle.write(b"start")
+        out_handle.seek(size - 3)
+        out_handle.write(b"end")
+    with open(src, "rb") as in_handle:
+        regions = staging._data_regions(in_handle.fileno(), size)
+    if regions == [(0, size)]:
+        pytest.skip("Temporary filesystem does not report holes in sparse files")
+    assert regions[0][0] == 0 and regions[-1][1] == size
+    assert sum(end - start for start, end in regions) < size
+    # Avoid reflinks, which share blocks instead of copying data regions
+    monkeypatch.setattr(staging, "FICLONE", 0)
+    dst = str(tmp_path / "staged" / "sparse.img")
+    assert staging.copy_file(src, dst) in ["copy_file_range", "copy"]
+    assert os.path.getsize(dst) == size
+    assert os.stat(dst).st_blocks * 512 < size
+    with open(dst, "rb") as in_handle:
+        assert in_handle.read(5) == b"start"
+        in_handle.seek(size - 3)
+        assert in_handle.read() == b"end"
@@ -0,0 +1,68 @@
+"""Test supervising multiple runfn containers on a single machine.
+"""
+import threading
+import time
+
+import pytest
+
+from bcbiovm.docker import engine, manage, supervisor
+
+
+@pytest.fixture
+def node_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv("BCBIO_VM_NODE_DIR", str(tmp_path))
+
+
+@pytest.fixture
+def fake_runfn(monkeypatch, fake_engine):
+    """Replace runfn with a container that stays running briefly, tracking concurrency.
+    """
+    state = {"running": 0, "max": 0}
+    lock = threading.Lock()
+    def do_runfn(fn_name, fn_args, cmd_args, parallel, dockerconf):
+        cid = engine.create_container("quay.io/bcbio/bcbio-vc", ["true"], labels=manage._context.labels)
+        with lock:
+            state["running"] += 1
+            state["max"] = max(state["max"], state["running"])
+        try:
+            time.sleep(0.2)
+            if fn_args and fn_args[0] == "fail":
+                raise ValueError("Failed %s" % fn_name)
+        finally:
+            with lock:
+                state["running"] -= 1
+        engine.remove_container(cid)
+        return [fn_name] + fn_args
+    monkeypatch.setattr(supervisor.run, "do_runfn", do_runfn)
+    return state
+
+
+def _items(n, cores=1, fail=None):
+    return [["fn%s" % i, {}, {}, {"cores_per_job": cores}, "fail" if i == fail else "ok"]
+            for i in range(n)]
+
+
+def test_run_items_within_cores(node_dir, fake_runfn):
+    out = supervisor.run_items(_items(5), cores=2, memory=100, poll=0.05)
+    assert out == [["fn%s" % i, "ok"] for i in range(5)]
+    assert fake_runfn["max"] == 2
+
+
+def test_shared_node_capacity(node_dir, fake_runfn):
+    """Separate supervisors on a node share cores rather than each using the whole host.
+    """
+    outs = []
+    threads = [threading.Thread(target=lambda: outs.append(
+        supervisor.run_items(_items(3), cores=2, memory=100, poll=0.05))) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(outs) == 2
+    assert fake_runfn["max"] == 2
+
+
+def test_failure_removes_containers(node_dir, fake_runfn, fake_engine):
+    with pytest.raises(ValueError):
+        supervisor.run_items(_items(3, fail=0), cores=4, memory=100, poll=0.05)
+    assert fake_engine.containers == {}
@@ -0,0 +1,42 @@
+"""Test recording trace events, flushing them as processing runs.
+"""
+import json
+
+import pytest
+
+from bcbiovm.shared import trace
+
+
+@pytest.fixture
+def tracer(tmp_path, monkeypatch):
+    out_file = str(tmp_path / "traces" / "trace.json")
+    monkeypatch.setattr(trace, "_state", {"out_file": out_file, "events": [], "started": False})
+    monkeypatch.setattr(trace, "MAX_EVENTS", 5)
+    return out_file
+
+
+def test_flush_appends_events(tracer):
+    for i in range(3):
+        with trace.span("step", i=i):
+            pass
+    trace.flush()
+    assert trace._state["events"] == []
+    with trace.span("outer"):
+        with trace.span("inner"):
+            pass
+    trace.flush()
+    trace.write()
+    with open(tracer) as in_handle:
+        events = json.load(in_handle)
+    assert [e["name"] for e in events] == ["step", "step", "step", "inner", "outer"]
+    assert events[2]["args"] == {"i": "2"}
+
+
+def test_flush_caps_buffer(tracer):
+    for i in range(12):
+        with trace.span("step"):
+            pass
+        assert len(trace._state["events"]) < trace.MAX_EVENTS
+    trace.write()
+    with open(tracer) as in_handle:
+        assert len(json.load(in_handle)) == 12
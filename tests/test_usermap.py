@@ -0,0 +1,41 @@
+"""Test mounts for running containers as the mapped external user.
+"""
+import os
+import pwd
+
+import pytest
+
+from bcbiovm.docker import mounts, usermap
+
+
+@pytest.fixture
+def mapped(monkeypatch, tmp_path):
+    monkeypatch.setenv("BCBIO_VM_NODE_DIR", str(tmp_path / "node"))
+    monkeypatch.setenv("BCBIO_DOCKER_USER_MODE", "mapped")
+
+
+def _destinations(all_mounts):
+    return [os.path.normpath(m.split(":")[1]) for m in all_mounts]
+
+
+def test_runfn_mounts_mapped(mapped, tmp_path):
+    homedir = pwd.getpwuid(os.getuid()).pw_dir
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    dmounts = mounts.minimize(["%s:/mnt/work" % work_dir, "%s:%s" % (homedir, homedir)])
+    all_mounts = usermap.add_mounts(dmounts)
+    dests = _destinations(all_mounts)
+    assert len(dests) == len(set(dests))
+    assert "/etc/passwd" in dests and "/etc/group" in dests
+    assert dests.count(os.path.normpath(homedir)) == 1
+    assert "%s:%s" % (homedir, homedir) in all_mounts
+
+
+def test_mounts_mapped_without_home(mapped, tmp_path):
+    all_mounts = usermap.add_mounts(["%s:/mnt/work" % tmp_path])
+    dests = _destinations(all_mounts)
+    assert len(dests) == len(set(dests))
+    assert usermap.home_dir() in dests
+    passwd_file = [m for m in all_mounts if m.endswith(":/etc/passwd:ro")][0].split(":")[0]
+    with open(passwd_file) as in_handle:
+        assert ":%s:" % usermap.home_dir() in in_handle.read()